@@ -0,0 +1,63 @@
+import numpy as np
+from mesa.time import RandomActivation
+from constant_variables import Draw, Phase
+
+
+class AgentStreams:
+    """
+    Counter-based random streams (Philox) through which every draw of the simulation engines goes.
+
+    The draw of agent i for a purpose (see constant_variables.Draw) at step t is the i-th output of the Philox
+    generator keyed by the seed, with counter (0, t, purpose, 0). It only depends on (seed, step, purpose, agent),
+    not on the order of the draws nor on the process or the engine: a seed gives the same population and the same
+    per-agent draws to the mesa, vectorized and replicate batch engines, in the main process or in a worker.
+
+    Agents are identified by their stream id: citizens first (0..n_citizens - 1, in order of creation, which is the
+    order of their cell), then cops. Population draws use the flat index of the cell (x * height + y) at step 0.
+    """
+
+    def __init__(self, seed=None):
+        """
+        Create the streams of a simulation.
+        :param seed: random seed, a random key is drawn if None
+        """
+        self.key = np.random.SeedSequence().entropy if seed is None else int(seed) % 2 ** 128
+        self._cache_step = None
+        self._cache = {}
+
+    def uniforms(self, step, draw, size):
+        """
+        Uniform draws in [0, 1) of agents 0..size - 1 for a purpose at a step (read-only, arrays of the current step
+        are cached).
+        :param step: step of the simulation
+        :param draw: purpose of the draw (see constant_variables.Draw)
+        :param size: number of agents
+        """
+        if step != self._cache_step:
+            self._cache_step, self._cache = step, {}
+
+        values = self._cache.get(draw)
+        if values is None or len(values) < size:
+            generator = np.random.Generator(np.random.Philox(key=self.key, counter=[0, step, draw.value, 0]))
+            values = self._cache[draw] = generator.random(size)
+            values.flags.writeable = False
+        return values
+
+
+class StreamActivation(RandomActivation):
+    """
+    Random activation in the order of the ORDER draw of the agents (see AgentStreams), instead of a shuffle by the
+    mesa random generator.
+    """
+
+    def step(self):
+        profiler = self.model.profiler
+        start = profiler.clock()
+        order = self.model.get_uniforms(Draw.ORDER)
+        agents = sorted(self._agents.values(), key=lambda agent: order[agent.stream_id])
+        profiler.lap(Phase.SCHEDULE, start)
+        for agent in agents:
+            if agent.unique_id in self._agents:
+                agent.step()
+        self.steps += 1
+        self.time += 1
@@ -0,0 +1,146 @@
+import numpy as np
+from vision import von_neumann_offsets
+
+
+class ArrayGrid:
+    """
+    Torus grid holding at most one agent per cell, backed by an int32 array of agent ids (-1 for an empty cell).
+
+    Replaces mesa MultiGrid in the civil violence model: there are no lists per cell, and the von Neumann
+    neighborhood offsets are computed once per radius. The mesa accessors used by the model and by the web interface
+    (place_agent, move_agent, remove_agent, get_cell_list_contents, coord_iter, get_neighborhood, ...) are provided
+    with the same signatures.
+
+    A cop moves on the cell of the citizen it arrests only once the arrestee left the grid, so a cell never holds
+    two agents. Placing an agent on an occupied cell raises an exception.
+    """
+
+    def __init__(self, width, height, torus=True):
+        """
+        Create a new empty grid.
+        :param width: grid width
+        :param height: grid height
+        :param torus: must be True, the model space is a torus
+        """
+        if not torus:
+            raise ValueError("ArrayGrid is a torus, non-toroidal grids are not supported.")
+
+        self.width = width
+        self.height = height
+        self.torus = torus
+        self.cell_agent = np.full((width, height), -1, dtype=np.int32)  # unique_id of the agent of every cell
+        self.agents = {}  # unique_id -> agent placed in the grid
+        self._offsets = {}  # Von Neumann neighborhood offsets by radius
+
+    def clear(self):
+        """
+        Remove every agent (neighborhood offsets are kept).
+        """
+        self.cell_agent.fill(-1)
+        self.agents.clear()
+
+    def torus_adj(self, pos):
+        """
+        Convert coordinate, handling torus looping.
+        """
+        return pos[0] % self.width, pos[1] % self.height
+
+    def place_agent(self, agent, pos):
+        """
+        Position an agent on an empty cell and update its pos attribute.
+        """
+        x, y = self.torus_adj(pos)
+        if self.cell_agent[x, y] >= 0:
+            raise Exception("Cell ({}, {}) is not empty.".format(x, y))
+        self.cell_agent[x, y] = agent.unique_id
+        self.agents[agent.unique_id] = agent
+        agent.pos = (x, y)
+
+    def remove_agent(self, agent):
+        """
+        Remove an agent from the grid, its pos attribute is set to None.
+        """
+        self.cell_agent[agent.pos] = -1
+        del self.agents[agent.unique_id]
+        agent.pos = None
+
+    def move_agent(self, agent, pos):
+        """
+        Move an agent from its current cell to an empty cell.
+        """
+        x, y = self.torus_adj(pos)
+        if self.cell_agent[x, y] >= 0:
+            raise Exception("Cell ({}, {}) is not empty.".format(x, y))
+        self.cell_agent[agent.pos] = -1
+        self.cell_agent[x, y] = agent.unique_id
+        agent.pos = (x, y)
+
+    def is_cell_empty(self, pos):
+        return self.cell_agent[pos] < 0
+
+    @property
+    def empties(self):
+        """
+        Set of the empty cells (computed on request, the model draws empty cells from its vision counter).
+        """
+        xs, ys = np.nonzero(self.cell_agent < 0)
+        return set(zip(xs.tolist(), ys.tolist()))
+
+    def get_agents(self, xs, ys):
+        """
+        Agents of the cells (xs, ys), in the order of the cells, empty cells being skipped.
+        :param xs: array of x coordinates
+        :param ys: array of y coordinates
+        """
+        ids = self.cell_agent[xs, ys]
+        return [self.agents[i] for i in ids[ids >= 0].tolist()]
+
+    def get_cell_list_contents(self, cell_list):
+        """
+        Agents of a list of cells (mesa accessor).
+        :param cell_list: list of (x, y) coordinates, or a single (x, y) tuple
+        """
+        if isinstance(cell_list, tuple) and len(cell_list) == 2 and np.isscalar(cell_list[0]):
+            cell_list = [cell_list]
+        if not cell_list:
+            return []
+        xs, ys = zip(*cell_list)
+        return self.get_agents(list(xs), list(ys))
+
+    def iter_cell_list_contents(self, cell_list):
+        return iter(self.get_cell_list_contents(cell_list))
+
+    def coord_iter(self):
+        """
+        Iterate over the cells, column by column (mesa accessor).
+        :return: iterator of (list of agents of the cell, x, y)
+        """
+        for x in range(self.width):
+            for y in range(self.height):
+                agent_id = self.cell_agent[x, y]
+                yield ([self.agents[agent_id]] if agent_id >= 0 else []), x, y
+
+    def get_offsets(self, radius):
+        """
+        Von Neumann neighborhood offsets of a radius on the torus, center excluded (computed once per radius).
+        """
+        if radius not in self._offsets:
+            self._offsets[radius] = von_neumann_offsets(radius, self.width, self.height)
+        return self._offsets[radius]
+
+    def get_neighborhood(self, pos, moore=False, include_center=False, radius=1):
+        """
+        Cells of the von Neumann neighborhood of pos (mesa accessor, Moore neighborhoods are not used by the model).
+        :return: list of (x, y) coordinates
+        """
+        if moore:
+            raise ValueError("ArrayGrid only provides von Neumann neighborhoods.")
+        dx, dy = self.get_offsets(radius)
+        cells = list(zip(((pos[0] + dx) % self.width).tolist(), ((pos[1] + dy) % self.height).tolist()))
+        return [tuple(pos)] + cells if include_center else cells
+
+    def get_neighbors(self, pos, moore=False, include_center=False, radius=1):
+        """
+        Agents in the von Neumann neighborhood of pos (mesa accessor).
+        """
+        return self.get_cell_list_contents(self.get_neighborhood(pos, moore, include_center, radius))
@@ -0,0 +1,54 @@
+import json
+import numpy as np
+
+ALIGNMENT = 8
+
+
+def pack_arrays(arrays, meta):
+    """
+    Pack numpy arrays in a single binary buffer, sent back by multiprocessing workers instead of pickled objects.
+
+    Layout: 8 bytes (little endian) header length, JSON header ({'meta': meta, 'arrays': {name: shape, dtype and
+    offset}}), then the raw (C-contiguous) data of every array aligned on 8 bytes.
+    :param arrays: dictionary of numpy arrays (object dtype not supported)
+    :param meta: dictionary of JSON-serializable values
+    :return: bytes
+    """
+    layout = {}
+    offset = 0
+    for key, array in arrays.items():
+        if array.dtype.hasobject:
+            raise ValueError("Array {} of object dtype can't be packed.".format(key))
+        layout[key] = {'shape': list(array.shape), 'dtype': array.dtype.str, 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps({'meta': meta, 'arrays': layout}).encode()
+    start = -(-(8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    buffer = bytearray(start + offset)
+    buffer[:8] = len(header).to_bytes(8, 'little')
+    buffer[8:8 + len(header)] = header
+    for key, array in arrays.items():
+        begin = start + layout[key]['offset']
+        buffer[begin:begin + array.nbytes] = np.ascontiguousarray(array).tobytes()
+
+    return bytes(buffer)
+
+
+def unpack_arrays(buffer):
+    """
+    Read a buffer created by pack_arrays. Arrays are read-only views on the buffer (no copy).
+    :return: dictionary of numpy arrays and dictionary of meta values
+    """
+    size = int.from_bytes(buffer[:8], 'little')
+    description = json.loads(bytes(buffer[8:8 + size]).decode())
+    start = -(-(8 + size) // ALIGNMENT) * ALIGNMENT
+
+    arrays = {}
+    for key, layout in description['arrays'].items():
+        dtype = np.dtype(layout['dtype'])
+        count = int(np.prod(layout['shape'], dtype=np.int64))
+        arrays[key] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                    offset=start + layout['offset']).reshape(layout['shape'])
+
+    return arrays, description['meta']
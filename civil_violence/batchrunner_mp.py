@@ -1,7 +1,18 @@
+import time
+import numpy as np
+import pandas as pd
+from functools import partial
 from mesa.batchrunner import BatchRunner
 from multiprocessing import Pool, cpu_count
 from tqdm import tqdm
 from collections import OrderedDict
+from network_cache import configure_network_cache
+from shared_population import SharedPopulation, POPULATION_PARAMETERS
+from batch_results import pack_arrays, unpack_arrays
+from columnar_datacollector import ColumnarDataCollector
+from simulation_executor import get_model
+from task_scheduler import get_default_parameters, estimate_cost, schedule_tasks, run_chunk, \
+    utilisation_report, format_utilisation
 
 
 class BatchRunnerMP(BatchRunner):
@@ -14,9 +25,14 @@ class BatchRunnerMP(BatchRunner):
     Note: You must give function name instead of lambda in data collector argument. Lambda can't be handle by
     multiprocessing pool, however mesa can collect data from model by simply indicated the function name.
     With this method you do not need to update datacollector class to make multiprocessing run.
+
+    Workers don't send their data collector back: its arrays are packed in a binary buffer (see batch_results) and
+    the model time series of every run are copied, as they arrive, in a preallocated tensor model_series of shape
+    (runs, max_steps + 1, reporters), padded with NaN after the last step of the run (see run_lengths).
     """
 
-    def __init__(self, model_cls, nr_processes=None, **kwargs):
+    def __init__(self, model_cls, nr_processes=None, shared_population=False, executor=None, schedule=True,
+                 population_seeds=False, network_cache_dir=None, **kwargs):
         """Create a new BatchRunnerMP for a given model with the given
         parameters.
 
@@ -24,9 +40,25 @@ class BatchRunnerMP(BatchRunner):
         nr_processes: int
                       the number of separate processes the BatchRunner
                       should start, all running in parallel.
+        shared_population: If True, the population (agents static attributes and social network) is built once
+                      from the fixed parameters, placed in shared memory and used zero-copy by every worker.
+                      Replicates then only differ by their dynamics.
+        executor: SimulationExecutor whose workers (and model reuse option) are used instead of a new pool.
+                      The executor is not closed by run_all, so it can serve several batches.
+        schedule: If True, runs are ordered by estimated cost (longest first) and cheap runs are sent to the
+                      workers in chunks (see task_scheduler). Otherwise runs are sent one by one in parameter order.
+        population_seeds: If True, iteration i of every parameter combination uses population_seed i (unless the
+                      parameters set it): replicates keep their own population and dynamics, but a population (and
+                      its social network) is shared by the iteration across the sweep (see network_cache).
+        network_cache_dir: directory of the on-disk network cache shared by the workers, configured before the
+                      pool starts (see network_cache.configure_network_cache). With an executor, give it to the
+                      executor instead.
         kwargs: the kwargs required for the parent BatchRunner class
         """
-        if nr_processes is None:
+        self.executor = executor
+        if executor is not None:
+            self.processes = executor.processes
+        elif nr_processes is None:
             # identify the number of processors available on users machine
             available_processors = cpu_count()
             self.processes = available_processors
@@ -35,7 +67,38 @@ class BatchRunnerMP(BatchRunner):
             self.processes = nr_processes
 
         super().__init__(model_cls, **kwargs)
-        self.pool = Pool(self.processes)
+
+        self.shared_population = None
+        if shared_population:
+            self.share_population()
+
+        self.population_seeds = population_seeds
+        if network_cache_dir is not None and executor is None:
+            configure_network_cache(directory=network_cache_dir)  # Before the pool, workers inherit it
+        self.pool = executor.pool if executor is not None else Pool(self.processes)
+        self.reuse_models = executor is not None and executor.reuse_models
+        self.schedule = schedule
+        self.utilisation = None  # Utilisation report of the workers during the last run_all
+
+        self.run_keys = []  # Key (param values, iteration) of each run
+        self.run_lengths = None  # Number of collected steps of each run
+        self.series_names = []
+        self.series_dtypes = []
+        self.model_series = None
+        self.agent_series = {}  # Exported agent arrays of each run, if the model collects agent reporters
+
+    def share_population(self):
+        """
+        Build the population from the fixed parameters and place it in shared memory.
+        Models attach to it through their population parameter.
+        """
+        variable = [name for name in (self.parameters_list[0] if self.parameters_list else {})
+                    if name in POPULATION_PARAMETERS]
+        if variable:
+            raise ValueError("Population can't be shared when {} vary.".format(variable))
+
+        self.shared_population = SharedPopulation.from_model_parameters(**self.fixed_parameters)
+        self.fixed_parameters['population'] = self.shared_population.name
 
     def _make_model_args_mp(self):
         """Prepare all combinations of parameter values for `run_all`
@@ -47,14 +110,18 @@ class BatchRunnerMP(BatchRunner):
         total_iterations = self.iterations
         all_kwargs = []
 
-        count = len(self.parameters_list)
+        # Without variable parameters, the fixed parameters are run as a single combination
+        parameters_list = self.parameters_list or ([{}] if len(self.fixed_parameters) else [])
+        count = len(parameters_list)
         if count:
-            for params in self.parameters_list:
+            for params in parameters_list:
                 kwargs = params.copy()
                 kwargs.update(self.fixed_parameters)
                 # run each iterations specific number of times
                 for iter in range(self.iterations):
                     kwargs_repeated = kwargs.copy()
+                    if self.population_seeds:
+                        kwargs_repeated.setdefault('population_seed', iter)
                     all_kwargs.append(
                         [
                             self.model_cls,
@@ -62,15 +129,12 @@ class BatchRunnerMP(BatchRunner):
                             self.max_steps,
                             iter,
                             self.model_reporters,  # We add model_reporters and agent_reporters in order to by-pass
-                            self.agent_reporters  # the impossibility to transmit model in multi-processing pool
+                            self.agent_reporters,  # the impossibility to transmit model in multi-processing pool
+                            len(all_kwargs),  # Index of the run in the result tensors
+                            self.reuse_models
                         ]
                     )
 
-        elif len(self.fixed_parameters):
-            count = 1
-            kwargs = self.fixed_parameters.copy()
-            all_kwargs.append(kwargs)
-
         total_iterations *= count
 
         return all_kwargs, total_iterations
@@ -92,9 +156,13 @@ class BatchRunnerMP(BatchRunner):
             iter_args[1] = key word arguments needed for model object
             iter_args[2] = maximum number of steps for model
             iter_args[3] = number of time to run model for stochastic/random variation with same parameters
+            iter_args[6] = index of the run
+            iter_args[7] = reset the previous model of the worker instead of creating a new one
         :return:
+            index of the run
             tuple of param values which serves as a unique key for model results
-            model object
+            data collector arrays packed in a binary buffer
+            model and agent reporters values
         """
 
         model_i = iter_args[0]
@@ -103,9 +171,11 @@ class BatchRunnerMP(BatchRunner):
         iteration = iter_args[3]
         model_reporters = iter_args[4]  # Received in the arguments from _make_model_args_mp. By getting reporter values
         agent_reporters = iter_args[5]  # here, we don't need to pass model class in multi-processing pool
+        run_index = iter_args[6]
+        reuse = iter_args[7]
 
         # instantiate version of model with correct parameters
-        model = model_i(**kwargs)
+        model = get_model(model_i, kwargs, reuse)
         while model.running and model.schedule.steps < max_steps:
             model.step()
 
@@ -114,12 +184,12 @@ class BatchRunnerMP(BatchRunner):
 
         # convert kwargs dict to tuple to  make consistent
         param_values = tuple(kwargs.values())
-        data_collector = None
+        payload = None
         model_var = OrderedDict()
         agent_var = OrderedDict()
 
         if hasattr(model, "datacollector"):
-            data_collector = model.datacollector
+            payload = pack_arrays(*model.datacollector.export_arrays())
 
         if model_reporters:
 
@@ -134,50 +204,118 @@ class BatchRunnerMP(BatchRunner):
                 agent_var[agent.unique_id] = agent_record
 
         # Instead of transmitting the model (like in original BatchRunnerMP) which is not possible in multiprocessing
-        # pool, we obtain the necessary data (data_collector, model_var, agent_var) in upstream.
-        # Note: we should give a function name instead of a lambda to [data_collector, model_var, agent_var] since
+        # pool, we obtain the necessary data (payload, model_var, agent_var) in upstream.
+        # Note: we should give a function name instead of a lambda to [model_var, agent_var] since
         # lambda can't be handled by multiprocessing pool.
-        return param_values, data_collector, model_var, agent_var
+        return run_index, param_values, payload, model_var, agent_var
+
+    def _prepare_results(self, total_runs):
+        """
+        Reset the result containers for total_runs runs. The model series tensor is allocated with the first result
+        (reporters are only known once a model ran).
+        """
+        self.run_keys = [None] * total_runs
+        self.run_lengths = np.zeros(total_runs, dtype=np.int64)
+        self.model_series = None
+        self.agent_series = {}
 
-    def _result_prep_mp(self, results):
+    def _collect_result(self, run_index, model_key, payload, model_var, agent_var):
         """
         Helper Function
-        Takes results from Processpool and single processor debug run and fixes format to
-        make compatible with BatchRunner Output
+        Store the result of a run as soon as it is received, in a format compatible with BatchRunner Output.
 
         BatchRunnerMP bug handling method:
         Model object can't be transmitted through multiprocessing pool, upstream data processing enable us to solve
         this issue.
 
-        :param results: A tuple of datacollector, model_var and agent_var pre-processed data.
-        :updates model_vars and agents_vars so consistent across all batchrunner
-        """
-        # Take results and convert to dictionary so dataframe can be called
-        for model_key, (datacollector, model_var, agent_var) in results.items():
-            if self.model_reporters:
-                self.model_vars[model_key] = model_var  # Fix to original BatchRunnerMP
-
-            if self.agent_reporters:
-                agent_vars = agent_var
-                for agent_id, reports in agent_vars.items():
-                    agent_key = model_key + (agent_id,)
-                    self.agent_vars[agent_key] = reports  # Fix to original BatchRunnerMP
-
-            if datacollector is not None:
-                if datacollector.model_reporters is not None:
-                    self.datacollector_model_reporters[
-                        model_key
-                    ] = datacollector.get_model_vars_dataframe()
-                if datacollector.agent_reporters is not None:
-                    self.datacollector_agent_reporters[
-                        model_key
-                    ] = datacollector.get_agent_vars_dataframe()
-
-        # Make results consistent
-        if len(self.datacollector_model_reporters.keys()) == 0:
-            self.datacollector_model_reporters = None
-        if len(self.datacollector_agent_reporters.keys()) == 0:
-            self.datacollector_agent_reporters = None
+        :param run_index: index of the run
+        :param model_key: tuple of param values and iteration
+        :param payload: data collector arrays packed in a binary buffer
+        :param model_var: model reporters values
+        :param agent_var: agent reporters values
+        """
+        self.run_keys[run_index] = model_key
+
+        if self.model_reporters:
+            self.model_vars[model_key] = model_var  # Fix to original BatchRunnerMP
+
+        if self.agent_reporters:
+            for agent_id, reports in agent_var.items():
+                agent_key = model_key + (agent_id,)
+                self.agent_vars[agent_key] = reports  # Fix to original BatchRunnerMP
+
+        if payload is None:
+            return
+
+        arrays, meta = unpack_arrays(payload)
+        series = [arrays['model/' + name] for name in meta['model_reporters']]
+        # Runs stopped in a steady state are padded until max_iter by the model, the batch stops at max_steps
+        n_steps = min(len(series[0]) if series else 0, self.max_steps + 1)
+
+        if self.model_series is None:
+            self.series_names = meta['model_reporters']
+            self.series_dtypes = [values.dtype for values in series]
+            self.model_series = np.full((len(self.run_keys), self.max_steps + 1, len(series)), np.nan)
+        # A reporter can be integer in a run and float in another one (see ColumnarDataCollector.promote)
+        self.series_dtypes = [np.result_type(dtype, values.dtype) for dtype, values in zip(self.series_dtypes, series)]
+        if n_steps > self.model_series.shape[1]:
+            padding = n_steps - self.model_series.shape[1]
+            self.model_series = np.pad(self.model_series, ((0, 0), (0, padding), (0, 0)), constant_values=np.nan)
+
+        for j, values in enumerate(series):
+            self.model_series[run_index, :n_steps, j] = values[:n_steps]
+        self.run_lengths[run_index] = n_steps
+
+        if meta['agent_reporters']:
+            self.agent_series[model_key] = (arrays, meta)
+
+    def get_collector_model(self):
+        """
+        Data collector model series of every run, rebuilt from the model series tensor.
+        :return: dict {(Param1, Param2,...,iteration): <DataCollector Pandas DataFrame>}
+        """
+        if self.model_series is None:
+            return None
+
+        return {key: pd.DataFrame(series) for key, series in self.iter_collector_model()}
+
+    def iter_collector_model(self):
+        """
+        Iterate over the model series of every run (arrays of the reporters dtype), e.g. to write them to a series
+        file (see series_store.SeriesWriter) without building dataframes.
+        :return: iterator of ((Param1, Param2,...,iteration), dictionary of series)
+        """
+        if self.model_series is None:
+            return
+
+        for i, key in enumerate(self.run_keys):
+            if key is not None:
+                yield key, {name: self.model_series[i, :self.run_lengths[i], j].astype(dtype)
+                            for j, (name, dtype) in enumerate(zip(self.series_names, self.series_dtypes))}
+
+    def get_collector_agents(self):
+        """
+        Data collector agent series of every run (only if the model collects agent reporters).
+        :return: dict {(Param1, Param2,...,iteration): <DataCollector Pandas DataFrame>}
+        """
+        if not self.agent_series:
+            return None
+
+        return {key: ColumnarDataCollector.from_arrays(arrays, meta).get_agent_vars_dataframe()
+                for key, (arrays, meta) in self.agent_series.items()}
+
+    def _make_chunks(self, run_iter_args):
+        """
+        Group the runs in chunks sent to the workers.
+        With schedule, runs are ordered by estimated cost, longest first, and cheap runs are batched.
+        :return: list of lists of run arguments
+        """
+        if not self.schedule:
+            return [[args] for args in run_iter_args]
+
+        defaults = get_default_parameters(self.model_cls)
+        costs = [estimate_cost(args[1], args[2], defaults) for args in run_iter_args]
+        return [[run_iter_args[index] for index in chunk] for chunk in schedule_tasks(costs, self.processes)]
 
     def run_all(self):
         """
@@ -186,30 +324,43 @@ class BatchRunnerMP(BatchRunner):
         """
 
         run_iter_args, total_iterations = self._make_model_args_mp()
-        # register the process pool and init a queue
-        # store results in ordered dictionary
-        results = {}
+        self._prepare_results(len(run_iter_args))
+
+        chunks = self._make_chunks(run_iter_args)
+        timings = []
+        start = time.time()
 
         if self.processes > 1:
-            with tqdm(total_iterations, disable=not self.display_progress) as pbar:
-                # (data_collector, model_var, agent_var) replace model variable which can't be transmitted
-                for params, data_collector, model_var, agent_var in self.pool.imap_unordered(
-                        self._run_wrappermp, run_iter_args
-                ):
-                    results[params] = (data_collector, model_var, agent_var)
-                    pbar.update()
-
-                self._result_prep_mp(results)
+            with tqdm(total=total_iterations, disable=not self.display_progress) as pbar:
+                # (payload, model_var, agent_var) replace model variable which can't be transmitted
+                for results in self.pool.imap_unordered(partial(run_chunk, self._run_wrappermp), chunks):
+                    for result, timing in results:
+                        self._collect_result(*result)
+                        timings.append(timing)
+                        pbar.update()
         # For debugging model due to difficulty of getting errors during multiprocessing
         else:
-            for run in run_iter_args:
-                params, data_collector, model_var, agent_var = self._run_wrappermp(run)
-                results[params] = (data_collector, model_var, agent_var)
-
-            self._result_prep_mp(results)
-
-        # Close multi-processing
-        self.pool.close()
+            for chunk in chunks:
+                for result, timing in run_chunk(self._run_wrappermp, chunk):
+                    self._collect_result(*result)
+                    timings.append(timing)
+
+        self.utilisation = utilisation_report(timings, self.processes, start, time.time())
+        if self.display_progress:
+            print(format_utilisation(self.utilisation))
+
+        # Close multi-processing (an executor is closed by its owner)
+        if self.executor is None:
+            self.pool.close()
+
+        if self.shared_population is not None:
+            if self.executor is None:
+                self.pool.join()
+            self.shared_population.unlink()
+            self.shared_population = None
+
+        self.datacollector_model_reporters = self.get_collector_model()
+        self.datacollector_agent_reporters = self.get_collector_agents()
 
         return (
             getattr(self, "model_vars", None),
@@ -0,0 +1,273 @@
+import sys
+import json
+import time
+import platform
+import numpy as np
+import mesa
+import network_cache
+from multiprocessing import cpu_count
+from batchrunner_mp import BatchRunnerMP
+from constant_variables import Engine, GraphType, Collection
+from engines import get_model_class
+from utils import *
+
+GRID_SIZES = [40, 100, 200]
+DENSITIES = [(0.5, 0.02), (0.7, 0.04)]  # (agent_density, cop_density)
+VISION_RADII = [3, 7]
+GRAPH_TYPES = ['None'] + [graph_type.name for graph_type in GraphType]
+COLLECTIONS = [Collection.MODEL_ONLY.name, Collection.FULL.name]  # Data collection of the step cases
+REGRESSION_TOLERANCE = 0.2  # Relative slowdown of a case reported by compare_results
+
+
+def count_agents(model):
+    """
+    Number of agents (citizens and cops) of a model, for both engines.
+    """
+    if hasattr(model, 'n_streams'):
+        return model.n_streams
+    return model.n_citizens + model.n_cops
+
+
+def get_case_parameters(size, graph_type='None', agent_density=0.7, cop_density=0.04, vision=7, max_iter=200,
+                        agent_collection=Collection.MODEL_ONLY.name):
+    """
+    Model parameters of a benchmark case, defaults of the configuration files otherwise.
+    Networks keep the mean degree they have on the 40x40 grid (p is scaled by the number of citizens), so that large
+    grids measure the cost of the model rather than of a quadratic number of edges.
+    :param size: width and height of the grid
+    :param graph_type: social network (see constant_variables.GraphType), 'None' for no network
+    :param vision: vision radius of citizens and cops
+    :param agent_collection: collection policy of the agent reporters (see constant_variables.Collection)
+    """
+    return {'width': size, 'height': size, 'max_iter': max_iter, 'graph_type': graph_type,
+            'agent_density': agent_density, 'cop_density': cop_density, 'active_agent_density': 0.01,
+            'agent_vision': vision, 'cop_vision': vision, 'p': 0.1 * (40 / size) ** 2, 'inf_threshold': 150,
+            'agent_collection': agent_collection}
+
+
+def summarize(durations):
+    """
+    Statistics (seconds) of repeated timings.
+    """
+    durations = np.asarray(durations, dtype=float)
+    return {'repeats': len(durations), 'mean': float(durations.mean()), 'min': float(durations.min()),
+            'std': float(durations.std())}
+
+
+def time_construction(engine, params, repeats=3):
+    """
+    Time the creation of a model (population, social network and initial collection).
+    The network cache is emptied before each creation and every repeat uses its own seed.
+    :return: benchmark record
+    """
+    model_cls = get_model_class(engine)
+    durations = []
+    for seed in range(repeats):
+        network_cache.network_cache.clear()
+        start = time.perf_counter()
+        model = model_cls(**params, seed=seed)
+        durations.append(time.perf_counter() - start)
+
+    return {'engine': engine, 'params': params, 'agents': count_agents(model), 'seconds': summarize(durations)}
+
+
+def time_steps(engine, params, steps=20, seed=0, profile=False):
+    """
+    Time the steps of a model, the time spent in the data collector being reported apart.
+    :param steps: number of steps timed (after construction)
+    :param profile: also report the timings per phase of the steps (MESA engine, see profiling.PhaseProfiler)
+    :return: benchmark record with steps/sec and agents·steps/sec (data collection included), and the number of
+        agent reporters collected (none with the vectorized engines, whatever the collection policy)
+    """
+    model = get_model_class(engine)(**params, seed=seed, **({'profile': True} if profile else {}))
+    agents = count_agents(model)
+
+    collector = model.datacollector
+    collect = collector.collect
+    collect_durations = []
+
+    def timed_collect(m):
+        start = time.perf_counter()
+        collect(m)
+        collect_durations.append(time.perf_counter() - start)
+
+    collector.collect = timed_collect  # Instance attribute, the collector class is left untouched
+
+    durations = []
+    for _ in range(steps):
+        if not model.running:
+            break
+        start = time.perf_counter()
+        model.step()
+        durations.append(time.perf_counter() - start)
+
+    total = sum(durations)
+    record = {'engine': engine, 'params': params, 'agents': agents, 'agent_reporters': len(collector.agent_reporters),
+              'steps': len(durations),
+              'step_seconds': summarize(durations), 'collect_seconds': summarize(collect_durations),
+              'collect_fraction': sum(collect_durations) / total,
+              'steps_per_sec': len(durations) / total, 'agent_steps_per_sec': agents * len(durations) / total}
+    if profile:
+        record['phases'] = compute_profile(model)
+    return record
+
+
+def time_batch(engine, params, runs=4, steps=20, nr_processes=None):
+    """
+    Time a BatchRunnerMP batch end to end (pool start, runs and collection of the results in the parent).
+    :param runs: number of runs (iterations of the fixed parameters)
+    :param steps: number of steps of each run
+    :param nr_processes: number of workers, all the CPUs if None
+    :return: benchmark record with runs/sec, steps/sec and agents·steps/sec
+    """
+    start = time.perf_counter()
+    batch = BatchRunnerMP(get_model_class(engine),
+                          nr_processes=nr_processes,
+                          max_steps=steps,
+                          iterations=runs,
+                          fixed_parameters=dict(params, seed=None),
+                          model_reporters={"ACTIVE": compute_active},
+                          display_progress=False)
+    batch.run_all()
+    duration = time.perf_counter() - start
+
+    agents = count_agents(get_model_class(engine)(**params, seed=0))  # Runs are unseeded, about the same number
+    total_steps = int(batch.run_lengths.sum() - runs)  # Initial collection of each run is not a step
+    return {'engine': engine, 'params': params, 'processes': batch.processes, 'runs': runs, 'agents': agents,
+            'seconds': duration, 'runs_per_sec': runs / duration, 'steps_per_sec': total_steps / duration,
+            'agent_steps_per_sec': agents * total_steps / duration}
+
+
+def run_benchmarks(engines=(Engine.MESA.name, Engine.VECTORIZED.name), sizes=GRID_SIZES, steps=20, repeats=3,
+                   batch_runs=4, nr_processes=None):
+    """
+    Benchmark suite of the civil violence model:
+    - construction of a model per graph type (40x40 grid) and per grid size (no network),
+    - steps and data collection per grid size, densities and vision radius (no network, model reporters only),
+    - steps per grid size, graph type and data collection (model reporters only or every agent reporter at every
+      step), so that the contagion through the network and the agent reporters are measured,
+    - BatchRunnerMP throughput per grid size.
+    :param engines: simulation backends benchmarked (see constant_variables.Engine)
+    :param sizes: width and height of the grids
+    :param steps: number of steps timed per case
+    :param repeats: number of constructions timed per case
+    :param batch_runs: number of runs of each batch
+    :param nr_processes: number of workers of the batches, all the CPUs if None
+    :return: results (dictionary, JSON serializable)
+    """
+    results = {'meta': get_environment(), 'construction': [], 'step': [], 'batch': []}
+
+    for engine in engines:
+        for graph_type in GRAPH_TYPES:
+            results['construction'].append(time_construction(engine, get_case_parameters(40, graph_type), repeats))
+        for size in sizes:
+            if size != 40:
+                results['construction'].append(time_construction(engine, get_case_parameters(size), repeats))
+
+        for size in sizes:
+            for agent_density, cop_density in DENSITIES:
+                for vision in VISION_RADII:
+                    params = get_case_parameters(size, agent_density=agent_density, cop_density=cop_density,
+                                                 vision=vision)
+                    results['step'].append(time_steps(engine, params, steps))
+
+        for size in sizes:
+            for graph_type in GRAPH_TYPES:
+                for agent_collection in COLLECTIONS:
+                    if graph_type == 'None' and agent_collection == Collection.MODEL_ONLY.name:
+                        continue  # Default case of the densities and vision radii above
+                    params = get_case_parameters(size, graph_type, agent_collection=agent_collection)
+                    results['step'].append(time_steps(engine, params, steps))
+
+        for size in sizes:
+            results['batch'].append(time_batch(engine, get_case_parameters(size), batch_runs, steps, nr_processes))
+
+    return results
+
+
+def get_environment():
+    """
+    Description of the machine and of the library versions, stored with the results.
+    """
+    return {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': cpu_count(),
+            'numpy': np.__version__, 'mesa': mesa.__version__}
+
+
+def get_case_key(suite, record):
+    """
+    Key identifying a benchmark case across result files.
+    """
+    return (suite, record['engine']) + tuple(sorted((name, str(value)) for name, value in record['params'].items()))
+
+
+def get_throughput(suite, record):
+    """
+    Throughput of a case (higher is faster).
+    """
+    if suite == 'construction':
+        return 1. / record['seconds']['min']
+    return record['agent_steps_per_sec']
+
+
+def compare_results(baseline, results, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare benchmark results with a baseline run on the same machine.
+    :param baseline: results of a previous run (see run_benchmarks)
+    :param results: new results
+    :param tolerance: relative slowdown tolerated
+    :return: list of (suite, engine, params, ratio) of the cases slower than the baseline, ratio being the new
+        throughput over the baseline one
+    """
+    reference = {get_case_key(suite, record): get_throughput(suite, record)
+                 for suite in ['construction', 'step', 'batch'] for record in baseline.get(suite, [])}
+
+    regressions = []
+    for suite in ['construction', 'step', 'batch']:
+        for record in results.get(suite, []):
+            key = get_case_key(suite, record)
+            if key not in reference:
+                continue
+            ratio = get_throughput(suite, record) / reference[key]
+            if ratio < 1 - tolerance:
+                regressions.append((suite, record['engine'], record['params'], ratio))
+
+    return regressions
+
+
+def benchmark_main(path=None, baseline_path=None, quick=False):
+    """
+    Run the benchmark suite and save its results in JSON.
+    :param path: output file, new timestamped file in archives if None
+    :param baseline_path: results to compare with, regressions are printed
+    :param quick: only benchmark the 40x40 grid
+    """
+    sizes = [40] if quick else GRID_SIZES
+    results = run_benchmarks(sizes=sizes)
+
+    if path is None:
+        path = 'archives/benchmark_{0}.json'.format(int(time.time()))
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Benchmark results saved in file {:s}".format(path))
+
+    for record in results['step']:
+        print("{:<10s} {:>3d}x{:<3d} density {:.2f} vision {:d} graph {:<15s} {:<10s}: {:10.0f} agents.steps/s "
+              "({:.0%} collection)".format(
+                record['engine'], record['params']['width'], record['params']['height'],
+                record['params']['agent_density'], record['params']['agent_vision'], record['params']['graph_type'],
+                record['params']['agent_collection'], record['agent_steps_per_sec'], record['collect_fraction']))
+
+    if baseline_path is not None:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        for suite, engine, params, ratio in compare_results(baseline, results):
+            print("Regression {} {} {}x{} (graph {}): {:.0%} of the baseline throughput".format(
+                suite, engine, params['width'], params['height'], params['graph_type'], ratio))
+
+    return results
+
+
+if __name__ == '__main__':
+    # python benchmark.py [output.json] [baseline.json]
+    benchmark_main(*sys.argv[1:3])
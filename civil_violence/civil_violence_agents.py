@@ -1,13 +1,59 @@
-import random
 import math
-from mesa import Agent
-from constant_variables import State, HardshipConst
+from constant_variables import State, HardshipConst, Draw, Phase, STATES, QUIESCENT_CODE, ACTIVE_CODE, COP_CODE
 
 
-class Citizen(Agent):
+class SlottedAgent:
+    """
+    Base class of the agents, with the attributes and methods of mesa Agent used by the schedulers and the grid.
+    Agents declare their attributes in __slots__: they have no instance dictionary, which reduces the memory per
+    agent and speeds up attribute lookups on large populations.
+
+    The state is stored as an integer code (state_code, see constant_variables.State values), the state property
+    converts it from and to State members for the model reporters and the web interface.
+    """
+    __slots__ = ('unique_id', 'model', 'pos', 'stream_id', 'state_code')
+
+    def __init__(self, unique_id, model):
+        self.unique_id = unique_id
+        self.model = model
+        self.pos = None
+        self.stream_id = 0  # Set by the model once every agent is created (see AgentStreams)
+
+    @property
+    def state(self):
+        return STATES[self.state_code]
+
+    @state.setter
+    def state(self, state):
+        self.state_code = state.value
+
+    @property
+    def random(self):
+        return self.model.random
+
+    def step(self):
+        pass
+
+    def advance(self):
+        pass
+
+    def get_move_target(self, empty_cells):
+        """
+        Pick the cell the agent moves to among the empty cells of its vision (MOVE draw of the agent).
+        :return: (x, y) coordinates, None if there is no empty cell
+        """
+        if not empty_cells:
+            return None
+        return empty_cells[int(self.model.get_uniforms(Draw.MOVE)[self.stream_id] * len(empty_cells))]
+
+
+class Citizen(SlottedAgent):
     """
     A citizen agent, part of the population.
     """
+    __slots__ = ('network_node', 'hardship', 'hardship_endo', 'hardship_cont', 'susceptibility', 'influence',
+                 'expression_intensity', 'legitimacy', 'risk_aversion', 'threshold', 'vision', 'jail_sentence',
+                 'grievance', 'jailable', 'influencer')
 
     def __init__(self, unique_id, model, pos, hardship, susceptibility, influence, expression_intensity, 
         legitimacy, risk_aversion, threshold, vision, jailable=True):
@@ -33,16 +79,14 @@ class Citizen(Agent):
         hardship_endo: endogenous hardship
         hardship_cont: contagious hardship
         network_node : agent's node_id in the graph representing the social network
-        state: current state of the agent (default: Quiescent)
+        state_code: integer code of the current state of the agent (default: Quiescent), see state property
         jail_sentence: current jail sentence of the agent (default: 0)
-        neighbors: List of neighbors in agent vision
-        empty_cells: List of empty cells in agent vision
+        network_neighbors: neighbors in the social network (read from the model social network on request)
         """
 
         super().__init__(unique_id, model)
-        random.seed(model.seed)
 
-        self.pos = pos  # Position in MultiGrid space
+        self.pos = pos  # Position in the grid
         self.network_node = 0  # Position in graph
 
         self.hardship = hardship  # Set equal to U(0, 1) for initialization
@@ -61,53 +105,82 @@ class Citizen(Agent):
         self.jailable = jailable
         self.influencer = False
 
-        self.network_neighbors = []  # Neighbors in social network
-        self.neighbors = []  # Neighbors in MultiGrid space
-        self.empty_cells = []  # Empty cells around the agent in MultiGrid space
-
-        self.state = State.ACTIVE if threshold == 0 else State.QUIESCENT
+        self.state_code = ACTIVE_CODE if threshold == 0 else QUIESCENT_CODE
 
     def step(self):
         """
         Citizen agent rules (Epstein 2002 model)
         """
 
+        profiler = self.model.profiler
+        start = profiler.clock()
+
         # Jailed agent can't perform any action
-        # After sentence resets state and contagious hardship
         if self.jail_sentence:
-            self.jail_sentence -= 1
-
-            if self.jail_sentence == 0:
-                self.state = State.QUIESCENT  # Jailed agent returns quiescent
-                self.hardship_cont = 0
-                self.model.add_jailed(self)
+            self.serve_sentence()
+            profiler.lap(Phase.RELEASE, start)
             return
 
-        self.hardship = self.update_hardship()
-        self.get_network_neighbors()
-        self.update_neighbors()  # Should we run this at each turn instead of retrieving the neighbors when necessary ?
+        self.update_grievance()
+        start = profiler.lap(Phase.CONTAGION, start)
+        # Empty cells are read before the decision, the state change of the agent doesn't modify them
+        empty_cells = self.get_empty_cells() if self.model.movement else None
+        start = profiler.lap(Phase.NEIGHBORHOOD, start)
 
-        self.grievance = self.get_grievance()
-        rule_a = self.grievance - self.get_net_risk() > self.threshold
-        if self.state is State.QUIESCENT and rule_a:
-            self.state = State.ACTIVE
-        elif self.state is State.ACTIVE and not rule_a:
-            self.state = State.QUIESCENT
+        self.set_state(self.decide())
+        start = profiler.lap(Phase.DECISION, start)
 
         # Move agent in the 2D Grid
-        if self.model.movement and self.empty_cells:
-            new_pos = random.choice(self.empty_cells)
-            self.model.grid.move_agent(self, new_pos)
+        new_pos = self.get_move_target(empty_cells)
+        if new_pos is not None:
+            self.model.move_agent(self, new_pos)
+        profiler.lap(Phase.MOVEMENT, start)
+
+    def serve_sentence(self):
+        """
+        One step of jail. After sentence resets state and contagious hardship, and the agent is placed back in the
+        grid.
+        """
+        self.jail_sentence -= 1
+
+        if self.jail_sentence == 0:
+            self.model.update_state(self, State.QUIESCENT)  # Jailed agent returns quiescent
+            self.hardship_cont = 0
+            self.model.add_jailed(self)
 
-    def update_neighbors(self):
+    def update_grievance(self):
         """
-        Keep track of neighbours and empty surrounding cells.
+        Update the perceived hardship (contagious hardship received from the social network) and the grievance.
         """
+        self.hardship = self.update_hardship()
+        self.grievance = self.get_grievance()
+
+    def decide(self):
+        """
+        Activation rule A (Epstein 2002 model), from the grievance and the cops and active citizens in vision.
+        The state of the agent is not modified.
+        :return: code of the next state of the agent
+        """
+        rule_a = self.grievance - self.get_net_risk() > self.threshold
+        if self.state_code == QUIESCENT_CODE and rule_a:
+            return ACTIVE_CODE
+        if self.state_code == ACTIVE_CODE and not rule_a:
+            return QUIESCENT_CODE
+        return self.state_code
+
+    def set_state(self, state_code):
+        """
+        Change the state of the agent through the model (state counters, vision counter and social network).
+        """
+        if state_code != self.state_code:
+            self.model.update_state(self, STATES[state_code])
 
-        # Moore = False because we check N/S/E/W
-        neighborhood = self.model.grid.get_neighborhood(self.pos, moore=False, radius=self.vision)
-        self.neighbors = self.model.grid.get_cell_list_contents(neighborhood)
-        self.empty_cells = [c for c in neighborhood if self.model.grid.is_cell_empty(c)]
+    def get_empty_cells(self):
+        """
+        Empty cells in the vision of the agent, in the order of the vision diamond (see VisionCounter).
+        Cops and active citizens in vision are counted by the model vision counter, no neighbor scan is needed.
+        """
+        return self.model.vision_counter.get_empty_cells(self.pos, self.vision)
 
     def get_arrest_probability(self):
         """
@@ -117,8 +190,8 @@ class Citizen(Agent):
 
         :return: 1 - exp(-k * C_v / int(A_v + 1))
         """
-        c_v = sum(isinstance(n, Cop) for n in self.neighbors)
-        a_v = sum(isinstance(n, Citizen) and n.state is State.ACTIVE for n in self.neighbors)
+        c_v = self.model.vision_counter.count_cops(self.pos, self.vision)
+        a_v = self.model.vision_counter.count_actives(self.pos, self.vision)
         cop_to_agent_ratio = int(c_v / (a_v + 1))  # This modification is suggested to get active agent more easily
         return 1 - math.exp(-1 * self.model.k * cop_to_agent_ratio)  # Rounding to min integer
 
@@ -165,6 +238,8 @@ class Citizen(Agent):
         project, but removing it will increase the received hardship.
         Timestep, or delta_time, can also be considered fixed in this discrete time model.
         Distance is a parameter that is more or less incorporated in NetworkX, so perhaps set this fixed as well.
+        The sum of influence * expression_intensity of active network neighbors is maintained by the model
+        social network (see NetworkCSR).
         :param hardship_params: default values
         """
         # Fixed values for parameters
@@ -173,13 +248,8 @@ class Citizen(Agent):
         transmission_rate = hardship_params.TRANSMISSION_RATE.value
         hardship = hardship_params.HARDSHIP.value
 
-        for n in self.model.G.neighbors(self.network_node):  # Network neighbors
-            agent = self.model.network_dict[n]  # Get agent at the neighbor node
-            if agent.state == State.ACTIVE:  # If the agent is active state
-                hardship += (distance * timestep * transmission_rate * 
-                    agent.influence * agent.expression_intensity * self.susceptibility)
-
-        return hardship
+        received = self.model.network_csr.received[self.network_node]  # Active network neighbors emission
+        return hardship + distance * timestep * transmission_rate * received * self.susceptibility
 
     def set_influencer(self, connections, threshold):
         """
@@ -190,18 +260,26 @@ class Citizen(Agent):
         else: 
             self.influencer = False
 
-    def get_network_neighbors(self):
+    @property
+    def network_neighbors(self):
         """
-        Retrieve neighbors to this agent in the social network.
+        Neighbors of this agent in the social network.
         """
-
-        self.network_neighbors = (list(self.model.G.neighbors(self.network_node)))
+        return self.model.network_csr.neighbors(self.network_node)
 
 
-class Cop(Agent):
+class Cop(SlottedAgent):
     """
     Create a new law enforcement officer agent.
     """
+    __slots__ = ('vision',)
+
+    # Data collector fix: citizen attributes reported as missing values for cops
+    hardship = None
+    grievance = None
+    influencer = None
+    network_neighbors = None
+    influence = None
 
     def __init__(self, unique_id, model, pos, vision):
         """
@@ -213,61 +291,73 @@ class Cop(Agent):
         """
 
         super().__init__(unique_id, model)
-        self.unique_id = unique_id
-        self.model = model
         self.pos = pos
         self.vision = vision
-        self.state = State.COP
-
-        # Data collector fix
-        self.hardship = None
-        self.grievance = None
-        self.influencer = None
-        self.network_neighbors = None
-        self.influence = None
-
-        self.neighbors = []  # Neighbors in MultiGrid space
-        self.empty_cells = []  # Empty cells around the agent in MultiGrid space
+        self.state_code = COP_CODE
 
     def step(self):
         """
         Inspect vision and arrest a random agent. Move there
         """
-        self.update_neighbors()
-        active_neighbors = []
-        
-        # Check for all active neighbors in vision
-        for agent in self.neighbors:
-            if type(agent).__name__.upper() == 'CITIZEN' \
-                    and agent.state is State.ACTIVE \
-                    and agent.jail_sentence == 0 \
-                    and agent.jailable:
-                active_neighbors.append(agent)
+        profiler = self.model.profiler
+        start = profiler.clock()
+        arrestee = self.choose_arrestee()
+        start = profiler.lap(Phase.NEIGHBORHOOD, start)
 
         # If there are any active arrest one randomly and move there
-        if active_neighbors:
-            arrestee = random.choice(active_neighbors)
-            sentence = random.randint(1, self.model.max_jail_term)
-            arrestee.jail_sentence = sentence
-            arrestee.state = State.JAILED
+        new_pos = None
+        if arrestee is not None:
             new_pos = arrestee.pos
-            self.model.jailings_list[0] += 1
+            self.arrest(arrestee)
+        start = profiler.lap(Phase.ARREST, start)
+
+        if self.model.movement:
+            # No active citizens, move to random empty cell
+            if new_pos is None:
+                new_pos = self.get_move_target(self.get_empty_cells())
+            if new_pos is not None:
+                self.model.move_agent(self, new_pos)
+        profiler.lap(Phase.MOVEMENT, start)
+
+    def choose_arrestee(self):
+        """
+        Pick a random active citizen in vision (ARREST draw of the cop).
+        :return: citizen, None if there is no active citizen in vision
+        """
+        active_neighbors = self.get_active_neighbors()
+        if not active_neighbors:
+            return None
+        return active_neighbors[int(self.model.get_uniforms(Draw.ARREST)[self.stream_id] * len(active_neighbors))]
 
-            if sentence > 0:
-                self.model.remove_agent_grid(arrestee)
-            if self.model.movement:
-                self.model.grid.move_agent(self, new_pos)
+    def arrest(self, arrestee):
+        """
+        Jail a citizen (SENTENCE draw of the citizen) and remove it from the grid.
+        """
+        sentence = 1 + int(self.model.get_uniforms(Draw.SENTENCE)[arrestee.stream_id] * self.model.max_jail_term)
+        arrestee.jail_sentence = sentence
+        self.model.update_state(arrestee, State.JAILED)
+        self.model.jailings_list[0] += 1
+
+        if sentence > 0:
+            self.model.remove_agent_grid(arrestee)
+
+    def get_active_neighbors(self):
+        """
+        Active citizens in vision which can be arrested.
+        Neighbors are only retrieved when the vision counter reports active citizens in vision.
+        """
+        vision_counter = self.model.vision_counter
+        if not vision_counter.count_actives(self.pos, self.vision):
+            return []
 
-        # No active citizens, move to random empty cell
-        elif self.model.movement and self.empty_cells:
-            new_pos = random.choice(self.empty_cells)
-            self.model.grid.move_agent(self, new_pos)
+        # Only the cells of active citizens are read, in the order of the vision diamond (see VisionCounter)
+        xs, ys = vision_counter.get_diamond(self.pos, self.vision)
+        active = vision_counter.actives[xs, ys] > 0
+        return [agent for agent in self.model.grid.get_agents(xs[active], ys[active])
+                if agent.state_code == ACTIVE_CODE and agent.jail_sentence == 0 and agent.jailable]
 
-    def update_neighbors(self):
+    def get_empty_cells(self):
         """
-        Create a list of neighbors & empty neighbor cells
+        Empty cells in the vision of the cop, in the order of the vision diamond (see VisionCounter).
         """
-        # Moore = False because we check N/S/E/W
-        neighborhood = self.model.grid.get_neighborhood(self.pos, moore=False, radius=self.vision)
-        self.neighbors = self.model.grid.get_cell_list_contents(neighborhood)
-        self.empty_cells = [c for c in neighborhood if self.model.grid.is_cell_empty(c)]
+        return self.model.vision_counter.get_empty_cells(self.pos, self.vision)
@@ -1,13 +1,18 @@
 import json
-import random
+import itertools
 from datetime import datetime
 from mesa import Model
-from mesa.space import MultiGrid
-from mesa.time import RandomActivation
-from mesa.datacollection import DataCollector
+from array_grid import ArrayGrid
 from civil_violence_agents import Citizen, Cop
-from constant_variables import State, GraphType
-from graph_utils import generate_network, print_network
+from constant_variables import State, GraphType, Column, Collection, Draw, Phase, Activation, STATES, ACTIVE_CODE, \
+    COP_CODE
+from columnar_datacollector import ColumnarDataCollector
+from graph_utils import generate_network, print_network, NetworkCSR
+from vision import VisionCounter
+from agent_rng import AgentStreams, StreamActivation
+from synchronous_activation import SynchronousActivation
+from profiling import PhaseProfiler
+from shared_population import attach_population, check_population
 from figure import create_fig, run_analysis
 from utils import *
 
@@ -25,7 +30,10 @@ class CivilViolenceModel(Model):
                  p=0.1, p_ws=0.1,
                  directed=False, max_jail_term=30,
                  active_threshold_t=0.1, initial_legitimacy_l0=0.82,
-                 movement=True, seed=None):
+                 movement=True, seed=None, population_seed=None, population=None,
+                 agent_collection=Collection.FULL.name, collection_interval=1, collection_sample=0.1,
+                 steady_state_window=0, steady_state_tolerance=0., profile=False,
+                 activation=Activation.SEQUENTIAL.name):
         """
         Create a new civil violence model.
 
@@ -48,19 +56,42 @@ class CivilViolenceModel(Model):
         :param directed: Is graph directed
         :param movement: Can agent move at end of an iteration
         :param seed: random seed
+        :param population_seed: random seed of the population (placement and static attributes of the agents, social
+            network), seed if None. Runs of a sweep given the same population seed share their population (and the
+            network cache) while keeping their own dynamics.
+        :param population: name of a shared population (see shared_population). If provided, agents and social
+            network are loaded from shared memory instead of being generated.
+        :param agent_collection: Collection policy of the agent reporters (FULL, MODEL_ONLY, EVERY_K, FINAL_STEP or
+            SUBSAMPLE, see constant_variables.Collection). Sweeps only using model reporters should use MODEL_ONLY.
+        :param collection_interval: Number of steps between two agent collections (EVERY_K policy)
+        :param collection_sample: Fraction of the agents collected (SUBSAMPLE policy)
+        :param steady_state_window: Stop the simulation once active and jailed citizens and legitimacy did not vary
+            during this number of steps, model reporters are padded with the last values until max_iter. 0 disables.
+        :param steady_state_tolerance: Variation allowed by the steady state criterion (fraction of the citizens
+            for the counts, see utils.steady_state_reached).
+        :param profile: accumulate wall time and calls per phase of the steps (see profiling.PhaseProfiler and
+            utils.compute_profile)
+        :param activation: SEQUENTIAL, agents step one after the other in random order and see the updates of the
+            agents activated before them, or SYNCHRONOUS, agents decide by phase from the state of the previous phase
+            (see synchronous_activation.SynchronousActivation, same rules than the vectorized engine)
 
         Additional attributes:
             running : is the model running
             iteration : current step of the simulation
             citizen_list : a list storing the citizen agents added to the model.   
             influencer_list : a list storing the citizien agents that are influencers
+            state_counts : number of citizens in each state, updated on every state transition
 
-            grid : A 2D cellular automata representing the real world space environment
+            grid : A 2D cellular automata representing the real world space environment (ArrayGrid, one agent per cell)
             network : A NetworkGrid with as many nodes as (citizen) agents representing the social network.
-            Agent in the NetworkGrid are deep copy of agent in the MultiGrid has Mesa implementation is based on
+            Agent in the NetworkGrid are deep copy of agent in the grid has Mesa implementation is based on
             the usage of a single space. (Example: NetworkGrid place_agent method will change "pos" attribute from agent
-            meaning one agent can't be on both MultiGrid and NetworkGrid).
+            meaning one agent can't be on both grid and NetworkGrid).
             We maintain a dictionary of agent position instead.
+            network_csr : Social network frozen in CSR format, propagating contagious hardship.
+            vision_counter : Grid-level counting service of cops and active citizens in vision of every cell.
+            streams : Counter-based random streams of the simulation, agents draw with their stream_id.
+            profiler : Timings per phase of the steps (disabled unless profile is set).
 
         """
         super().__init__()
@@ -71,13 +102,22 @@ class CivilViolenceModel(Model):
 
         self.seed = seed
         self.random.seed(self.seed)
+        self.streams = AgentStreams(self.seed)  # Every draw of the simulation goes through the streams
+        self.profiler = PhaseProfiler(profile)
 
         # Initialize Model grid and schedule
         self.height = height
         self.width = width
-        self.grid = MultiGrid(self.width, self.height, torus=True)  # Grid or MultiGrid ?
-        self.schedule = RandomActivation(self)
+        self.grid, self.vision_counter = self.create_space([agent_vision, cop_vision])
+        if activation not in Activation.__members__:
+            raise ValueError("Unknown activation {}, expected one of {}.".format(activation,
+                                                                                list(Activation.__members__)))
+        self.activation = activation
+        self.schedule = SynchronousActivation(self) if activation == Activation.SYNCHRONOUS.name \
+            else StreamActivation(self)
         self.max_iter = max_iter
+        self.steady_state_window = steady_state_window
+        self.steady_state_tolerance = steady_state_tolerance
         self.iteration = 0  # Simulation iteration counter
         self.movement = movement
 
@@ -99,6 +139,7 @@ class CivilViolenceModel(Model):
         self.citizen_list = []
         self.cop_list = []
         self.influencer_list = []
+        self.state_counts = {state: 0 for state in State}
         self.jailings_list = [0, 0, 0, 0]
         self.outbreaks = 0
         self.outbreak_now = 0
@@ -109,89 +150,204 @@ class CivilViolenceModel(Model):
         self.path = f'output/{self.graph_type}_{date.month}_{date.day}_{date.hour}_{date.minute}_'
 
         # === Set Data collection ===
-        self.datacollector = DataCollector(
+        self.datacollector = ColumnarDataCollector(
+            n_steps=self.max_iter + 2,  # Initial state and steps until the model stops
             model_reporters=self.get_model_reporters(),
-            agent_reporters=self.get_agent_reporters()
+            agent_reporters=self.get_agent_reporters(),
+            agent_collection=agent_collection,
+            collection_interval=collection_interval,
+            collection_sample=collection_sample,
+            streams=self.streams
         )
 
         # ==============================
         # === Initialize environment ===
         # ==============================
 
-        # Add agents to the model
-        unique_id = 0
-        for (contents, x, y) in self.grid.coord_iter():
-            random_x = self.random.random()
-            if random_x < self.agent_density:
-                # Add agents
-                agent = Citizen(
-                    unique_id=unique_id, model=self,
-                    pos=(x, y), hardship=self.random.random(), susceptibility=self.random.random(),
-                    influence=self.random.random(), expression_intensity=self.random.random(),
-                    legitimacy=self.initial_legitimacy_l0, risk_aversion=self.random.random(),
-                    threshold=self.active_threshold_t, vision=self.agent_vision)
-
-                unique_id += 1
-                self.citizen_list.append(agent)
-                self.grid.place_agent(agent, (x, y))  # Place agent in the MultiGrid
-                self.schedule.add(agent)
-
-            elif random_x < (self.agent_density + self.active_agent_density):
-                # Enforce an initial proportion of active agents
-                agent = Citizen(
-                    unique_id=unique_id, model=self,
-                    pos=(x, y), hardship=self.random.random(), susceptibility=self.random.random(),
-                    influence=self.random.random(), expression_intensity=self.random.random(),
-                    legitimacy=self.initial_legitimacy_l0, risk_aversion=self.random.random(),
-                    threshold=0, vision=self.agent_vision)
-
-                unique_id += 1
-                self.citizen_list.append(agent)
-                self.grid.place_agent(agent, (x, y))  # Place agent in the MultiGrid
-                self.schedule.add(agent)
-
-            elif random_x < (self.agent_density + self.active_agent_density + self.cop_density):
-                # Add law enforcement officer
-                agent = Cop(
-                    unique_id=unique_id, model=self,
-                    pos=(x, y), vision=self.cop_vision)
-
-                unique_id += 1
-                self.cop_list.append(agent)
-                self.grid.place_agent(agent, (x, y))  # Place agent in the MultiGrid
-                self.schedule.add(agent)
+        if population is None:
+            # Add agents to the model, with the draws of their cell
+            n_cells = self.width * self.height
+            population_streams = self.streams if population_seed is None else AgentStreams(population_seed)
+            draws = {draw: population_streams.uniforms(0, draw, n_cells).tolist() for draw in
+                     [Draw.PLACEMENT, Draw.HARDSHIP, Draw.SUSCEPTIBILITY, Draw.INFLUENCE, Draw.EXPRESSION_INTENSITY,
+                      Draw.RISK_AVERSION]}
+            unique_id = 0
+            for x, y in itertools.product(range(self.width), range(self.height)):
+                cell = x * self.height + y
+                random_x = draws[Draw.PLACEMENT][cell]
+                if random_x < (self.agent_density + self.active_agent_density):
+                    # Add agents, enforcing an initial proportion of active agents
+                    agent = Citizen(
+                        unique_id=unique_id, model=self,
+                        pos=(x, y), hardship=draws[Draw.HARDSHIP][cell],
+                        susceptibility=draws[Draw.SUSCEPTIBILITY][cell], influence=draws[Draw.INFLUENCE][cell],
+                        expression_intensity=draws[Draw.EXPRESSION_INTENSITY][cell],
+                        legitimacy=self.initial_legitimacy_l0, risk_aversion=draws[Draw.RISK_AVERSION][cell],
+                        threshold=self.active_threshold_t if random_x < self.agent_density else 0,
+                        vision=self.agent_vision)
+
+                    unique_id += 1
+                    self.citizen_list.append(agent)
+                    self.state_counts[agent.state] += 1
+                    self.grid.place_agent(agent, (x, y))  # Place agent in the grid
+                    self.schedule.add(agent)
+
+                elif random_x < (self.agent_density + self.active_agent_density + self.cop_density):
+                    # Add law enforcement officer
+                    agent = Cop(
+                        unique_id=unique_id, model=self,
+                        pos=(x, y), vision=self.cop_vision)
+
+                    unique_id += 1
+                    self.cop_list.append(agent)
+                    self.grid.place_agent(agent, (x, y))  # Place agent in the grid
+                    self.schedule.add(agent)
+        else:
+            self.load_population(population)
+
+        # Stream ids: citizens then cops (see AgentStreams)
+        for stream_id, agent in enumerate(self.citizen_list + self.cop_list):
+            agent.stream_id = stream_id
+        self.n_streams = len(self.citizen_list) + len(self.cop_list)
+
+        for agent in self.schedule.agents:
+            self.vision_counter.place(agent.pos, *self.get_vision_flags(agent), propagate=False)
+        self.vision_counter.rebuild()
 
         # Generate a social network composed of every civilian agents
-        self.G, self.network_dict = generate_network(self.citizen_list, graph_type, p, p_ws, directed, seed)
+        if population is None:
+            edges, self.network_dict = generate_network(self.citizen_list, graph_type, p, p_ws, directed,
+                                                        seed if population_seed is None else population_seed)
+            self.network_csr = NetworkCSR.from_edges(edges, self.network_dict, directed)
+        self._graph = None  # networkx export of the social network, see G property.
         # print_network(self.G, self.network_dict)  # Uncomment to print the network.
 
         # With network in place, set the influencers.
         self.set_influencers(self.inf_threshold)
 
         # Create the graph show the frequency of degrees for the nodes
-        create_fig(self.G.degree, draw=False)  # Set draw=True to draw a figure
+        create_fig(list(enumerate(self.network_csr.degree)), draw=False)  # Set draw=True to draw a figure
 
         self.running = True
         self.datacollector.collect(self)
 
+    def create_space(self, radii):
+        """
+        Create the grid and the vision counter.
+        The space of a model being reset is emptied and reused if the grid size and the vision radii don't change
+        (the neighborhood offsets of the grid are kept).
+        :param radii: vision radius used by the agents (citizens and cops)
+        """
+        recycled = self.__dict__.pop('_recycled_space', None)
+        if recycled is not None:
+            grid, vision_counter = recycled
+            if (grid.width, grid.height) == (self.width, self.height) and vision_counter.radii == sorted(set(radii)):
+                grid.clear()
+                vision_counter.clear()
+                return grid, vision_counter
+
+        return ArrayGrid(self.width, self.height, torus=True), VisionCounter(self.width, self.height, radii)
+
+    def get_uniforms(self, draw):
+        """
+        Uniform draws of every agent (indexed by stream id) for a purpose at the current step (see AgentStreams).
+        :param draw: purpose of the draw (see constant_variables.Draw)
+        """
+        return self.streams.uniforms(self.schedule.steps, draw, self.n_streams)
+
+    def reset(self, **params):
+        """
+        Reset the model in place for a new run instead of creating a new model (see simulation_executor).
+        Agents, social network and data collector are rebuilt from the new parameters and seed, the grid and the
+        vision counter are reused.
+        :param params: parameters of the new run, same than __init__ (missing parameters take their default value)
+        """
+        self._recycled_space = (self.grid, self.vision_counter)
+        self.__init__(**params)
+
+    def load_population(self, population):
+        """
+        Create the agents and the social network from a shared population.
+        Citizen i of the population is localized at node i of the network.
+        :param population: name of the shared population
+        """
+        arrays, meta = attach_population(population)
+        check_population(meta, self.width, self.height)
+
+        unique_id = 0
+        self.network_dict = dict()
+        for i, cell in enumerate(arrays['citizen_pos'].tolist()):
+            agent = Citizen(
+                unique_id=unique_id, model=self,
+                pos=divmod(cell, self.height), hardship=float(arrays['hardship_endo'][i]),
+                susceptibility=float(arrays['susceptibility'][i]),
+                influence=float(arrays['influence'][i]),
+                expression_intensity=float(arrays['expression_intensity'][i]),
+                legitimacy=self.initial_legitimacy_l0, risk_aversion=float(arrays['risk_aversion'][i]),
+                threshold=0 if arrays['enforced_active'][i] else self.active_threshold_t, vision=self.agent_vision)
+            agent.network_node = i
+
+            unique_id += 1
+            self.citizen_list.append(agent)
+            self.network_dict[i] = agent
+            self.state_counts[agent.state] += 1
+            self.grid.place_agent(agent, agent.pos)
+            self.schedule.add(agent)
+
+        for cell in arrays['cop_pos'].tolist():
+            agent = Cop(unique_id=unique_id, model=self, pos=divmod(cell, self.height), vision=self.cop_vision)
+
+            unique_id += 1
+            self.cop_list.append(agent)
+            self.grid.place_agent(agent, agent.pos)
+            self.schedule.add(agent)
+
+        # The frozen network arrays are used zero-copy
+        network_arrays = {key: arrays[key] for key in ['rows', 'in_indptr', 'in_indices'] if key in arrays}
+        self.network_csr = NetworkCSR(
+            arrays['indptr'], arrays['indices'], arrays['influence'] * arrays['expression_intensity'],
+            arrays['enforced_active'], meta['directed'], **network_arrays)
+
+    @property
+    def G(self):
+        """
+        networkx graph of the social network, only built when requested (visualization, figures).
+        The simulation itself relies on network_csr.
+        """
+        if self._graph is None:
+            self._graph = self.network_csr.to_networkx()
+        return self._graph
+
     def step(self):
         """
         One step in agent-based model simulation
         """
+        profiler = self.profiler
 
-        self.schedule.step()
+        start = profiler.clock()
+        self.network_csr.rebuild()
+        profiler.lap(Phase.CONTAGION, start)
+        self.schedule.step()  # Agents and scheduler time their own phases
         self.iteration += 1
+
+        start = profiler.clock()
         self.update_legitimacy()
+        start = profiler.lap(Phase.LEGITIMACY, start)
 
         self.outbreak_score_monitoring()
+        steady = self.steady_state_window > 0 and \
+            steady_state_reached(self, self.steady_state_window, self.steady_state_tolerance)
+        start = profiler.lap(Phase.OUTBREAK, start)
         self.datacollector.collect(self)
+        profiler.lap(Phase.COLLECTION, start)
 
         # Save initial values
         if self.iteration == 1:
             self.save_initial_values(save=False)
 
-        # Stop the model after a certain amount of iterations.
-        if self.iteration > self.max_iter:
+        # Stop the model after a certain amount of iterations, or earlier once settled.
+        if self.iteration > self.max_iter or steady:
+            self.datacollector.pad(self.max_iter + 2)
             self.save_data(save=False)
             self.running = False
 
@@ -268,45 +424,69 @@ class CivilViolenceModel(Model):
         """
         return {"QUIESCENT": compute_quiescent,
                 "ACTIVE": compute_active,
-                "JAILED": compute_active,
+                "JAILED": compute_jailed,
                 "LEGITIMACY": compute_legitimacy,
                 "INFLUENCERS": compute_influencers,
-                "OUTBREAKS": compute_outbreaks}
+                "OUTBREAKS": compute_outbreaks,
+                "STOP_STEP": compute_stop_step}
 
     def get_agent_reporters(self):
         """
-        Dictionary of agent reporter names and attributes/funcs
+        Dictionary of agent reporter names and (attribute, column kind).
+        States are stored as their integer code (state_code attribute) and network neighbors as their number.
         """
 
-        return {"Grievance": "grievance",
-                "Hardship": "hardship",
-                "State": "state",
-                "Influencer": "influencer",
-                "N_connections": "network_neighbors",
-                "InfluencePi": "influence"}
+        return {"Grievance": ("grievance", Column.FLOAT),
+                "Hardship": ("hardship", Column.FLOAT),
+                "State": ("state_code", Column.STATE),
+                "Influencer": ("influencer", Column.BOOL),
+                "N_connections": ("network_neighbors", Column.COUNT),
+                "InfluencePi": ("influence", Column.FLOAT)}
 
     def count_type_citizens(self, state_req):
         """
         Helper method to count agents.
         Cop agents can't disappear from the map, so number of cops can be retrieved from model attributes.
+        Citizens are counted in O(1) from the state counters maintained by update_state.
         """
-        count = 0
-        for agent in self.citizen_list:
-            if type(agent).__name__.upper() == 'COP':
-                continue
-            if agent.jail_sentence and state_req == 'JAILED':
-                count += 1
-            else:
-                if agent.state is State.ACTIVE and state_req == 'ACTIVE':
-                    count += 1
-                elif agent.state == State.QUIESCENT and state_req == 'QUIESCENT':
-                    count += 1
-        return count
+        return self.state_counts[State[state_req]]
+
+    def get_vision_flags(self, agent):
+        """
+        Contribution of an agent to the vision counter layers.
+        :return: (number of cops, number of active citizens)
+        """
+        if agent.state_code == COP_CODE:
+            return 1, 0
+        return 0, int(agent.state_code == ACTIVE_CODE)
+
+    def update_state(self, agent, state):
+        """
+        Change the state of a citizen (activation, deactivation, arrest, release),
+        keeping the state counters and the vision counter up to date.
+        """
+        code = state.value
+        if agent.pos is not None:
+            delta = (code == ACTIVE_CODE) - (agent.state_code == ACTIVE_CODE)
+            if delta:
+                self.vision_counter.update(agent.pos, actives=delta)
+        self.network_csr.set_active(agent.network_node, code == ACTIVE_CODE)
+        self.state_counts[STATES[agent.state_code]] -= 1
+        self.state_counts[state] += 1
+        agent.state_code = code
+
+    def move_agent(self, agent, new_pos):
+        """
+        Move an agent in the grid.
+        """
+        self.vision_counter.move(agent.pos, new_pos, *self.get_vision_flags(agent))
+        self.grid.move_agent(agent, new_pos)
 
     def remove_agent_grid(self, agent):
         """
         Removes an agent from the grid.
         """
+        self.vision_counter.remove(agent.pos, *self.get_vision_flags(agent))
         self.grid.remove_agent(agent)
 
     def add_jailed(self, agent):
@@ -315,11 +495,12 @@ class CivilViolenceModel(Model):
         If the sentence of a jailed agent is over, place him back on a random empty cell in the grid.
         """
 
-        if len(self.grid.empties) == 0:
+        new_pos = self.vision_counter.draw_empty_cell(self.get_uniforms(Draw.RELEASE)[agent.stream_id])
+        if new_pos is None:
             raise Exception("There are no empty cells.")
 
-        new_pos = self.random.choice(list(self.grid.empties))
         self.grid.place_agent(agent, new_pos)
+        self.vision_counter.place(new_pos, *self.get_vision_flags(agent))
 
     def set_influencers(self, inf_threshold=150):
         """
@@ -328,7 +509,7 @@ class CivilViolenceModel(Model):
         :param inf_threshold: determine how many connections a node needs to be considered an influencer
         """
         for agent in self.citizen_list:
-            agent.set_influencer(len(list(self.G.neighbors(agent.network_node))), inf_threshold)
+            agent.set_influencer(len(self.network_csr.neighbors(agent.network_node)), inf_threshold)
             if agent.influencer:
                 self.influencer_list.append(agent)
 
@@ -338,14 +519,17 @@ class CivilViolenceModel(Model):
         Gives manual control over the model to evaluate the influence of influencers.
         """
         if self.influencer_list:
+            draws = self.get_uniforms(Draw.INFLUENCER)
             for i in range(len(self.influencer_list)):
-                to_remove = self.random.choice(self.influencer_list)
+                to_remove = self.influencer_list[int(draws[i] * len(self.influencer_list))]
                 if to_remove.pos: # Check if influencer is jailed.
-                    self.grid.remove_agent(to_remove)
+                    self.remove_agent_grid(to_remove)
                 self.influencer_list.remove(to_remove)
                 self.citizen_list.remove(to_remove)
+                self.state_counts[to_remove.state] -= 1
                 self.schedule.remove(to_remove)
-                self.G.remove_node(to_remove.network_node)
+                self.network_csr.remove_node(to_remove.network_node)
+                self._graph = None
 
     def jail_influencer(self):
         """
@@ -353,13 +537,15 @@ class CivilViolenceModel(Model):
         Gives manual control over the model to evaluate the influence of influencers.
         """
         if self.influencer_list:
+            draws = self.get_uniforms(Draw.INFLUENCER)
+            sentences = self.get_uniforms(Draw.INFLUENCER_SENTENCE)
             for i in range(len(self.influencer_list)):
-                arrestee = self.random.choice(self.influencer_list)
+                arrestee = self.influencer_list[int(draws[i] * len(self.influencer_list))]
                 if arrestee.state == State.JAILED: # Check if influencer is jailed.
                     continue
-                sentence = random.randint(1, self.max_jail_term)
+                sentence = 1 + int(sentences[arrestee.stream_id] * self.max_jail_term)
                 arrestee.jail_sentence = sentence
-                arrestee.state = State.JAILED
+                self.update_state(arrestee, State.JAILED)
                 self.jailings_list[0] += 1
                 if sentence > 0:
                     self.remove_agent_grid(arrestee)
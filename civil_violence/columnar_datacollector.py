@@ -0,0 +1,383 @@
+from operator import attrgetter
+import numpy as np
+import pandas as pd
+from agent_rng import AgentStreams
+from constant_variables import State, Column, Collection, Draw
+
+# Storage of each column kind: dtype and value of the agents without the attribute (cops)
+COLUMN_DTYPES = {Column.FLOAT: (np.float64, np.nan),
+                 Column.STATE: (np.int8, 0),
+                 Column.BOOL: (np.int8, -1),
+                 Column.COUNT: (np.int32, -1)}
+
+# State codes (State.value) to State members, 0 is used for missing values
+STATE_CODES = np.array([None] + list(State), dtype=object)
+
+
+def to_column(values, kind):
+    """
+    Convert agent attribute values to a typed column.
+    :param values: sequence of attribute values (integer codes for states), None for agents without the attribute
+    :param kind: Column kind
+    :return: numpy array
+    """
+    dtype, missing = COLUMN_DTYPES[kind]
+    if kind == Column.FLOAT:
+        return np.array(values, dtype=dtype)  # None is converted to NaN
+    if kind == Column.STATE:
+        return np.fromiter((missing if v is None else v for v in values), dtype=dtype, count=len(values))
+    if kind == Column.BOOL:
+        return np.fromiter((missing if v is None else v for v in values), dtype=dtype, count=len(values))
+    return np.fromiter((missing if v is None else len(v) for v in values), dtype=dtype, count=len(values))
+
+
+def from_column(column, kind):
+    """
+    Convert a typed column back to the values mesa DataCollector would report.
+    Counts are kept as integers (nullable for missing values).
+    """
+    if kind == Column.FLOAT:
+        return column
+    if kind == Column.STATE:
+        return STATE_CODES[column]
+    if kind == Column.BOOL:
+        return np.array([None, False, True], dtype=object)[column + 1]
+    return pd.array(np.where(column < 0, None, column).tolist(), dtype='Int64')
+
+
+class ColumnarDataCollector:
+    """
+    Drop-in replacement of mesa DataCollector storing reports in preallocated NumPy arrays.
+
+    Each model reporter is a 1D array indexed by collection, and each agent reporter a 2D array of shape
+    (agent collections, collected agents), columns being mapped to agent unique ids (see get_agent_ids). Agent values are typed (see Column): states are stored
+    as their small integer code and lists (network neighbors) as their length, instead of one tuple per agent
+    and step. Arrays are allocated for n_steps collections and doubled if the model runs longer.
+
+    Agent reporters follow a collection policy (see Collection):
+        FULL: every agent at every step
+        MODEL_ONLY: agent reporters are not collected
+        EVERY_K: every agent, every collection_interval steps
+        FINAL_STEP: every agent, only for the last step reached by the model (snapshot taken when data is read)
+        SUBSAMPLE: a random subset (collection_sample fraction) of the agents, drawn once (SUBSAMPLE draw of the
+            agent streams), at every step
+
+    get_model_vars_dataframe and get_agent_vars_dataframe build mesa-compatible dataframes on demand.
+    """
+
+    def __init__(self, n_steps=1, model_reporters=None, agent_reporters=None,
+                 agent_collection=Collection.FULL.name, collection_interval=1, collection_sample=1.0, streams=None):
+        """
+        Create a new columnar data collector.
+        :param n_steps: number of collections to preallocate (max_iter + 2 for the initial state and the last step)
+        :param model_reporters: dictionary of reporter names and functions of the model
+        :param agent_reporters: dictionary of reporter names and (attribute, Column kind) tuples
+        :param agent_collection: collection policy of the agent reporters (Collection name)
+        :param collection_interval: number of steps between two agent collections (EVERY_K policy)
+        :param collection_sample: fraction of the agents collected (SUBSAMPLE policy)
+        :param streams: AgentStreams of the model, the agents (identified by their stream_id) with the lowest SUBSAMPLE
+            draws form the subsample. Random streams if None
+        """
+        self.capacity = max(int(n_steps), 1)
+        self.agent_collection = Collection[agent_collection]
+        self.collection_interval = max(int(collection_interval), 1)
+        self.collection_sample = collection_sample
+        self.streams = AgentStreams() if streams is None else streams
+
+        self.model_reporters = dict(model_reporters or {})
+        self.agent_reporters = dict(agent_reporters or {})
+        if self.agent_collection == Collection.MODEL_ONLY:
+            self.agent_reporters = {}
+
+        self.n_collected = 0
+        self._model_vars = {}  # Allocated at first collection, dtype taken from the first report (widened if needed)
+
+        if self.agent_collection == Collection.FINAL_STEP:
+            self.agent_capacity = 1
+        elif self.agent_collection == Collection.EVERY_K:
+            self.agent_capacity = -(-self.capacity // self.collection_interval)
+        else:
+            self.agent_capacity = self.capacity
+
+        self.n_agents = 0  # Number of columns of the agent arrays
+        self.agent_ids = np.zeros(0, dtype=np.int64)  # Unique id of each column
+        self.columns = np.zeros(0, dtype=np.int64)  # Column of each unique id, -1 if never collected
+        self.n_agent_rows = 0
+        self.agent_steps = np.zeros(self.agent_capacity, dtype=np.int64)  # Step of each agent collection
+        self.sampled = None  # Unique ids of the agents subsample
+        self._agent_vars = {}
+        self._present = None  # Agents in the schedule at each agent collection
+        self._pending = None  # Model of the deferred final step snapshot
+
+    @property
+    def model_vars(self):
+        """
+        Dictionary of collected model values as lists of Python scalars, like mesa DataCollector.model_vars (the
+        visualization modules send them to the browser as JSON, see get_model_array for the arrays)
+        """
+        return {name: self._model_vars[name][:self.n_collected].tolist() for name in self._model_vars}
+
+    def add_agents(self, ids):
+        """
+        Allocate columns for agents which were never collected.
+        :param ids: array of unique ids
+        """
+        if len(self.columns) <= ids.max():
+            self.columns = np.concatenate([self.columns, np.full(ids.max() + 1 - len(self.columns), -1)])
+        new_ids = np.unique(ids[self.columns[ids] < 0])
+        if len(new_ids) == 0:
+            return
+
+        n_agents = self.n_agents + len(new_ids)
+        self.columns[new_ids] = np.arange(self.n_agents, n_agents)
+        self.agent_ids = np.concatenate([self.agent_ids, new_ids])
+
+        for name, (_, kind) in self.agent_reporters.items():
+            dtype, missing = COLUMN_DTYPES[kind]
+            array = np.full((self.agent_capacity, n_agents), missing, dtype=dtype)
+            if name in self._agent_vars:
+                array[:, :self.n_agents] = self._agent_vars[name]
+            self._agent_vars[name] = array
+
+        present = np.zeros((self.agent_capacity, n_agents), dtype=bool)
+        if self._present is not None:
+            present[:, :self.n_agents] = self._present
+        self._present = present
+        self.n_agents = n_agents
+
+    def grow(self):
+        """
+        Double the number of model collections which can be stored.
+        """
+        self.capacity *= 2
+        for name, array in self._model_vars.items():
+            self._model_vars[name] = np.resize(array, self.capacity)
+
+    def promote(self, name, value):
+        """
+        Widen the dtype of a model reporter column taken from an integer (or boolean) first report, so that a later
+        float value (e.g. LEGITIMACY starting from an integer initial_legitimacy_l0) isn't truncated.
+        """
+        dtype = np.result_type(self._model_vars[name].dtype, value)
+        if dtype != self._model_vars[name].dtype:
+            self._model_vars[name] = self._model_vars[name].astype(dtype)
+
+    def grow_agents(self):
+        """
+        Double the number of agent collections which can be stored.
+        """
+        self.agent_capacity *= 2
+        self.agent_steps = np.resize(self.agent_steps, self.agent_capacity)
+        for name, array in self._agent_vars.items():
+            self._agent_vars[name] = np.resize(array, (self.agent_capacity, self.n_agents))
+        if self._present is not None:
+            self._present = np.resize(self._present, (self.agent_capacity, self.n_agents))
+            self._present[self.n_agent_rows:] = False
+
+    def collect(self, model):
+        """
+        Collect all the data for the given model object.
+        """
+        if self.n_collected == self.capacity:
+            self.grow()
+        row = self.n_collected
+
+        for name, reporter in self.model_reporters.items():
+            value = reporter(model)
+            if name not in self._model_vars:
+                dtype = np.asarray(value).dtype if np.isscalar(value) else object
+                self._model_vars[name] = np.zeros(self.capacity, dtype=dtype)
+            elif self._model_vars[name].dtype.kind in 'biu':
+                self.promote(name, value)
+            self._model_vars[name][row] = value
+
+        self.n_collected += 1
+
+        if not self.agent_reporters:
+            return
+        if self.agent_collection == Collection.FINAL_STEP:
+            self._pending = model  # The run may be stopped by the model or by a batch runner, collect on read
+        elif self.agent_collection != Collection.EVERY_K or model.schedule.steps % self.collection_interval == 0:
+            self.collect_agents(model)
+
+    def pad(self, n_rows):
+        """
+        Repeat the last model collection until n_rows collections, for a run stopped early in a steady state (agent
+        collections are not padded).
+        :param n_rows: number of model collections of a full run
+        """
+        if self.n_collected == 0 or self.n_collected >= n_rows:
+            return
+        while self.capacity < n_rows:
+            self.grow()
+        for array in self._model_vars.values():
+            array[self.n_collected:n_rows] = array[self.n_collected - 1]
+        self.n_collected = n_rows
+
+    def draw_subsample(self, agents):
+        """
+        Draw the agents subsample: the collection_sample fraction of the agents (at least one) with the lowest
+        SUBSAMPLE draw of their stream at step 0. The subsample only depends on the seed of the streams.
+        :param agents: agents of the schedule
+        :return: set of unique ids
+        """
+        stream_ids = np.array([agent.stream_id for agent in agents], dtype=np.int64)
+        ids = np.array([agent.unique_id for agent in agents], dtype=np.int64)
+        size = min(max(int(round(self.collection_sample * len(ids))), 1), len(ids))
+        draws = self.streams.uniforms(0, Draw.SUBSAMPLE, stream_ids.max(initial=-1) + 1)[stream_ids]
+        return set(ids[np.argsort(draws, kind='stable')[:size]].tolist())
+
+    def collect_agents(self, model, row=None):
+        """
+        Collect agent reporters of the agents of the schedule (the subsample with SUBSAMPLE policy), one column at
+        a time.
+        :param row: row to write, a new row is appended if None
+        """
+        agents = model.schedule.agents
+        if self.agent_collection == Collection.SUBSAMPLE:
+            if self.sampled is None:
+                self.sampled = self.draw_subsample(agents)
+            agents = [agent for agent in agents if agent.unique_id in self.sampled]
+
+        if row is None:
+            if self.n_agent_rows == self.agent_capacity:
+                self.grow_agents()
+            row = self.n_agent_rows
+            self.n_agent_rows += 1
+        self.agent_steps[row] = model.schedule.steps
+
+        attributes = [attribute for attribute, _ in self.agent_reporters.values()]
+        records = list(map(attrgetter('unique_id', *attributes), agents))
+        if not records:
+            return
+        columns = list(zip(*records))
+
+        ids = np.array(columns[0], dtype=np.int64)
+        self.add_agents(ids)
+        cols = self.columns[ids]
+
+        self._present[row] = False
+        self._present[row, cols] = True
+        for (name, (_, kind)), values in zip(self.agent_reporters.items(), columns[1:]):
+            self._agent_vars[name][row] = COLUMN_DTYPES[kind][1]  # Rows may be reused (grown or final step)
+            self._agent_vars[name][row, cols] = to_column(values, kind)
+
+    def flush(self):
+        """
+        Take the deferred final step snapshot (FINAL_STEP policy) if the model moved since the last one.
+        """
+        if self._pending is None:
+            return
+        if self.n_agent_rows == 0 or self.agent_steps[0] != self._pending.schedule.steps:
+            self.n_agent_rows = 1
+            self.collect_agents(self._pending, row=0)
+
+    def get_model_array(self, name):
+        """
+        Collected values of a model reporter
+        """
+        return self._model_vars[name][:self.n_collected]
+
+    def get_agent_steps(self):
+        """
+        Step of each agent collection (rows of get_agent_array)
+        """
+        self.flush()
+        return self.agent_steps[:self.n_agent_rows]
+
+    def get_agent_ids(self):
+        """
+        Unique id of the agents collected (columns of get_agent_array)
+        """
+        self.flush()
+        return self.agent_ids
+
+    def get_agent_array(self, name):
+        """
+        Collected values of an agent reporter, array of shape (agent collections, collected agents).
+        Agents absent from a collection (removed influencers) hold the missing value of the column.
+        """
+        self.flush()
+        return self._agent_vars[name][:self.n_agent_rows]
+
+    def get_model_vars_dataframe(self):
+        """
+        Dataframe of the model reporters, one row per collection.
+        """
+        return pd.DataFrame({name: self.get_model_array(name) for name in self._model_vars})
+
+    def get_agent_vars_dataframe(self):
+        """
+        Dataframe of the agent reporters, indexed by (Step, AgentID) like mesa DataCollector.
+        """
+        self.flush()
+        if self._present is None:
+            return pd.DataFrame(columns=list(self.agent_reporters))
+
+        rows, cols = np.nonzero(self._present[:self.n_agent_rows])
+        index = pd.MultiIndex.from_arrays([self.agent_steps[rows], self.agent_ids[cols]], names=["Step", "AgentID"])
+        data = {name: from_column(self._agent_vars[name][rows, cols], kind)
+                for name, (_, kind) in self.agent_reporters.items()}
+        return pd.DataFrame(data, index=index)
+
+    def export_arrays(self, agents=True):
+        """
+        Export the collected data as flat arrays (see batch_results.pack_arrays).
+        :param agents: also export the agent reporters
+        :return: dictionary of arrays and dictionary of meta values
+        """
+        arrays = {'model/' + name: self.get_model_array(name) for name in self._model_vars}
+        meta = {'model_reporters': list(self._model_vars), 'agent_reporters': {},
+                'agent_collection': self.agent_collection.name}
+
+        if agents and self.agent_reporters:
+            self.flush()
+            arrays.update({'agent_steps': self.agent_steps[:self.n_agent_rows],
+                           'agent_ids': self.agent_ids,
+                           'agent_present': self._present[:self.n_agent_rows] if self._present is not None
+                           else np.zeros((self.n_agent_rows, 0), dtype=bool)})
+            for name, (attribute, kind) in self.agent_reporters.items():
+                arrays['agent/' + name] = self._agent_vars[name][:self.n_agent_rows] if name in self._agent_vars \
+                    else np.zeros((self.n_agent_rows, 0), dtype=COLUMN_DTYPES[kind][0])
+                meta['agent_reporters'][name] = [attribute, kind.name]
+
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        """
+        Rebuild a (read-only) data collector from exported arrays, to get its dataframes.
+        """
+        n_collected = len(arrays['model/' + meta['model_reporters'][0]]) if meta['model_reporters'] else 0
+        agent_reporters = {name: (attribute, Column[kind]) for name, (attribute, kind) in
+                           meta['agent_reporters'].items()}
+        collector = cls(n_collected, dict.fromkeys(meta['model_reporters']), agent_reporters, meta['agent_collection'])
+        collector.n_collected = n_collected
+        collector._model_vars = {name: arrays['model/' + name] for name in meta['model_reporters']}
+
+        if agent_reporters:
+            collector.agent_steps = arrays['agent_steps']
+            collector.n_agent_rows = len(collector.agent_steps)
+            collector.agent_capacity = collector.n_agent_rows
+            collector.agent_ids = arrays['agent_ids']
+            collector.n_agents = len(collector.agent_ids)
+            collector._present = arrays['agent_present']
+            collector._agent_vars = {name: arrays['agent/' + name] for name in agent_reporters}
+
+        return collector
+
+    def __getstate__(self):
+        """
+        Only pickle the collected rows (results sent back by multiprocessing workers), without the model.
+        """
+        self.flush()
+        state = self.__dict__.copy()
+        state['_pending'] = None
+        state['capacity'] = max(self.n_collected, 1)
+        state['agent_capacity'] = max(self.n_agent_rows, 1)
+        state['_model_vars'] = {name: array[:state['capacity']] for name, array in self._model_vars.items()}
+        state['_agent_vars'] = {name: array[:state['agent_capacity']] for name, array in self._agent_vars.items()}
+        state['agent_steps'] = self.agent_steps[:state['agent_capacity']]
+        if self._present is not None:
+            state['_present'] = self._present[:state['agent_capacity']]
+        return state
@@ -2,8 +2,30 @@ from enum import Enum
 
 State = Enum('State', 'QUIESCENT ACTIVE JAILED COP')
 
+# Integer state codes (State values) stored by the agents, and State member of each code
+QUIESCENT_CODE, ACTIVE_CODE, JAILED_CODE, COP_CODE = [state.value for state in State]
+STATES = (None,) + tuple(State)
+
 GraphType = Enum('GraphType', 'ERDOS_RENYI BARABASI_ALBERT WATTS_STROGATZ')
 
+Engine = Enum('Engine', 'MESA VECTORIZED')
+
+Activation = Enum('Activation', 'SEQUENTIAL SYNCHRONOUS')
+
+Column = Enum('Column', 'FLOAT STATE BOOL COUNT')
+
+Collection = Enum('Collection', 'FULL MODEL_ONLY EVERY_K FINAL_STEP SUBSAMPLE')
+
+Draw = Enum('Draw', 'ORDER MOVE ARREST SENTENCE RELEASE INFLUENCER INFLUENCER_SENTENCE '
+                    'PLACEMENT HARDSHIP SUSCEPTIBILITY INFLUENCE EXPRESSION_INTENSITY RISK_AVERSION SUBSAMPLE')
+
+Phase = Enum('Phase', 'SCHEDULE CONTAGION NEIGHBORHOOD DECISION ARREST MOVEMENT RELEASE LEGITIMACY OUTBREAK '
+                      'COLLECTION')
+
+TilePhase = Enum('TilePhase', 'CITIZENS ARRESTS COP_MOVES')
+
+Trailing = Enum('Trailing', 'EXCLUDE INCLUDE')  # Handling of an outbreak still running at the end of a run
+
 
 class Color(Enum):
     QUIESCENT = "lightblue"
@@ -0,0 +1,20 @@
+from constant_variables import Engine
+from civil_violence_model import CivilViolenceModel
+from vectorized_model import VectorizedCivilViolenceModel
+
+
+def get_model_class(engine=Engine.MESA.name):
+    """
+    Select the simulation backend of the civil violence model.
+    :param engine: name of the engine (see constant_variables.Engine)
+    :return: model class to be instantiated by the batch runners
+    """
+    engines = {
+        Engine.MESA.name: CivilViolenceModel,
+        Engine.VECTORIZED.name: VectorizedCivilViolenceModel,
+    }
+
+    if engine not in engines:
+        raise ValueError("Unknown engine {}, expected one of {}.".format(engine, list(engines.keys())))
+
+    return engines[engine]
@@ -2,15 +2,20 @@ import time
 import numpy as np
 from mesa.batchrunner import BatchRunner
 from civil_violence_model import CivilViolenceModel
+from network_cache import configure_network_cache, NETWORK_CACHE_DIR
+from replicate_batch import run_replicates
 from utils import read_configuration
 
 
-def experiment_1(replicates=40, max_steps=200, graph_type="None"):
+def experiment_1(replicates=40, max_steps=200, graph_type="None", batched=False):
     """
     Experiment 1 - Run simulations of civil violence with network model.
     Function to generates data which are used for comparison of network topology influence on civil violence model.
+    :param batched: advance all the replicates together in one stacked state (vectorized engine rules, see
+        replicate_batch) instead of running mesa models one by one
     """
     path = 'archives/saved_data_experiment_1_{0}_{1}'.format(int(time.time()), graph_type)
+    configure_network_cache(directory=NETWORK_CACHE_DIR)
 
     configuration = read_configuration()
     model_params = {}
@@ -19,24 +24,28 @@ def experiment_1(replicates=40, max_steps=200, graph_type="None"):
     model_params['graph_type'] = graph_type
     model_params['max_iter'] = max_steps
 
-    batch = BatchRunner(CivilViolenceModel,
-                        max_steps=max_steps,
-                        iterations=replicates,
-                        fixed_parameters=model_params,
-                        model_reporters={'All_Data': lambda m: m.datacollector,
-                                         "QUIESCENT": lambda m: m.count_type_citizens("QUIESCENT"),
-                                         "ACTIVE": lambda m: m.count_type_citizens("ACTIVE"),
-                                         "JAILED": lambda m: m.count_type_citizens("JAILED"),
-                                         "OUTBREAKS": lambda m: m.outbreaks},  # attempt all
-                        display_progress=True)
-
-    batch.run_all()
-
-    batch_df = batch.get_model_vars_dataframe()
-    batch_df = batch_df.drop('All_Data', axis=1)
-
-    data = batch_df
-    run_data = batch.get_collector_model()
+    if batched:
+        data, run_data = run_replicates(replicates, max_steps, ["QUIESCENT", "ACTIVE", "JAILED", "OUTBREAKS"],
+                                        model_params)
+    else:
+        batch = BatchRunner(CivilViolenceModel,
+                            max_steps=max_steps,
+                            iterations=replicates,
+                            fixed_parameters=model_params,
+                            model_reporters={'All_Data': lambda m: m.datacollector,
+                                             "QUIESCENT": lambda m: m.count_type_citizens("QUIESCENT"),
+                                             "ACTIVE": lambda m: m.count_type_citizens("ACTIVE"),
+                                             "JAILED": lambda m: m.count_type_citizens("JAILED"),
+                                             "OUTBREAKS": lambda m: m.outbreaks},  # attempt all
+                            display_progress=True)
+
+        batch.run_all()
+
+        batch_df = batch.get_model_vars_dataframe()
+        batch_df = batch_df.drop('All_Data', axis=1)
+
+        data = batch_df
+        run_data = batch.get_collector_model()
 
     with open(path, 'ab') as f:
         np.save(f, data)
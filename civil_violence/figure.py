@@ -50,7 +50,6 @@ def run_analysis(df, draw=False):
     df_infl.plot(ax=ax[4])
 
     # Draw connections
-    df['N_connections'] = [len(_) for _ in df['N_connections']]
     df_conn = df.loc[df['Step'] == 1] 
     sns.distplot(df['N_connections'], kde=True, ax=ax[5])
 
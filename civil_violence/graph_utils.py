@@ -1,6 +1,8 @@
+import numpy as np
 import networkx as nx
 from mesa.visualization.modules import NetworkModule
-from constant_variables import GraphType
+from constant_variables import GraphType, State
+import network_cache
 
 
 class NetworkModuleExtended(NetworkModule):
@@ -17,6 +19,8 @@ class NetworkModuleExtended(NetworkModule):
 def generate_network(agent_list, graph_type, p, p_ws, directed=False, seed=None):
     """
     Generate a network based on the provided parameters
+    Agent i of the list is localized at node i of the network.
+    Networks generated with a seed are looked up in the network cache first.
 
     :param agent_list: List of agents to be added to the network
     :param p: Probability for edge creation
@@ -24,97 +28,325 @@ def generate_network(agent_list, graph_type, p, p_ws, directed=False, seed=None)
     :param directed: True if directed, False if undirected
     :param seed: Indicator of random number generation state
     :param graph_type: constants to select a type of Graph.
-    :return:
+    :return: array of edges and dictionnary mapping graph node to agent reference.
     """
 
+    network_dict = dict()
+    for idx, agent in enumerate(agent_list):
+        agent.network_node = idx  # Set the localisation of the agent in the social network
+        network_dict[agent.network_node] = agent
+
+    return load_or_generate_edges(len(agent_list), graph_type, p, p_ws, directed, seed), network_dict
+
+
+def load_or_generate_edges(num_nodes, graph_type, p, p_ws, directed=False, seed=None):
+    """
+    Get the edges of a social network from the network cache, generate them if they are not cached.
+    Same parameters than generate_edges. The returned array is read-only.
+    """
+    if graph_type not in GraphType.__members__:
+        return generate_edges(num_nodes, graph_type, p, p_ws, directed, seed)  # No network, nothing to cache
+
+    return network_cache.network_cache.get_or_generate(generate_edges, graph_type, num_nodes, p, p_ws, directed, seed)
+
+
+def generate_edges(num_nodes, graph_type, p, p_ws, directed=False, seed=None):
+    """
+    Generate the edges of a social network of num_nodes nodes, without any agent attached.
+    Node i of the graph corresponds to the i-th citizen of the model (same convention than generate_network).
+    Changing the generated networks requires bumping network_cache.GENERATOR_VERSION (cached networks are reused).
+
+    :param num_nodes: Number of nodes in the network
+    :param graph_type: constants to select a type of Graph.
+    :param p: Probability for edge creation
+    :param p_ws: probability of rewiring each edge, used by Watts-Strogatz
+    :param directed: True if directed, False if undirected
+    :param seed: Indicator of random number generation state
+    :return: array of shape (n_edges, 2) with (source, target) node ids.
+    """
+    rng = np.random.default_rng(seed)
+
     if graph_type == GraphType.ERDOS_RENYI.name:
-        return generate_erdos_renyi(agent_list, p, directed, seed)
+        return generate_erdos_renyi(num_nodes, p, directed, rng)
 
     if graph_type == GraphType.BARABASI_ALBERT.name:
-        return generate_barabasi_albert(agent_list, p, seed)
+        return generate_barabasi_albert(num_nodes, p, rng)
 
     if graph_type == GraphType.WATTS_STROGATZ.name:
-        return generate_watts_strogatz(agent_list, p, p_ws, seed)
+        return generate_watts_strogatz(num_nodes, p, p_ws, rng)
 
     # Default - no network
-    no_graph = nx.Graph()
-    network_dict = dict()
-    for idx, agent in enumerate(agent_list):
-        no_graph.add_node(idx)  # Agents are added to a graph with no edge (for compatibility)
-        agent.network_node = idx
-        network_dict[agent.network_node] = agent
-
-    return no_graph, network_dict
+    return np.empty((0, 2), dtype=np.int64)
 
 
-def generate_erdos_renyi(agent_list, p, directed=False, seed=None):
+def generate_erdos_renyi(num_nodes, p, directed=False, rng=None):
     """
-    Generate an Erdos Renyi graph. Add as many nodes as there's agents.
-    :param agent_list: List of agents (citizen)
+    Generate an Erdos Renyi graph G(n, p) with geometric skips between created edges (Batagelj & Brandes 2005),
+    so the cost is proportional to the number of edges instead of the number of node pairs.
+    :param num_nodes: number of nodes (citizens)
     :param p: probability of creating an edge
     :param directed: True if graph is directed
-    :param seed: randomization seed
-    :return: networkx graph and dictionnary mapping graph node to agent reference.
+    :param rng: numpy random generator
+    :return: array of edges
     """
+    rng = np.random.default_rng(rng)
+    n_pairs = num_nodes * (num_nodes - 1) if directed else num_nodes * (num_nodes - 1) // 2
+    if p <= 0 or n_pairs == 0:
+        return np.empty((0, 2), dtype=np.int64)
 
-    num_nodes = len(agent_list)
-    graph = nx.generators.random_graphs.erdos_renyi_graph(num_nodes, p, seed, directed)
-    network_dict = dict()
+    # Index of created edges among all node pairs, drawn by chunks of geometric skips
+    chunks = []
+    last = -1
+    chunk_size = max(int(n_pairs * p * 1.1), 64)
+    while last < n_pairs:
+        positions = last + np.cumsum(rng.geometric(min(p, 1.), size=chunk_size))
+        chunks.append(positions)
+        last = positions[-1]
+    pairs = np.concatenate(chunks)
+    pairs = pairs[pairs < n_pairs]
 
-    agent_number = 0
-    for agent in agent_list:
-        # Set the localisation of the agent in the social network
-        agent.network_node = list(graph.nodes)[agent_number]
-        network_dict[agent.network_node] = agent
-        agent_number += 1
-    return graph, network_dict
+    if directed:
+        # Pair index -> (u, v), u != v
+        sources, rank = np.divmod(pairs, num_nodes - 1)
+        targets = rank + (rank >= sources)
+    else:
+        # Pair index in the lower triangle -> (u, v), u < v
+        targets = ((1 + np.sqrt(1 + 8 * pairs.astype(float))) // 2).astype(np.int64)
+        targets -= targets * (targets - 1) // 2 > pairs  # Fix float rounding
+        targets += (targets + 1) * targets // 2 <= pairs
+        sources = pairs - targets * (targets - 1) // 2
 
+    return np.stack([sources, targets], axis=1)
 
-def generate_barabasi_albert(agent_list, p, seed=None):
+
+def generate_barabasi_albert(num_nodes, p, rng=None):
     """
-    Generate an Erdos Renyi graph. Add as many nodes as there's agents.
-    :param agent_list: List of agents (citizen)
+    Generate a Barabasi-Albert graph with m = (p * n - 1) / 2 edges per new node.
+    Like networkx, the graph starts from a star graph of m + 1 nodes. Preferential attachment is done by sampling
+    uniformly the endpoints of the edge list built so far.
+    :param num_nodes: number of nodes (citizens)
     :param p: probability of creating an edge
-    :param seed: randomization seed
-    :return: networkx graph and dictionnary mapping graph node to agent reference.
+    :param rng: numpy random generator
+    :return: array of edges
     """
-
-    num_nodes = len(agent_list)
+    rng = np.random.default_rng(rng)
     m = int((p*num_nodes-1)/2)
-    graph = nx.generators.random_graphs.barabasi_albert_graph(num_nodes, m, seed)
-    network_dict = dict()
+    if m < 1 or m >= num_nodes:
+        raise ValueError(f"Barabási–Albert network must have m >= 1 and m < n, m = {m}, n = {num_nodes}")
 
-    agent_number = 0
-    for agent in agent_list:
-        # Set the localisation of the agent in the social network
-        agent.network_node = list(graph.nodes)[agent_number]
-        network_dict[agent.network_node] = agent
-        agent_number += 1
-    return graph, network_dict
+    n_edges = m + (num_nodes - m - 1) * m
+    edges = np.empty((n_edges, 2), dtype=np.int64)
+    edges[:m, 0] = 0  # Initial star graph
+    edges[:m, 1] = np.arange(1, m + 1)
+    endpoints = edges.reshape(-1)  # Node repeated once per adjacent edge
+
+    n = m
+    for source in range(m + 1, num_nodes):
+        targets = np.unique(endpoints[rng.integers(0, 2 * n, size=m)])
+        while len(targets) < m:
+            extra = endpoints[rng.integers(0, 2 * n, size=m - len(targets))]
+            targets = np.union1d(targets, extra)
+        edges[n:n + m, 0] = source
+        edges[n:n + m, 1] = targets
+        n += m
+
+    return edges
 
 
-def generate_watts_strogatz(agent_list, p, p_ws, seed=None):
+def generate_watts_strogatz(num_nodes, p, p_ws, rng=None):
     """
-    Generate an Erdos Renyi graph. Add as many nodes as there's agents.
-    :param agent_list: List of agents (citizen)
+    Generate a Watts-Strogatz graph: ring lattice where each node is connected to its k = (n - 1) * p nearest
+    neighbors, then each edge (u, v) is rewired to (u, w) with probability p_ws, avoiding self loops and
+    multiple edges.
+    :param num_nodes: number of nodes (citizens)
     :param p: probability of creating an edge
     :param p_ws: probability of rewiring each edge
-    :param seed: randomization seed
-    :return: networkx graph and dictionnary mapping graph node to agent reference.
+    :param rng: numpy random generator
+    :return: array of edges
     """
-
-    num_nodes = len(agent_list)
+    rng = np.random.default_rng(rng)
     k = int((num_nodes-1)*p)
-    graph = nx.generators.random_graphs.watts_strogatz_graph(num_nodes, k, p_ws, seed)
-    network_dict = dict()
+    if k > num_nodes:
+        raise ValueError("k>n, choose smaller k or larger n")
 
-    agent_number = 0
-    for agent in agent_list:
-        # Set the localisation of the agent in the social network
-        agent.network_node = list(graph.nodes)[agent_number]
-        network_dict[agent.network_node] = agent
-        agent_number += 1
-    return graph, network_dict
+    nodes = np.arange(num_nodes, dtype=np.int64)
+    if k == num_nodes:  # The graph is complete, not Watts-Strogatz
+        sources, targets = np.triu_indices(num_nodes, 1)
+        return np.stack([sources, targets], axis=1).astype(np.int64)
+
+    edges = np.concatenate([np.stack([nodes, (nodes + j) % num_nodes], axis=1) for j in range(1, k // 2 + 1)]
+                           or [np.empty((0, 2), dtype=np.int64)])
+
+    rewired = np.flatnonzero(rng.random(len(edges)) < p_ws)
+    if not len(rewired):
+        return edges
+
+    existing = set((edges[:, 0] * num_nodes + edges[:, 1]).tolist())
+    existing.update((edges[:, 1] * num_nodes + edges[:, 0]).tolist())
+    degree = np.bincount(edges.reshape(-1), minlength=num_nodes)
+
+    for e in rewired.tolist():
+        u, v = int(edges[e, 0]), int(edges[e, 1])
+        if degree[u] >= num_nodes - 1:
+            continue  # skip this rewiring
+        w = int(rng.integers(num_nodes))
+        while w == u or u * num_nodes + w in existing:
+            w = int(rng.integers(num_nodes))
+        existing.difference_update((u * num_nodes + v, v * num_nodes + u))
+        existing.update((u * num_nodes + w, w * num_nodes + u))
+        degree[v] -= 1
+        degree[w] += 1
+        edges[e, 1] = w
+
+    return edges
+
+
+def edges_to_csr(edges, num_nodes, directed=False):
+    """
+    Freeze an edge list into a compressed sparse row (CSR) adjacency structure.
+    Neighbors of node i are indices[indptr[i]:indptr[i + 1]], as returned by networkx neighbors method
+    (successors in case of a directed graph).
+
+    :param edges: array of shape (n_edges, 2) with (source, target) node ids
+    :param num_nodes: Number of nodes in the network
+    :param directed: True if directed, False if undirected (each edge is then stored in both directions)
+    :return: indptr and indices arrays
+    """
+
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    sources, targets = edges[:, 0], edges[:, 1]
+    if not directed:
+        loops = sources == targets  # Self loops are stored once, like networkx neighbors
+        sources, targets = (np.concatenate([sources, targets[~loops]]),
+                            np.concatenate([targets, sources[~loops]]))
+
+    order = np.lexsort((targets, sources))
+    indices = targets[order]
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_nodes), out=indptr[1:])
+
+    return indptr, indices
+
+
+class NetworkCSR:
+    """
+    Social network frozen in compressed sparse row format, used to propagate contagious hardship.
+
+    Every node emits influence * expression_intensity when its agent is active. The received contagion of a node
+    (sum of the emission of its neighbors) is computed for all nodes at once as a sparse matrix-vector product,
+    then kept up to date incrementally when a single node changes of activity or is removed from the network.
+    """
+
+    def __init__(self, indptr, indices, emission, active, directed=False, rows=None, in_indptr=None, in_indices=None):
+        """
+        Create a new CSR social network.
+        :param indptr: CSR row pointers (see edges_to_csr)
+        :param indices: CSR column indices (see edges_to_csr)
+        :param emission: influence * expression_intensity of every node
+        :param active: boolean array, True if the agent at the node is active
+        :param directed: True if directed. Nodes then receive from their successors.
+        :param rows: row of every entry of indices, computed if None
+        :param in_indptr: CSR row pointers of the transposed network (directed only), computed if None
+        :param in_indices: CSR column indices of the transposed network (directed only), computed if None
+        """
+        self.num_nodes = len(indptr) - 1
+        self.directed = directed
+        self.indptr = indptr
+        self.indices = indices
+        self.degree = np.diff(indptr)
+        self.rows = rows if rows is not None else np.repeat(np.arange(self.num_nodes), self.degree)
+
+        # Nodes receiving the emission of a node (predecessors), needed by incremental updates
+        if not directed:
+            self.in_indptr, self.in_indices = self.indptr, self.indices
+        elif in_indptr is not None:
+            self.in_indptr, self.in_indices = in_indptr, in_indices
+        else:
+            self.in_indptr, self.in_indices = edges_to_csr(
+                np.stack([self.indices, self.rows], axis=1), self.num_nodes, directed=True)
+
+        self.emission = np.asarray(emission, dtype=float)
+        self.active = np.asarray(active, dtype=bool).copy()
+        self.removed = np.zeros(self.num_nodes, dtype=bool)
+        self.n_removed = 0
+        self.received = np.zeros(self.num_nodes)
+        self.rebuild()
+
+    @classmethod
+    def from_edges(cls, edges, network_dict, directed=False):
+        """
+        Freeze the edges generated by generate_network.
+        :param edges: array of shape (n_edges, 2) with (source, target) node ids
+        :param network_dict: map between node id (0..n-1) and agent
+        :param directed: True if directed, False if undirected
+        """
+        num_nodes = len(network_dict)
+        agents = [network_dict[n] for n in range(num_nodes)]
+        indptr, indices = edges_to_csr(edges, num_nodes, directed)
+        emission = [agent.influence * agent.expression_intensity for agent in agents]
+        active = [agent.state is State.ACTIVE for agent in agents]
+        return cls(indptr, indices, emission, active, directed)
+
+    def get_arrays(self):
+        """
+        Frozen arrays of the network, used to share it between processes (see shared_population).
+        """
+        arrays = {'indptr': self.indptr, 'indices': self.indices, 'rows': self.rows}
+        if self.directed:
+            arrays.update({'in_indptr': self.in_indptr, 'in_indices': self.in_indices})
+        return arrays
+
+    def rebuild(self):
+        """
+        Recompute the received contagion of every node (sparse matrix-vector product).
+        """
+        weights = self.emission * (self.active & ~self.removed)
+        received = np.bincount(self.rows, weights=weights[self.indices], minlength=self.num_nodes)
+        self.received = received.astype(float, copy=False)  # Graph without edges gives an integer array
+
+    def set_active(self, node, active):
+        """
+        Update the activity of a node and the received contagion of the nodes it emits to.
+        """
+        if self.active[node] == active or self.removed[node]:
+            self.active[node] = active
+            return
+
+        self.active[node] = active
+        receivers = self.in_indices[self.in_indptr[node]:self.in_indptr[node + 1]]
+        self.received[receivers] += self.emission[node] if active else -self.emission[node]
+
+    def remove_node(self, node):
+        """
+        Remove a node from the network. Its edges are kept in the CSR arrays but it doesn't emit anymore
+        and it is excluded from the neighbors of other nodes.
+        """
+        if not self.removed[node]:
+            self.set_active(node, False)
+            self.removed[node] = True
+            self.n_removed += 1
+
+    def neighbors(self, node):
+        """
+        Neighbors of a node (successors in case of a directed graph).
+        :return: array of node ids
+        """
+        neighbors = self.indices[self.indptr[node]:self.indptr[node + 1]]
+        if self.n_removed:
+            neighbors = neighbors[~self.removed[neighbors]]
+        return neighbors
+
+    def to_networkx(self):
+        """
+        Export the network (without removed nodes) as a networkx graph.
+        Optional adapter for the visualization path (portrayal, figures, print_network).
+        """
+        graph = nx.DiGraph() if self.directed else nx.Graph()
+        kept = ~self.removed
+        graph.add_nodes_from(np.flatnonzero(kept).tolist())
+        edges = kept[self.rows] & kept[self.indices]
+        graph.add_edges_from(zip(self.rows[edges].tolist(), self.indices[edges].tolist()))
+        return graph
 
 
 def print_network(G, network_dict):
@@ -0,0 +1,129 @@
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+# On-disk store of the networks shared by the workers of the sweeps (see configure_network_cache), anchored to the
+# package so that it doesn't depend on the working directory of the caller
+NETWORK_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archives', 'network_cache')
+
+# Version of the generated networks, part of the cache keys. Bump it whenever graph_utils.generate_edges (or the
+# format of the edge arrays) changes, so that networks stored by a previous version are never served.
+GENERATOR_VERSION = 1
+
+
+class NetworkCache:
+    """
+    Content-addressed cache of social network edge arrays.
+    Networks are keyed by (generator version, graph_type, n, p, p_ws, directed, seed). They are kept in an in-memory LRU and,
+    if a directory is provided, in an on-disk store of .npy edge arrays shared by every process of a sweep.
+
+    Only networks generated with an explicit seed are cached: with seed=None every replicate must get its own
+    random topology.
+    """
+
+    def __init__(self, max_size=32, directory=None):
+        """
+        Create a new network cache.
+        :param max_size: maximal number of networks kept in memory
+        :param directory: directory of the on-disk store. If None, networks are only cached in memory.
+        """
+        self.max_size = max_size
+        self.directory = directory
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(graph_type, num_nodes, p, p_ws, directed, seed):
+        """
+        Key of a network in the cache, for the current GENERATOR_VERSION.
+        """
+        return GENERATOR_VERSION, str(graph_type), int(num_nodes), float(p), float(p_ws), bool(directed), int(seed)
+
+    def get_path(self, key):
+        """
+        Path of a network in the on-disk store.
+        """
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, 'network_v{}_{}.npy'.format(key[0], digest))
+
+    def get(self, key):
+        """
+        Get a network from the cache.
+        :return: read-only array of edges, None if the network is not cached.
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+
+        if self.directory is not None and os.path.exists(self.get_path(key)):
+            edges = np.load(self.get_path(key))
+            self.put(key, edges, save=False)
+            return self.memory[key]
+
+        return None
+
+    def put(self, key, edges, save=True):
+        """
+        Add a network to the cache.
+        :param key: key from get_key
+        :param edges: array of edges
+        :param save: also write the network in the on-disk store
+        """
+        edges.flags.writeable = False  # Cached networks are shared by every model using them
+        self.memory[key] = edges
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+        if save and self.directory is not None:
+            path = self.get_path(key)
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                np.save(f, edges)
+            os.replace(tmp_path, path)  # Atomic, several workers may write the same network
+
+    def get_or_generate(self, generate, graph_type, num_nodes, p, p_ws, directed=False, seed=None):
+        """
+        Get a network from the cache, generate it (and cache it) if it is not available.
+        :param generate: function generating the edges from (num_nodes, graph_type, p, p_ws, directed, seed)
+        """
+        if seed is None:
+            return generate(num_nodes, graph_type, p, p_ws, directed, seed)
+
+        key = self.get_key(graph_type, num_nodes, p, p_ws, directed, seed)
+        edges = self.get(key)
+        if edges is None:
+            self.misses += 1
+            edges = generate(num_nodes, graph_type, p, p_ws, directed, seed)
+            self.put(key, edges)
+        else:
+            self.hits += 1
+
+        return edges
+
+    def clear(self):
+        """
+        Empty the in-memory cache (the on-disk store is kept).
+        """
+        self.memory.clear()
+
+
+network_cache = NetworkCache()
+
+
+def configure_network_cache(max_size=32, directory=None):
+    """
+    Replace the network cache used by generate_network.
+    Call it before creating a multiprocessing pool so that workers inherit the configuration.
+    :param max_size: maximal number of networks kept in memory
+    :param directory: directory of the on-disk store, None to only cache in memory
+    :return: the new network cache
+    """
+    global network_cache
+    network_cache = NetworkCache(max_size, directory)
+    return network_cache
@@ -2,11 +2,16 @@ import time
 import numpy as np
 import matplotlib.pyplot as plt
 from batchrunner_mp import BatchRunnerMP
-from civil_violence_model import CivilViolenceModel
+from constant_variables import Engine
+from engines import get_model_class
+from network_cache import NETWORK_CACHE_DIR
+from series_store import SeriesWriter
+from simulation_executor import SimulationExecutor
 from utils import *
 
 
-def sensitive_analysis_no_network(problem, replicates=10, max_steps=200, distinct_samples=20, nr_processes=None):
+def sensitive_analysis_no_network(problem, replicates=10, max_steps=200, distinct_samples=20, nr_processes=None,
+                                  engine=Engine.MESA.name, stream_runs=False):
     """
     One-factor-at-a-time (OFAT) sensitivity analysis of civil violence model with network (no bias)
     Work with multiprocessing
@@ -15,10 +20,23 @@ def sensitive_analysis_no_network(problem, replicates=10, max_steps=200, distinc
     :param max_steps: Maximal number of steps of the simulations
     :param distinct_samples: Number of samples per variables
     :param nr_processes: number of CPUs to be used. If None, by default all available CPUs will be used.
+    :param engine: simulation backend (MESA or VECTORIZED, see constant_variables.Engine)
+    :param stream_runs: if True, the step-wise model series of every run are written to a series file as the batches
+        end instead of being kept in memory (see series_store.SeriesReader)
+    :return: dataframe of the final model reporters per variable, and the DataCollector dataframes of every run per
+        variable, or the path of the series file if stream_runs
     """
 
     data = {}
     run_data = {}
+    path = 'archives/saved_data_ofat_{0}.npy'.format(int(time.time()))
+
+    # With stream_runs, step-wise model series are written per variable as the batches end instead of kept in memory
+    run_path = path + '_run.series' if stream_runs else path + '_run'
+    writer = SeriesWriter(run_path) if stream_runs else None
+
+    # Workers are started once and reused by the batches of every variable, models are reset in place.
+    executor = SimulationExecutor(nr_processes, network_cache_dir=NETWORK_CACHE_DIR)
 
     for i, var in enumerate(problem['names']):
         # Get the bounds for this variable and get <distinct_samples> samples within this space (uniform)
@@ -37,40 +55,47 @@ def sensitive_analysis_no_network(problem, replicates=10, max_steps=200, distinc
 
         # BatchRunnerMP used is a local modified version of the BatchRunnerMP class provided by mesa.
         # It handle the multiprocessing issue which prohibite
-        batch = BatchRunnerMP(CivilViolenceModel,
-                            nr_processes=nr_processes,
+        batch = BatchRunnerMP(get_model_class(engine),
+                            executor=executor,
                             max_steps=max_steps,
                             iterations=replicates,
                             variable_parameters={var: samples},
                             fixed_parameters=model_params,
-                            model_reporters={'All_Data': compute_datacollector,  # multiprocessing pool can't handle
-                                             "QUIESCENT": compute_quiescent,     # lambda function.
-                                             "ACTIVE": compute_active,
+                            model_reporters={"QUIESCENT": compute_quiescent,  # multiprocessing pool can't handle
+                                             "ACTIVE": compute_active,        # lambda function.
                                              "JAILED": compute_jailed,
                                              "OUTBREAKS": compute_outbreaks,
                                              "INFLUENCERS": compute_influencers,
-                                             "LEGITIMACY": compute_legitimacy},
+                                             "LEGITIMACY": compute_legitimacy,
+                                             "STOP_STEP": compute_stop_step},
                             display_progress=True)
 
         batch.run_all()
 
         batch_df = batch.get_model_vars_dataframe()
-        batch_df = batch_df.drop('All_Data', axis=1)
 
         data[var] = batch_df
-        run_data[var] = batch.get_collector_model()
+        if stream_runs:
+            for key, series in batch.iter_collector_model():  # Step-wise model series, from the workers arrays
+                writer.append(var, key, series)
+        else:
+            run_data[var] = batch.get_collector_model()  # Step-wise model series, rebuilt from the workers arrays
 
         # Uncomment to save data per parameter.
         # path = 'archives/progress_data_ofat_{0}_{1}.npy'.format(var, int(time.time()))
         # with open(path, 'ab') as f:
         #     np.save(f, data)
 
+    executor.close()
+
     # Save final data
-    path = 'archives/saved_data_ofat_{0}.npy'.format(int(time.time()))
     with open(path, 'ab') as f:
         np.save(f, data)
 
-    run_path = path+'_run'
+    if stream_runs:
+        writer.close()
+        return data, run_path
+
     with open(run_path, 'ab') as f:
         np.save(f, run_data)
 
@@ -126,7 +151,7 @@ def ofat_main():
         'bounds': [[0.01, 1], [0.01, 1], [1, 100], [1, 20], [1, 20]]
     }
 
-    data, run_data = sensitive_analysis_no_network(problem, 10, 200, 20, None)
+    data, run_path = sensitive_analysis_no_network(problem, 10, 200, 20, None, stream_runs=True)
     for param in ("OUTBREAKS", "ACTIVE", "QUIESCENT", "JAILED", "INFLUENCERS", "LEGITIMACY"):
         plot_all_vars(problem, data, param)
         plt.show()
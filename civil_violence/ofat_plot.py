@@ -16,7 +16,8 @@ y_labels = dict({
     "QUIESCENT": "Number of quiescent citizens",
     "JAILED": "Number of jailed citizens",
     "INFLUENCERS": "Number of influencers",
-    "LEGITIMACY": "Central authority legitimacy"
+    "LEGITIMACY": "Central authority legitimacy",
+    "STOP_STEP": "Step of the end of the simulation"
 })
 
 
@@ -1,5 +1,8 @@
 import numpy as np
 import pandas as pd
+from constant_variables import Trailing
+from outbreak_analysis import stack_series, find_outbreaks, get_group_statistics
+from series_store import SeriesReader
 
 '''
 README:
@@ -7,12 +10,15 @@ To run this script, please follow the following steps:
     1. Adjust the following constants such that they correspond to those in the SA.py file. 
     2. Run the ofat_mp.py script. 
     3. Add the paths to the output files from the ofat_mp.py to the file_paths list (line27).
+    A *_run.series file (see series_store) is processed one parameter value at a time, 
+    older *_run.npy archives are loaded in memory. 
     4. Depending on if the output files is a Sensitivity Analysis (multiple dictionaries), 
-    or a fixed run (single dictionary), several lines need to be commented in/out. 
+    or a fixed run (single dictionary), several lines need to be commented in/out (*_run.npy archives only). 
     5. Run the ofat_work.py script. 
 '''
 
 THRESHOLD = 50
+TRAILING = Trailing.EXCLUDE  # Outbreak still running at the end of a run, see outbreak_analysis.find_outbreaks
 ITERATIONS = 10
 STEPS = 20
 N_PARAMS = 6
@@ -47,19 +53,14 @@ def map_keys():
     Keys are of the form: (Parameter value, iteration)
     """
     keys_dict = {}
-    # iter_list = np.arange(ITERATIONS*STEPS).reshape((STEPS, ITERATIONS)) # In case of multiple exported dictionaries.
-    iter_list = np.arange(ITERATIONS)	# In case of a single exported dictionary
+    # iter_list = np.arange(ITERATIONS*STEPS) # In case of multiple exported dictionaries.
+    iter_list = np.tile(np.arange(ITERATIONS), STEPS)	# In case of a single exported dictionary
     for i in range(len(PARAMS)):
-        param_list = []
         if PARAMS[i] == 'max_jail_term':
-            param_range = np.linspace(BOUNDS[i][0], BOUNDS[i][1], STEPS, dtype=np.int32).reshape(STEPS, 1)
+            param_range = np.linspace(BOUNDS[i][0], BOUNDS[i][1], STEPS, dtype=np.int32)
         else:
-            param_range = np.linspace(BOUNDS[i][0], BOUNDS[i][1], STEPS).reshape(STEPS, 1)
-        param_matrix = np.repeat(param_range, ITERATIONS, axis=1)
-        for j in range(STEPS):
-            # param_list.extend(list(zip(param_matrix[j], iter_list[j]))) # In case of multiple exported dictionaries.
-            param_list.extend(list(zip(param_matrix[j], iter_list))) # In case of a single exported dictionary.
-        keys_dict[PARAMS[i]] = param_list
+            param_range = np.linspace(BOUNDS[i][0], BOUNDS[i][1], STEPS)
+        keys_dict[PARAMS[i]] = list(zip(np.repeat(param_range, ITERATIONS), iter_list))
 
     return keys_dict
 
@@ -68,97 +69,59 @@ def get_param_means(data, parameter):
     """
     For a provided parameter, calculates the determined output values for every parameter/iteration
     configuration.
+    The ACTIVE series of every key are stacked and analysed at once (see outbreak_analysis).
 
     Returns a dataframe with the output type as column names. Every row contains the mean values of 
     the set amount of iterations for every parameter configuration.
     """
-    # Initialize outputs
-    output = np.zeros((STEPS, N_OUTPUT))   
     keys = keys_dict[parameter]
+    actives, lengths = stack_series([data[parameter][key]['ACTIVE'] for key in keys])
+
+    # Every key is an iteration, the key list is divided in the different step sizes of the parameter.
+    groups = np.arange(len(keys)) // ITERATIONS
+    output = get_group_statistics(actives, THRESHOLD, groups, lengths, TRAILING)
+
+    output_df = pd.DataFrame({'PARAM_VAL': [keys[i * ITERATIONS][0] for i in range(STEPS)]})
+    for column in ['MEAN_N', 'MEAN_PEAK_HEIGHT', 'MEAN_OUTBREAK_DURATION', 'MAX_PEAK_HEIGHT', 'MAX_OUTBREAK_DURATION']:
+        output_df[column] = output[column]
 
-    # Divide the key list in the different step sizes of the parameter.
-    for i in range(STEPS):
-        peak_heights = []
-        peak_widths = []
-        s_keys = keys[i*ITERATIONS : (i+1)*ITERATIONS]
-        
-        # Every key is an iteration
-        for key in s_keys:
-            actives = data[parameter][key]['ACTIVE']
-            ph, pw = get_outbreaks(actives, THRESHOLD)
-            peak_heights.extend(ph)
-            peak_widths.extend(pw)
-            
-        # Output calculation
-        mean_n_peaks = len(peak_heights)/ITERATIONS
-        mean_peak_height = np.mean(np.array(peak_heights))
-        mean_peak_width = np.mean(peak_widths)
-        max_peak_height = np.max(peak_heights)
-        max_peak_width = np.max(peak_widths)
-
-        output[i] = [key[0], mean_n_peaks, mean_peak_height, mean_peak_width, max_peak_height, max_peak_width]
-
-    output_df = pd.DataFrame({
-        'PARAM_VAL': output[:, 0],
-        'MEAN_N': output[:, 1],
-        'MEAN_PEAK_HEIGHT': output[:, 2],
-        'MEAN_OUTBREAK_DURATION': output[:, 3],
-        'MAX_PEAK_HEIGHT': output[:, 4],
-        'MAX_OUTBREAK_DURATION': output[:, 5]})
-    
     return output_df  # Can also return 'output' if the data is wanted in array form.
 
 
-def get_outbreaks(data, threshold):
+def get_series_means(reader, parameter):
+    """
+    Same output than get_param_means, computed from a series file (see series_store.SeriesReader) in bounded memory:
+    the ACTIVE series of the iterations of a single parameter value are read at a time.
+    The parameter value of a run is the first value of its key.
+    """
+    runs = reader.find_runs(parameter)
+    values = [reader.get_key(run)[0] for run in runs]
+
+    rows = []
+    for value in dict.fromkeys(values):
+        actives, lengths = stack_series([reader.get_series(run, 'ACTIVE')
+                                         for run, run_value in zip(runs, values) if run_value == value])
+        output = get_group_statistics(actives, THRESHOLD, np.zeros(len(lengths)), lengths, TRAILING)
+        rows.append(dict({'PARAM_VAL': value}, **{column: output[column][0] for column in output}))
+
+    return pd.DataFrame(rows)
+
+
+def get_outbreaks(data, threshold, trailing=TRAILING):
     """
     Calculates the outbreaks from the actives data based on a certain threshold.
-    The last codeblock defines the behavior when the provided data ends in an outbreak.
-    Depending on the user, they might want to include/exclude that final outbreak.
+    The trailing argument defines the behavior when the provided data ends in an outbreak.
+    Depending on the user, they might want to include/exclude that final outbreak
+    (including it obviously skewers data, but might be preferable over 0 or infinite outbreaks).
 
     Returns:
         - An array with the peak size of every outbreak.
         - An array with the outbreak durations.
     """
-    outbreak_peaks = []
-    outbreak_widths = []
-    counting = False
-    current_peak = 0
-    start = 0
-
-    for i in range(len(data)):
-
-        if data[i] >= threshold and not counting:
-            counting = True
-            if current_peak < data[i]:
-                current_peak = data[i]
-            start = i
-
-        elif data[i] >= threshold and counting:
-            if current_peak < data[i]:
-                current_peak = data[i]
-
-        elif data[i] < threshold and counting:
-            outbreak_peaks.append(current_peak)
-            outbreak_widths.append(i-start)
-            current_peak = 0
-            counting = False
-
-    if not outbreak_peaks and not counting: # Captures data without outbreaks, empty list break further calculations.
-        outbreak_peaks.append(0)
-        outbreak_widths.append(0)
-
-    # Capture cases where timeline ends in an outbreak.
-    # Uncomment if final outbreak needs to be included in calculation.
-    # Obviously skewers data, but might be preferable over 0 or infinite outbreaks.
-    
-    # if not outbreak_peaks and counting: # Data is a single massive outbreak.
-    #     outbreak_peaks.append(current_peak)
-    #     outbreak_widths.append(len(data))
-    # elif outbreak_peaks and counting: # Data ends in an outbreak.
-    #     outbreak_peaks.append(current_peak)
-    #     outbreak_widths.append(len(data)-start)
- 
-    return outbreak_peaks, outbreak_widths
+    outbreaks = find_outbreaks(np.asarray(data, dtype=float).reshape(1, -1), threshold, trailing=trailing)
+    if not outbreaks['counts'][0]:  # Captures data without outbreaks, empty list break further calculations.
+        return [0], [0]
+    return outbreaks['peak'].tolist(), outbreaks['duration'].tolist()
 
 
 def fix_keys(dictionary):
@@ -187,18 +150,26 @@ def save_csv(name, df):
 
 if __name__ == '__main__':
     # Run the script
-    model_data = load_datacollector()
-    run_data = model_data[file_paths[1]]  # Step-wise DataCollector is only captured in the *_run.npy files.
+    output_data = {}
 
-    for dic in run_data:
-        run_data[dic] = fix_keys(run_data[dic])
+    if file_paths[1].endswith('.series'):
+        # Step-wise model series of the runs, read one parameter value at a time
+        reader = SeriesReader(file_paths[1])
+        for param in reader.get_groups():
+            output_data[param] = get_series_means(reader, param)
+    else:
+        model_data = load_datacollector()
+        run_data = model_data[file_paths[1]]  # Step-wise DataCollector is only captured in the *_run.npy files.
 
-    keys_dict = map_keys()
-    output_data = {}
+        for dic in run_data:
+            run_data[dic] = fix_keys(run_data[dic])
+
+        keys_dict = map_keys()
+
+        # Output calculation
+        for param in run_data.keys():
+            output_data[param] = get_param_means(run_data, param)
 
-    # Output calculation
-    for param in run_data.keys():
-        output_data[param] = get_param_means(run_data, param)
     # Saving output
     for df in output_data:
         save_csv(str(df), output_data[df])
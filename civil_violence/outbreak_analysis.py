@@ -0,0 +1,89 @@
+import numpy as np
+from constant_variables import Trailing
+
+
+def stack_series(series_list):
+    """
+    Stack time series of different lengths in a 2D array (runs x steps), padded with NaN.
+    :param series_list: list of array-like time series (e.g. ACTIVE column of the model dataframes)
+    :return: float array of shape (runs, longest series) and array of the length of every series
+    """
+    lengths = np.array([len(series) for series in series_list], dtype=np.int64)
+    actives = np.full((len(series_list), lengths.max(initial=0)), np.nan)
+    for i, series in enumerate(series_list):
+        actives[i, :lengths[i]] = np.asarray(series, dtype=float)
+    return actives, lengths
+
+
+def find_outbreaks(actives, threshold, lengths=None, trailing=Trailing.EXCLUDE):
+    """
+    Outbreaks (sequences of steps where the number of active citizens is at least threshold) of every run, found in
+    one pass by run-length encoding of the threshold crossings.
+    :param actives: array of shape (runs, steps), padded with NaN after the end of the shorter runs
+    :param threshold: number of active citizens of an outbreak
+    :param lengths: number of steps of every run, all the steps if None
+    :param trailing: Trailing.EXCLUDE to drop an outbreak still running at the end of a run, Trailing.INCLUDE to keep
+        it with its duration until the end of the run
+    :return: dictionary of arrays with an entry per outbreak, ordered by run then start: run, start, duration, peak,
+        and the array of the number of outbreaks of every run ('counts'), trailing ones included
+    """
+    actives = np.asarray(actives, dtype=float)
+    runs, steps = actives.shape
+    if lengths is None:
+        lengths = np.full(runs, steps, dtype=np.int64)
+
+    above = np.zeros((runs, steps + 2), dtype=np.int8)
+    above[:, 1:-1] = actives >= threshold
+    crossings = np.diff(above, axis=1)
+    run, start = np.nonzero(crossings == 1)
+    _, end = np.nonzero(crossings == -1)  # First step below threshold (or end of the array), same order than starts
+
+    # Peak of every outbreak: maximum over [start, end) of the flat array, a sentinel allows end == steps
+    flat = np.append(actives.ravel(), -np.inf)
+    bounds = np.stack([run * steps + start, run * steps + end], axis=1).ravel()
+    peak = np.maximum.reduceat(flat, bounds)[::2] if len(bounds) else np.zeros(0)
+
+    counts = np.bincount(run, minlength=runs)
+    if trailing == Trailing.EXCLUDE:
+        keep = end < lengths[run]
+        run, start, end, peak = run[keep], start[keep], end[keep], peak[keep]
+
+    return {'run': run, 'start': start, 'duration': end - start, 'peak': peak, 'counts': counts}
+
+
+def get_group_statistics(actives, threshold, groups, lengths=None, trailing=Trailing.EXCLUDE, quiet_runs=True):
+    """
+    Outbreak statistics of groups of runs (e.g. the iterations of a parameter value of an OFAT analysis).
+    :param actives: array of shape (runs, steps), see find_outbreaks
+    :param threshold: number of active citizens of an outbreak
+    :param groups: group index (0..n_groups - 1) of every run
+    :param lengths: number of steps of every run, all the steps if None
+    :param trailing: handling of the outbreaks running at the end of a run (see find_outbreaks)
+    :param quiet_runs: a run without any outbreak counts as an outbreak of peak 0 and duration 0, like
+        ofat_post_processing.get_outbreaks did
+    :return: dictionary of arrays with an entry per group: MEAN_N (outbreaks per run), MEAN_PEAK_HEIGHT,
+        MEAN_OUTBREAK_DURATION, MAX_PEAK_HEIGHT, MAX_OUTBREAK_DURATION (NaN for a group without outbreak)
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    n_groups = groups.max(initial=-1) + 1
+    outbreaks = find_outbreaks(actives, threshold, lengths, trailing)
+    group, peak, duration = groups[outbreaks['run']], outbreaks['peak'], outbreaks['duration']
+
+    if quiet_runs:
+        quiet = np.flatnonzero(outbreaks['counts'] == 0)
+        group = np.concatenate([group, groups[quiet]])
+        peak = np.concatenate([peak, np.zeros(len(quiet))])
+        duration = np.concatenate([duration, np.zeros(len(quiet), dtype=np.int64)])
+
+    n = np.bincount(group, minlength=n_groups)
+    max_peak = np.full(n_groups, -np.inf)
+    max_duration = np.full(n_groups, -np.inf)
+    np.maximum.at(max_peak, group, peak)
+    np.maximum.at(max_duration, group, duration)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {'MEAN_N': n / np.bincount(groups, minlength=n_groups),
+                'MEAN_PEAK_HEIGHT': np.bincount(group, peak, n_groups) / n,
+                'MEAN_OUTBREAK_DURATION': np.bincount(group, duration, n_groups) / n,
+                'MAX_PEAK_HEIGHT': np.where(n > 0, max_peak, np.nan),
+                'MAX_OUTBREAK_DURATION': np.where(n > 0, max_duration, np.nan)}
@@ -0,0 +1,93 @@
+import time
+import pandas as pd
+from constant_variables import Phase
+
+
+def _no_clock():
+    return 0.
+
+
+def _no_lap(phase, start):
+    return 0.
+
+
+class PhaseProfiler:
+    """
+    Wall time and number of calls accumulated per phase of a step (see constant_variables.Phase).
+
+    Instrumented code reads the clock at the start of a sequence of phases and calls lap at the end of each phase:
+        start = profiler.clock()
+        ...
+        start = profiler.lap(Phase.CONTAGION, start)
+    A disabled profiler replaces clock and lap by functions returning 0, so the instrumentation only costs two
+    calls per phase.
+    """
+
+    def __init__(self, enabled=False):
+        """
+        Create a new profiler.
+        :param enabled: accumulate the timings, otherwise clock and lap do nothing
+        """
+        self.enabled = enabled
+        self.seconds = {phase: 0. for phase in Phase}
+        self.calls = {phase: 0 for phase in Phase}
+        if not enabled:
+            self.clock = _no_clock
+            self.lap = _no_lap
+
+    @staticmethod
+    def clock():
+        """
+        Current time, start of the next phase.
+        """
+        return time.perf_counter()
+
+    def lap(self, phase, start):
+        """
+        End a phase started at start.
+        :param phase: phase which ended (see constant_variables.Phase)
+        :param start: time at the start of the phase (see clock)
+        :return: current time, start of the next phase
+        """
+        now = time.perf_counter()
+        self.seconds[phase] += now - start
+        self.calls[phase] += 1
+        return now
+
+    def get_totals(self):
+        """
+        Accumulated timings, JSON and pickle friendly.
+        :return: dictionary phase name -> (seconds, calls)
+        """
+        return {phase.name: (self.seconds[phase], self.calls[phase]) for phase in Phase}
+
+    def summary(self):
+        """
+        Summary table of the timings (see profile_table).
+        """
+        return profile_table([self.get_totals()])
+
+
+def profile_table(profiles):
+    """
+    Aggregate the timings of several runs, for instance the PROFILE reporter of the runs of a BatchRunnerMP batch
+    (see utils.compute_profile), in a summary table.
+    :param profiles: iterable of timings (see PhaseProfiler.get_totals), None values are ignored
+    :return: dataframe indexed by phase with total seconds, calls, share of the step time and µs per call,
+        the slowest phases first
+    """
+    seconds = {phase.name: 0. for phase in Phase}
+    calls = {phase.name: 0 for phase in Phase}
+    for profile in profiles:
+        if profile is None:
+            continue
+        for name, (phase_seconds, phase_calls) in profile.items():
+            seconds[name] += phase_seconds
+            calls[name] += phase_calls
+
+    table = pd.DataFrame({'seconds': seconds, 'calls': calls})
+    table.index.name = 'phase'
+    total = table['seconds'].sum()
+    table['share'] = table['seconds'] / total if total else 0.
+    table['us_per_call'] = 1e6 * table['seconds'] / table['calls'].where(table['calls'] > 0)
+    return table.sort_values('seconds', ascending=False)
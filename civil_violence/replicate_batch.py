@@ -0,0 +1,592 @@
+import numpy as np
+import pandas as pd
+from constant_variables import State, GraphType, HardshipConst, Collection, Draw
+from graph_utils import load_or_generate_edges, edges_to_csr, NetworkCSR
+from vision import von_neumann_offsets, diamond_sum, draw_without_replacement
+from columnar_datacollector import ColumnarDataCollector
+from agent_rng import AgentStreams
+
+REPORTERS = ["QUIESCENT", "ACTIVE", "JAILED", "LEGITIMACY", "INFLUENCERS", "OUTBREAKS", "STOP_STEP"]
+
+
+class ReplicateBatchModel:
+    """
+    Independent replicates of the civil violence model (vectorized engine rules) advanced together.
+
+    The grids of the replicates are stacked (cell r * width * height + x * height + y of replicate r), the citizens
+    and cops of every replicate are concatenated (see citizen_rep and cop_rep) and the social network is the disjoint
+    union of the networks of the replicates. A step of all the replicates is then a single set of array operations,
+    instead of one pass of the vectorized engine per replicate. Model reporters are collected per replicate.
+    """
+    def __init__(self,
+                 replicates=4,
+                 max_iter=200,
+                 height=40, width=40,
+                 agent_density=0.7, agent_vision=7,
+                 active_agent_density=0.01,
+                 cop_density=0.04, cop_vision=7,
+                 inf_threshold=40, tackle_inf=False,
+                 k=2.3, graph_type=GraphType.BARABASI_ALBERT.name,
+                 p=0.1, p_ws=0.1,
+                 directed=False, max_jail_term=30,
+                 active_threshold_t=0.1, initial_legitimacy_l0=0.82,
+                 movement=True, seed=None, population_seed=None,
+                 agent_collection=Collection.MODEL_ONLY.name, collection_interval=1, collection_sample=0.1,
+                 steady_state_window=0, steady_state_tolerance=0.):
+        """
+        Create a batch of replicates of the civil violence model.
+        Parameters are the same than VectorizedCivilViolenceModel (shared populations are not supported).
+        :param replicates: number of replicates, each with its own population and social network
+        :param seed: random seed of the batch. Replicate r uses seed + r (streams and network): it follows the same
+            trajectory than VectorizedCivilViolenceModel with seed + r.
+        :param population_seed: random seed of the populations (placement, static attributes and social network),
+            replicate r uses population_seed + r (seed + r if None)
+        :param steady_state_window: a replicate reaching the steady state (see utils.steady_state_reached) is frozen:
+            its reporters keep the values of the stop. The batch stops once every replicate is frozen.
+
+        Additional attributes:
+            citizen_rep, cop_rep : replicate of each citizen and cop
+            streams : random streams of every replicate (see AgentStreams), agent_key maps the global index of an
+                agent (citizens then cops) to its stream id in the concatenated draws of the replicates
+            cell_agent : stacked flat grids storing the index of the agent in the cell, -1 if empty.
+                Cops are indexed after citizens (n_citizens + cop index).
+            legitimacy, outbreaks, stop_step : one value per replicate (stop_step is -1 while the replicate runs)
+            series : collected model reporters, arrays of shape (steps, replicates)
+        """
+        self.replicates = replicates
+        self.seed = seed
+        self.streams = [AgentStreams(None if seed is None else seed + r) for r in range(replicates)]
+
+        self.height = height
+        self.width = width
+        self.n_cells = width * height
+        self.max_iter = max_iter
+        self.steady_state_window = steady_state_window
+        self.steady_state_tolerance = steady_state_tolerance
+        self.iteration = 0
+        self.movement = movement
+
+        self.max_jail_term = max_jail_term
+        self.active_threshold_t = active_threshold_t
+        self.initial_legitimacy_l0 = initial_legitimacy_l0
+        self.legitimacy = np.full(replicates, float(initial_legitimacy_l0))
+        self.k = k
+        self.graph_type = graph_type
+
+        self.agent_density = agent_density
+        self.agent_vision = agent_vision
+        self.active_agent_density = active_agent_density
+        self.cop_density = cop_density
+        self.cop_vision = cop_vision
+        self.inf_threshold = inf_threshold
+
+        self.jailings = np.zeros((4, replicates))  # jailings_list of every replicate
+        self.outbreaks = np.zeros(replicates, dtype=np.int64)
+        self.outbreak_now = np.zeros(replicates, dtype=bool)
+        self.outbreak_influencer_now = np.zeros(replicates, dtype=bool)
+        self.tackle_inf = tackle_inf
+        self.stop_step = np.full(replicates, -1, dtype=np.int64)
+        self._offsets_cache = {}
+
+        self.generate_population(graph_type, p, p_ws, directed, population_seed)
+
+        # Citizen dynamic columns
+        self.hardship_cont = np.zeros(self.n_citizens)
+        self.hardship = np.array(self.hardship_endo)
+        self.threshold = np.where(self.enforced_active, 0., self.active_threshold_t)
+        self.state = np.where(self.enforced_active, State.ACTIVE.value, State.QUIESCENT.value).astype(np.int8)
+        self.jail_sentence = np.zeros(self.n_citizens, dtype=np.int64)
+        self.grievance = self.hardship * (1 - self.legitimacy[self.citizen_rep])
+
+        # Stacked grids
+        self.cell_agent = np.full(self.replicates * self.n_cells, -1, dtype=np.int64)
+        self.cell_agent[self.citizen_pos] = np.arange(self.n_citizens)
+        self.cell_agent[self.cop_pos] = self.n_citizens + np.arange(self.n_cops)
+
+        # Social network
+        self.network_csr = NetworkCSR(self.indptr, self.indices, self.influence * self.expression_intensity,
+                                      self.state == State.ACTIVE.value, self.directed)
+
+        self.influencer = self.network_csr.degree > self.inf_threshold
+        self.influencer_list = np.flatnonzero(self.influencer)  # Sorted, hence grouped by replicate
+        self.influencer_count = np.bincount(self.citizen_rep[self.influencer_list], minlength=replicates)
+
+        self.capacity = self.max_iter + 2
+        self.series = {name: np.zeros((self.capacity, replicates),
+                                      dtype=float if name == "LEGITIMACY" else np.int64) for name in REPORTERS}
+        self.n_collected = 0
+
+        self.running = True
+        self.collect()
+
+    def generate_population(self, graph_type, p, p_ws, directed, population_seed):
+        """
+        Place the agents of every replicate on its grid, draw their static attributes and generate the social
+        networks (same rules than VectorizedCivilViolenceModel.generate_population).
+        :param population_seed: random seed of the populations, seed of the batch if None
+        """
+        columns = {draw: [] for draw in [Draw.HARDSHIP, Draw.SUSCEPTIBILITY, Draw.INFLUENCE,
+                                         Draw.EXPRESSION_INTENSITY, Draw.RISK_AVERSION]}
+        citizen_pos, cop_pos, enforced_active, edges = [], [], [], []
+        n_citizens = 0
+        for r, streams in enumerate(self.streams):
+            if population_seed is None:
+                replicate_seed = None if self.seed is None else self.seed + r
+            else:
+                replicate_seed = population_seed + r
+                streams = AgentStreams(replicate_seed)
+            draws = streams.uniforms(0, Draw.PLACEMENT, self.n_cells)
+            citizen_cells = np.flatnonzero(draws < self.agent_density + self.active_agent_density)
+            cop_cells = np.flatnonzero((draws >= self.agent_density + self.active_agent_density)
+                                       & (draws < self.agent_density + self.active_agent_density + self.cop_density))
+
+            citizen_pos.append(r * self.n_cells + citizen_cells)
+            cop_pos.append(r * self.n_cells + cop_cells)
+            enforced_active.append(draws[citizen_cells] >= self.agent_density)
+            for draw, column in columns.items():
+                column.append(streams.uniforms(0, draw, self.n_cells)[citizen_cells])
+
+            edges.append(np.asarray(load_or_generate_edges(len(citizen_cells), graph_type, p, p_ws, directed,
+                                                           replicate_seed)).reshape(-1, 2) + n_citizens)
+            n_citizens += len(citizen_cells)
+
+        citizen_counts = np.array([len(pos) for pos in citizen_pos])
+        cop_counts = np.array([len(pos) for pos in cop_pos])
+        self.citizen_rep = np.repeat(np.arange(self.replicates), citizen_counts)
+        self.cop_rep = np.repeat(np.arange(self.replicates), cop_counts)
+        self.citizen_pos = np.concatenate(citizen_pos).astype(np.int64)
+        self.cop_pos = np.concatenate(cop_pos).astype(np.int64)
+        self.n_citizens = len(self.citizen_pos)
+        self.n_cops = len(self.cop_pos)
+
+        # Stream id of every agent: citizens then cops of each replicate, replicates one after the other
+        self.n_streams = citizen_counts + cop_counts
+        stream_start = np.concatenate([[0], np.cumsum(self.n_streams)[:-1]])
+        citizen_start = np.concatenate([[0], np.cumsum(citizen_counts)[:-1]])
+        cop_start = np.concatenate([[0], np.cumsum(cop_counts)[:-1]])
+        self.agent_key = np.concatenate([
+            stream_start[self.citizen_rep] + np.arange(self.n_citizens) - citizen_start[self.citizen_rep],
+            stream_start[self.cop_rep] + citizen_counts[self.cop_rep] + np.arange(self.n_cops) - cop_start[self.cop_rep]])
+
+        # Citizen static columns
+        self.enforced_active = np.concatenate(enforced_active)
+        self.hardship_endo = np.concatenate(columns[Draw.HARDSHIP])
+        self.susceptibility = np.concatenate(columns[Draw.SUSCEPTIBILITY])
+        self.influence = np.concatenate(columns[Draw.INFLUENCE])
+        self.expression_intensity = np.concatenate(columns[Draw.EXPRESSION_INTENSITY])
+        self.risk_aversion = np.concatenate(columns[Draw.RISK_AVERSION])
+
+        self.indptr, self.indices = edges_to_csr(np.concatenate(edges), self.n_citizens, directed)
+        self.directed = directed
+
+    def run(self, max_steps=200):
+        """
+        Step every replicate until the batch stops or max_steps steps.
+        """
+        while self.running and self.iteration < max_steps:
+            self.step()
+        return self
+
+    def step(self):
+        """
+        One step of every replicate
+        """
+        self.citizens_step()
+        self.cops_step()
+        self.iteration += 1
+        self.update_legitimacy()
+
+        self.outbreak_score_monitoring()
+        steady = self.get_steady_replicates()
+        self.collect()
+        self.stop_step[steady] = self.iteration
+
+        # Stop the batch after a certain amount of iterations, or earlier once every replicate settled.
+        if self.iteration > self.max_iter or (self.stop_step >= 0).all():
+            self.pad(self.max_iter + 2)
+            self.running = False
+
+    def citizens_step(self):
+        """
+        Citizen agent rules (Epstein 2002 model) applied to every citizen of every replicate at once.
+        """
+
+        # Jailed agent can't perform any action
+        # After sentence resets state and contagious hardship
+        jailed = self.jail_sentence > 0
+        self.jail_sentence[jailed] -= 1
+        released = np.flatnonzero(jailed & (self.jail_sentence == 0))
+        if released.size:
+            self.state[released] = State.QUIESCENT.value
+            self.hardship_cont[released] = 0
+            self.add_jailed(released)
+
+        acting = np.flatnonzero(~jailed)
+        if not acting.size:
+            return
+
+        # Contagious hardship, computed from the state of the networks before the update
+        received = self.get_received_hardship()
+        to_update = acting[self.hardship[acting] < 1]
+        self.hardship_cont[to_update] += received[to_update]
+        self.hardship[acting] = np.minimum(self.hardship_cont[acting] + self.hardship_endo[acting], 1)
+        self.grievance[acting] = self.hardship[acting] * (1 - self.legitimacy[self.citizen_rep[acting]])
+
+        pos = self.citizen_pos[acting]
+        c_v = self.count_in_vision(pos, self.get_cop_layer(), self.agent_vision)
+        a_v = self.count_in_vision(pos, self.get_active_layer(), self.agent_vision)
+        cop_to_agent_ratio = np.floor_divide(c_v, a_v + 1)
+        net_risk = self.risk_aversion[acting] * (1 - np.exp(-1 * self.k * cop_to_agent_ratio))
+
+        rule_a = self.grievance[acting] - net_risk > self.threshold[acting]
+        self.state[acting] = np.where(rule_a, State.ACTIVE.value, State.QUIESCENT.value)
+
+        # Move agents in the 2D Grids
+        if self.movement:
+            targets = self.sample_in_vision(pos, self.cell_agent == -1, self.agent_vision,
+                                            self.get_uniforms(Draw.MOVE)[acting])
+            self.move_agents(acting, pos, targets)
+
+    def cops_step(self):
+        """
+        Cops inspect their vision and arrest a random active citizen, then move there.
+        Cops without active citizen in vision move to a random empty cell.
+        """
+        if not self.n_cops:
+            return
+
+        cops = np.arange(self.n_cops)
+        targets = self.sample_in_vision(self.cop_pos, self.get_active_layer(), self.cop_vision,
+                                        self.get_uniforms(Draw.ARREST)[self.n_citizens + cops])
+
+        # Two cops can target the same citizen, only the first one (in activation order) arrests it.
+        arresting = self.resolve_conflicts(self.n_citizens + cops, targets)
+
+        if arresting.size:
+            cells = targets[arresting]
+            arrestees = self.cell_agent[cells]
+            self.jail(arrestees, Draw.SENTENCE)
+
+            if self.movement:
+                self.cell_agent[self.cop_pos[arresting]] = -1
+                self.cop_pos[arresting] = cells
+                self.cell_agent[cells] = self.n_citizens + arresting
+
+        # No active citizens, move to random empty cell
+        if self.movement:
+            idle = np.setdiff1d(cops, arresting, assume_unique=True)
+            pos = self.cop_pos[idle]
+            empty_targets = self.sample_in_vision(pos, self.cell_agent == -1, self.cop_vision,
+                                                  self.get_uniforms(Draw.MOVE)[self.n_citizens + idle])
+            self.move_agents(self.n_citizens + idle, pos, empty_targets)
+
+    def get_received_hardship(self, hardship_params=HardshipConst):
+        """
+        Received contagious hardship of every citizen from its active network neighbors.
+        :param hardship_params: default values
+        :return: array of received hardship per citizen
+        """
+        distance = hardship_params.DISTANCE.value
+        timestep = hardship_params.TIME_STEP.value
+        transmission_rate = hardship_params.TRANSMISSION_RATE.value
+        hardship = hardship_params.HARDSHIP.value
+
+        self.network_csr.active = self.state == State.ACTIVE.value
+        self.network_csr.rebuild()
+
+        return hardship + distance * timestep * transmission_rate * self.network_csr.received * self.susceptibility
+
+    def get_offsets(self, radius):
+        """
+        Von Neumann neighborhood offsets of a given radius (center excluded), wrapped on the torus.
+        """
+        if radius not in self._offsets_cache:
+            self._offsets_cache[radius] = von_neumann_offsets(radius, self.width, self.height)
+        return self._offsets_cache[radius]
+
+    def count_in_vision(self, pos, layer, radius):
+        """
+        Sum a per-cell layer over the von Neumann neighborhood of every position.
+        Vision counts are computed for the stacked grids at once (see vision.diamond_sum).
+        :param pos: flat positions (stacked grids)
+        :param layer: per-cell values (stacked flat grids)
+        :param radius: vision radius
+        """
+        grid_layer = layer.astype(np.int64).reshape(self.replicates, self.width, self.height)
+        return diamond_sum(grid_layer, radius).ravel()[pos]
+
+    def sample_in_vision(self, pos, layer, radius, draws):
+        """
+        Pick uniformly, for every position, a cell of its von Neumann neighborhood (in its own grid) where layer is
+        True. Candidates are ranked in the order of the offsets.
+        :param pos: flat positions (stacked grids)
+        :param layer: boolean per-cell mask (stacked flat grids)
+        :param radius: vision radius
+        :param draws: uniform draw of every position
+        :return: flat index of the selected cells, -1 if there is no candidate
+        """
+        available = self.count_in_vision(pos, layer, radius)
+        rank = np.floor(draws * available).astype(np.int64)
+        chosen = np.full(len(pos), -1, dtype=np.int64)
+
+        grid_start = pos - pos % self.n_cells
+        x, y = np.divmod(pos % self.n_cells, self.height)
+        seen = np.zeros(len(pos), dtype=np.int64)
+        for dx, dy in zip(*self.get_offsets(radius)):
+            cells = grid_start + ((x + dx) % self.width) * self.height + (y + dy) % self.height
+            hit = layer[cells]
+            select = hit & (seen == rank) & (chosen < 0)
+            chosen[select] = cells[select]
+            seen += hit
+
+        return chosen
+
+    def get_replicate_uniforms(self, draw):
+        """
+        Uniform draws of a purpose at the current step, concatenated over the replicates (indexed by agent_key).
+        """
+        return np.concatenate([streams.uniforms(self.iteration, draw, n_streams)
+                               for streams, n_streams in zip(self.streams, self.n_streams.tolist())])
+
+    def get_uniforms(self, draw):
+        """
+        Uniform draws of every agent (global index, cops after citizens) for a purpose at the current step.
+        """
+        return self.get_replicate_uniforms(draw)[self.agent_key]
+
+    def resolve_conflicts(self, agents, targets):
+        """
+        Agents targeting the same cell are resolved in activation order (ORDER draw, see StreamActivation).
+        :param agents: global index of the agents
+        :param targets: target of every agent, -1 if none
+        :return: indices (in agents) of the agents getting their target
+        """
+        candidates = np.flatnonzero(targets >= 0)
+        order = candidates[np.argsort(self.get_uniforms(Draw.ORDER)[agents[candidates]], kind='stable')]
+        _, first = np.unique(targets[order], return_index=True)
+        return order[first]
+
+    def move_agents(self, agents, pos, targets):
+        """
+        Move agents (global index, cops after citizens) to their target cell.
+        Agents targeting the same cell are resolved in activation order, the others stay in place.
+        """
+        movers = self.resolve_conflicts(agents, targets)
+
+        agents, pos, targets = agents[movers], pos[movers], targets[movers]
+        self.cell_agent[pos] = -1
+        self.cell_agent[targets] = agents
+
+        is_citizen = agents < self.n_citizens
+        self.citizen_pos[agents[is_citizen]] = targets[is_citizen]
+        self.cop_pos[agents[~is_citizen] - self.n_citizens] = targets[~is_citizen]
+
+    def get_cop_layer(self):
+        """
+        Per-cell flag of cops presence.
+        """
+        return self.cell_agent >= self.n_citizens
+
+    def get_active_layer(self):
+        """
+        Per-cell flag of active citizens presence (jailed citizens are not on the grids).
+        """
+        layer = np.zeros(self.replicates * self.n_cells, dtype=bool)
+        on_grid = self.citizen_pos >= 0
+        layer[self.citizen_pos[on_grid]] = self.state[on_grid] == State.ACTIVE.value
+        return layer
+
+    def outbreak_score_monitoring(self):
+        active = self.count_type_citizens("ACTIVE")
+        if self.tackle_inf:
+            triggered = (active > 30) & ~self.outbreak_influencer_now
+            if triggered.any():
+                self.jail_influencer(triggered)
+                self.outbreak_influencer_now |= triggered
+
+            self.outbreak_influencer_now[active < 30] = False
+
+        # Count amount of outbreaks
+        starting = (active > 50) & ~self.outbreak_now
+        self.outbreaks += starting  # Total number of outbreak
+        self.outbreak_now |= starting  # Indicate if outbreak now
+        self.outbreak_now[active < 50] = False
+
+    def update_legitimacy(self):
+        """
+        Compute legitimacy of every replicate (Epstein Working Paper 2001)
+        """
+        self.jailings[2:] = self.jailings[1:3].copy()
+        nb_active_and_quiescent = self.count_type_citizens("ACTIVE") + self.count_type_citizens("QUIESCENT")
+        self.jailings[1] = self.jailings[0] / nb_active_and_quiescent
+        self.jailings[0] = 0
+
+        # Python float powers, numpy array powers may round differently than the single model engines
+        sum_jailed = np.array([j1 - j2 ** 2 - j3 ** 3 for j1, j2, j3 in zip(*self.jailings[1:].tolist())])
+        self.legitimacy = np.maximum(self.initial_legitimacy_l0 * (1 - sum_jailed), 0)
+
+    def count_states(self):
+        """
+        Number of citizens in each state, per replicate.
+        :return: array of shape (3, replicates), rows QUIESCENT, ACTIVE and JAILED
+        """
+        codes = self.citizen_rep * 3 + (self.state - State.QUIESCENT.value)
+        return np.bincount(codes, minlength=3 * self.replicates).reshape(self.replicates, 3).T
+
+    def count_type_citizens(self, state_req):
+        """
+        Helper method to count citizens in a given state.
+        :return: array of counts per replicate
+        """
+        return self.count_states()[State[state_req].value - State.QUIESCENT.value]
+
+    def jail(self, citizens, draw):
+        """
+        Jail citizens for a random sentence and remove them from the grids.
+        :param draw: purpose of the sentence draws (SENTENCE or INFLUENCER_SENTENCE)
+        """
+        self.jail_sentence[citizens] = 1 + np.floor(
+            self.get_uniforms(draw)[citizens] * self.max_jail_term).astype(np.int64)
+        self.state[citizens] = State.JAILED.value
+        self.jailings[0] += np.bincount(self.citizen_rep[citizens], minlength=self.replicates)
+        self.cell_agent[self.citizen_pos[citizens]] = -1
+        self.citizen_pos[citizens] = -1
+
+    def add_jailed(self, citizens):
+        """
+        Un-jail citizens
+        Place citizens whose sentence is over back on random empty cells of the grid of their replicate.
+        One at a time, in index order, each citizen takes a cell among the remaining sorted empty cells of its grid.
+        """
+        draws = self.get_uniforms(Draw.RELEASE)
+
+        for r in np.unique(self.citizen_rep[citizens]).tolist():
+            released = np.sort(citizens[self.citizen_rep[citizens] == r])
+            grid = slice(r * self.n_cells, (r + 1) * self.n_cells)
+            grid_empties = r * self.n_cells + np.flatnonzero(self.cell_agent[grid] == -1)
+            if len(grid_empties) < len(released):
+                raise Exception("There are no empty cells.")
+
+            cells = grid_empties[draw_without_replacement(len(grid_empties), draws[released])]
+            self.citizen_pos[released] = cells
+            self.cell_agent[cells] = released
+
+    def jail_influencer(self, triggered):
+        """
+        Jail random citizens with the influencer tag, in the given replicates.
+        :param triggered: boolean array, True for the replicates where influencers are jailed
+        """
+        influencer_reps = self.citizen_rep[self.influencer_list]
+        for r in np.flatnonzero(triggered).tolist():
+            influencers = self.influencer_list[influencer_reps == r]
+            n = len(influencers)
+            if not n:
+                continue
+
+            # As many draws (with replacement) as influencers, among the influencers of the replicate
+            draws = self.streams[r].uniforms(self.iteration, Draw.INFLUENCER, self.n_streams[r])[:n]
+            picked = np.unique(influencers[np.floor(draws * n).astype(np.int64)])
+            self.jail(picked[self.state[picked] != State.JAILED.value], Draw.INFLUENCER_SENTENCE)
+
+    def get_steady_replicates(self):
+        """
+        Replicates reaching the steady state at this step (see utils.steady_state_reached).
+        :return: boolean array
+        """
+        window = self.steady_state_window
+        if window <= 0 or self.n_collected < window:
+            return np.zeros(self.replicates, dtype=bool)
+
+        counts = self.count_states()
+        citizens = counts.sum(axis=0)
+        steady = self.stop_step < 0
+        for name, current, scale in [("ACTIVE", counts[1], citizens),
+                                     ("JAILED", counts[2], citizens),
+                                     ("LEGITIMACY", self.legitimacy, 1.)]:
+            values = self.series[name][self.n_collected - window:self.n_collected]
+            variation = np.maximum(values.max(axis=0), current) - np.minimum(values.min(axis=0), current)
+            steady &= variation <= self.steady_state_tolerance * scale
+        return steady
+
+    def collect(self):
+        """
+        Collect the model reporters of every replicate. Frozen replicates keep the values of their stop.
+        """
+        if self.n_collected == self.capacity:
+            self.capacity *= 2
+            for name, array in self.series.items():
+                self.series[name] = np.resize(array, (self.capacity, self.replicates))
+
+        counts = self.count_states()
+        reports = {"QUIESCENT": counts[0], "ACTIVE": counts[1], "JAILED": counts[2], "LEGITIMACY": self.legitimacy,
+                   "INFLUENCERS": self.influencer_count, "OUTBREAKS": self.outbreaks,
+                   "STOP_STEP": np.full(self.replicates, self.iteration)}
+
+        row = self.n_collected
+        frozen = self.stop_step >= 0
+        for name, values in reports.items():
+            self.series[name][row] = np.where(frozen, self.series[name][row - 1], values)
+        self.n_collected += 1
+
+    def pad(self, n_rows):
+        """
+        Repeat the last collection until n_rows collections (batch stopped early, every replicate being frozen).
+        """
+        if self.n_collected >= n_rows:
+            return
+        for name, array in self.series.items():
+            if len(array) < n_rows:
+                array = self.series[name] = np.resize(array, (n_rows, self.replicates))
+            array[self.n_collected:n_rows] = array[self.n_collected - 1]
+        self.n_collected = n_rows
+
+    def get_model_array(self, name):
+        """
+        Collected values of a model reporter
+        :return: array of shape (steps, replicates)
+        """
+        return self.series[name][:self.n_collected]
+
+    def get_model_vars_dataframe(self, replicate):
+        """
+        Collected model reporters of a replicate, like the data collector of a single model.
+        """
+        return pd.DataFrame({name: self.get_model_array(name)[:, replicate] for name in REPORTERS})
+
+    def get_collectors(self):
+        """
+        Read-only data collector of every replicate (see ColumnarDataCollector.from_arrays).
+        """
+        meta = {'model_reporters': REPORTERS, 'agent_reporters': {}, 'agent_collection': Collection.MODEL_ONLY.name}
+        return [ColumnarDataCollector.from_arrays(
+            {'model/' + name: self.get_model_array(name)[:, r] for name in REPORTERS}, meta)
+            for r in range(self.replicates)]
+
+    def get_final_values(self):
+        """
+        Model reporters of every replicate at the end of the run.
+        :return: dataframe indexed by replicate
+        """
+        return pd.DataFrame({name: self.get_model_array(name)[-1] for name in REPORTERS},
+                            index=pd.RangeIndex(self.replicates, name="Run"))
+
+
+def run_replicates(replicates, max_steps, model_reporters, fixed_parameters):
+    """
+    Run replicates of a configuration as a replicate batch, results are formatted like a mesa BatchRunner with
+    fixed parameters only.
+    :param replicates: number of replicates
+    :param max_steps: maximal number of steps
+    :param model_reporters: names of the model reporters (see REPORTERS) collected at the end of the runs
+    :param fixed_parameters: parameters of the model
+    :return: dataframe of the model reporters (get_model_vars_dataframe) and dictionary of the step-wise dataframes
+        (get_collector_model)
+    """
+    model = ReplicateBatchModel(replicates=replicates, **fixed_parameters).run(max_steps)
+
+    data = model.get_final_values()[sorted(model_reporters)].reset_index()
+    for param, value in fixed_parameters.items():
+        data[param] = [value] * len(data)
+
+    run_data = {(r,): model.get_model_vars_dataframe(r) for r in range(replicates)}
+    return data, run_data
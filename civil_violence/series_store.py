@@ -0,0 +1,163 @@
+import json
+import numpy as np
+import pandas as pd
+from batch_results import ALIGNMENT
+
+MAGIC = b'CVSERIES'
+
+
+def to_json_key(key):
+    """
+    Run key (tuple of parameter values and iteration) as a JSON list.
+    """
+    return [value.item() if isinstance(value, np.generic) else value for value in key]
+
+
+class SeriesWriter:
+    """
+    Append-only file of the step-wise model series of the runs of a sweep, replacing the pickled dictionaries of
+    DataCollector dataframes (see SeriesReader).
+
+    Layout: 8 bytes magic, then the raw data of every series of every run (aligned on 8 bytes) in the order of the
+    appends, then a JSON index ({'runs': [{'group', 'key', 'columns': {name: dtype, offset and length}}]}) and its
+    length on 8 bytes (little endian). Runs are written as they are appended, only the index is kept in memory.
+    """
+
+    def __init__(self, path):
+        """
+        Create a new series file.
+        :param path: path of the file (overwritten)
+        """
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.offset = len(MAGIC)
+        self.runs = []
+
+    def append(self, group, key, series):
+        """
+        Append the series of a run.
+        :param group: group of the run, JSON-serializable (e.g. the varied parameter of an OFAT analysis)
+        :param key: key of the run (tuple of parameter values and iteration)
+        :param series: dictionary of 1D arrays (reporter name -> value at every step), object dtype not supported
+        """
+        columns = {}
+        for name, values in series.items():
+            values = np.ascontiguousarray(values)
+            if values.dtype.hasobject:
+                raise ValueError("Series {} of object dtype can't be written.".format(name))
+            padding = -values.nbytes % ALIGNMENT
+            self.file.write(values.tobytes() + bytes(padding))
+            columns[name] = {'dtype': values.dtype.str, 'offset': self.offset, 'length': len(values)}
+            self.offset += values.nbytes + padding
+
+        self.runs.append({'group': group, 'key': to_json_key(key), 'columns': columns})
+
+    def close(self):
+        """
+        Write the index and close the file. A file without index (writer not closed) can't be read.
+        """
+        if self.file is None:
+            return
+        index = json.dumps({'runs': self.runs}).encode()
+        self.file.write(index)
+        self.file.write(len(index).to_bytes(8, 'little'))
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SeriesReader:
+    """
+    Read a series file (see SeriesWriter) through a memory map: only the index is loaded, the series of a run are
+    read-only views on the file, read from disk when used. Sweeps can then be processed one run (or one group of
+    runs) at a time in bounded memory.
+    """
+
+    def __init__(self, path):
+        """
+        Open a series file.
+        :param path: path of the file
+        """
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self.buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError("{} is not a series file.".format(path))
+
+        size = int.from_bytes(bytes(self.buffer[-8:]), 'little')
+        self.runs = json.loads(bytes(self.buffer[-8 - size:-8]).decode())['runs']
+        for run in self.runs:
+            run['key'] = tuple(run['key'])
+
+    def __len__(self):
+        return len(self.runs)
+
+    def get_groups(self):
+        """
+        Groups of the runs, in order of first appearance.
+        """
+        return list(dict.fromkeys(run['group'] for run in self.runs))
+
+    def find_runs(self, group=None):
+        """
+        Index of the runs of a group (every run if None), in order of appearance.
+        """
+        return [i for i, run in enumerate(self.runs) if group is None or run['group'] == group]
+
+    def get_key(self, run):
+        """
+        Key (tuple of parameter values and iteration) of a run.
+        :param run: index of the run
+        """
+        return self.runs[run]['key']
+
+    def get_series(self, run, name):
+        """
+        Series of a run (read-only view on the file).
+        :param run: index of the run
+        :param name: name of the series (model reporter)
+        """
+        layout = self.runs[run]['columns'][name]
+        dtype = np.dtype(layout['dtype'])
+        return self.buffer[layout['offset']:layout['offset'] + layout['length'] * dtype.itemsize].view(dtype)
+
+    def iter_runs(self, group=None, names=None):
+        """
+        Iterate over the runs of a group (every run if None) without loading them.
+        :param names: names of the series read, every series if None
+        :return: iterator of (group, key, dictionary of series)
+        """
+        for i in self.find_runs(group):
+            run = self.runs[i]
+            yield run['group'], run['key'], {name: self.get_series(i, name) for name in names or run['columns']}
+
+    def get_dataframe(self, run):
+        """
+        Series of a run as a DataCollector dataframe (loaded in memory).
+        :param run: index of the run
+        """
+        return pd.DataFrame({name: np.array(self.get_series(run, name)) for name in self.runs[run]['columns']})
+
+
+def convert_archive(npy_path, path):
+    """
+    Convert a pickled archive of DataCollector dataframes (_run.npy files of the OFAT analysis or of the experiments)
+    to a series file. The archive is loaded once in memory.
+    :param npy_path: archive, dictionary {key: dataframe} or {group: {key: dataframe}}
+    :param path: path of the series file
+    """
+    with open(npy_path, 'rb') as f:
+        data = np.load(f, allow_pickle=True)[()]
+
+    with SeriesWriter(path) as writer:
+        for group, runs in data.items():
+            if not isinstance(runs, dict):
+                group, runs = None, {group: runs}
+            for key, df in runs.items():
+                key = key if isinstance(key, tuple) else (key,)
+                writer.append(group, key, {name: df[name].to_numpy(dtype=float) for name in df.columns})
@@ -1,4 +1,5 @@
 import random
+import tornado.escape
 
 from mesa.visualization.ModularVisualization import ModularServer
 from mesa.visualization.UserParam import UserSettableParameter
@@ -84,6 +85,21 @@ def get_visualization_elements(model_paramsl, show_network=False):
     return elements
 
 
+def check_visualization_state(server, steps=1):
+    """
+    Check that the visualization state can be sent to the browser: the model of the server is run for a few steps
+    and the render of every element is JSON-encoded like tornado does. The model is reset afterwards.
+    :param server: ModularServer
+    :param steps: number of steps run before the render
+    :raise TypeError: if a rendered value is not JSON serializable (e.g. a NumPy scalar)
+    """
+    server.reset_model()
+    for _ in range(steps):
+        server.model.step()
+    tornado.escape.json_encode(server.render_model())
+    server.reset_model()
+
+
 def run(configuration, seed=None):
     """
     Run the mesa server
@@ -121,6 +137,7 @@ def run(configuration, seed=None):
         model_params=model_params
     )
     print(model_params)
+    check_visualization_state(server)
 
     server.port = 8521
     server.launch()
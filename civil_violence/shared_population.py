@@ -0,0 +1,160 @@
+import json
+import uuid
+import numpy as np
+from multiprocessing import shared_memory
+
+# Parameters of the model defining the population (grid, agents static attributes and social network)
+POPULATION_PARAMETERS = ['height', 'width', 'agent_density', 'active_agent_density', 'cop_density',
+                         'graph_type', 'p', 'p_ws', 'directed', 'population_seed']
+
+# Populations attached by the current process, by name
+_attached = {}
+
+# Blocks of detached populations whose arrays were still in use, closed once released (see detach_population)
+_detached = []
+
+
+class SharedPopulation:
+    """
+    Frozen population (agents positions, static attributes and social network in CSR format) placed in
+    multiprocessing shared memory.
+
+    The parent process creates the population once, then the models of every worker attach to it by name
+    (population parameter of the models). Static arrays are used zero-copy, so fanning out replicates over a shared
+    population costs no additional memory per worker.
+
+    Each array is stored in its own shared memory block named <name>_<array>, and a <name>_meta block stores the
+    JSON description (shape, dtype) of the arrays, so the name is the only information workers need.
+
+    Workers map a population at its first use and keep it while it is in use: a process holds one read-only
+    population at a time (the population of its current model), attaching another one or releasing the populations
+    between tasks (see release_populations) unmaps the previous ones, so the memory of the populations of finished
+    batches is freed once unlinked by their creator, even if the workers live longer (see simulation_executor).
+    """
+
+    def __init__(self, name, blocks):
+        self.name = name
+        self.blocks = blocks
+
+    @classmethod
+    def create(cls, arrays, meta, name=None):
+        """
+        Copy arrays to shared memory.
+        :param arrays: dictionary of numpy arrays
+        :param meta: dictionary of JSON-serializable values describing the population
+        :param name: name of the population, generated if None
+        """
+        name = name or 'cv_{}'.format(uuid.uuid4().hex[:12])
+        blocks = []
+        layout = {}
+
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(name='{}_{}'.format(name, key), create=True,
+                                               size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            layout[key] = {'shape': list(array.shape), 'dtype': array.dtype.str}
+            blocks.append(block)
+
+        description = json.dumps({'meta': meta, 'arrays': layout}).encode()
+        block = shared_memory.SharedMemory(name='{}_meta'.format(name), create=True, size=len(description) + 8)
+        block.buf[:8] = len(description).to_bytes(8, 'little')
+        block.buf[8:8 + len(description)] = description
+        blocks.append(block)
+
+        return cls(name, blocks)
+
+    @classmethod
+    def from_model_parameters(cls, seed=None, **model_params):
+        """
+        Build a population by initializing a vectorized model with the given parameters.
+        :param seed: random seed of the population
+        :param model_params: parameters of the model (only POPULATION_PARAMETERS are used)
+        """
+        from vectorized_model import VectorizedCivilViolenceModel  # Avoid circular import
+
+        params = {key: value for key, value in model_params.items() if key in POPULATION_PARAMETERS}
+        model = VectorizedCivilViolenceModel(seed=seed, **params)
+        return cls.create(*model.export_population())
+
+    def unlink(self):
+        """
+        Release the shared memory. Must be called by the creator once every worker is done.
+        """
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+        detach_population(self.name)
+
+
+def attach_population(name, writable=False):
+    """
+    Attach the current process to a shared population (once per process).
+    Attaching a read-only population detaches the other read-only populations of the process (see
+    release_populations), writable populations are detached by their owner (see SharedPopulation.unlink).
+    :param name: name of the population
+    :param writable: arrays are writable (shared dynamic state, see tiled_model), read-only otherwise
+    :return: dictionary of arrays and dictionary of meta values
+    """
+    if name not in _attached:
+        if not writable:
+            release_populations()
+
+        meta_block = shared_memory.SharedMemory(name='{}_meta'.format(name))
+        size = int.from_bytes(bytes(meta_block.buf[:8]), 'little')
+        description = json.loads(bytes(meta_block.buf[8:8 + size]).decode())
+
+        blocks = [meta_block]
+        arrays = {}
+        for key, layout in description['arrays'].items():
+            block = shared_memory.SharedMemory(name='{}_{}'.format(name, key))
+            array = np.ndarray(tuple(layout['shape']), dtype=np.dtype(layout['dtype']), buffer=block.buf)
+            array.flags.writeable = writable
+            arrays[key] = array
+            blocks.append(block)
+
+        _attached[name] = (arrays, description['meta'], blocks, writable)  # Blocks referenced while arrays are used
+
+    arrays, meta = _attached[name][:2]
+    return arrays, meta
+
+
+def detach_population(name):
+    """
+    Unmap a shared population from the current process (the population itself is kept, see SharedPopulation.unlink).
+    Blocks whose arrays are still referenced (e.g. by a model not reset yet) can't be closed: they are closed by a
+    later attach, release or detach, once the arrays are released.
+    :param name: name of the population
+    """
+    if name in _attached:
+        _detached.extend(_attached.pop(name)[2])
+
+    still_used = []
+    for block in _detached:
+        try:
+            block.close()
+        except BufferError:
+            still_used.append(block)
+    _detached[:] = still_used
+
+
+def release_populations(keep=None):
+    """
+    Detach the read-only populations of the current process, except the population still in use.
+    Called by the workers after building or resetting the model of a task (see simulation_executor.get_model).
+    :param keep: name of the population kept attached, None to detach every read-only population
+    """
+    for name in [name for name, entry in _attached.items() if not entry[3] and name != keep]:
+        detach_population(name)
+    detach_population(None)  # Close the blocks released since the last detach
+
+
+def check_population(meta, width, height):
+    """
+    Check the grid of the model matches the grid of the population.
+    """
+    if meta['width'] != width or meta['height'] != height:
+        raise ValueError("Population grid is {}x{}, model grid is {}x{}.".format(
+            meta['width'], meta['height'], width, height))
+
@@ -0,0 +1,144 @@
+import time
+from collections import OrderedDict
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool, cpu_count, resource_tracker
+from batch_results import pack_arrays
+from constant_variables import Engine
+from engines import get_model_class
+from network_cache import configure_network_cache
+from shared_population import release_populations
+from task_scheduler import get_default_parameters, estimate_cost, schedule_tasks, run_chunk, utilisation_report
+
+# Model kept by the current process for reuse, by model class
+_models = {}
+
+
+def _init_worker():
+    """
+    Import the heavy modules once, when the worker starts, instead of in the first task.
+    """
+    import mesa  # noqa: F401
+    import networkx  # noqa: F401
+    import pandas  # noqa: F401
+    import civil_violence_model  # noqa: F401
+    import vectorized_model  # noqa: F401
+
+
+def get_model(model_cls, params, reuse=False):
+    """
+    Create a model, or reset in place the last model of this class created by the current process.
+    :param model_cls: model class
+    :param params: parameters of the model
+    :param reuse: reuse the last model (if the class provides a reset method)
+    """
+    model = _models.get(model_cls) if reuse else None
+    if model is None or not hasattr(model, 'reset'):
+        model = model_cls(**params)
+    else:
+        model.reset(**params)
+
+    if reuse:
+        _models[model_cls] = model
+    release_populations(keep=params.get('population'))  # Unmap the populations of the previous batches
+    return model
+
+
+def _run_task(task):
+    """
+    Run one simulation in a worker.
+    :param task: (index, engine, parameters, max_steps, model_reporters, reuse)
+    :return: index of the task, model reporters values and packed data collector arrays (see batch_results)
+    """
+    index, engine, params, max_steps, model_reporters, reuse = task
+
+    model = get_model(get_model_class(engine), params, reuse)
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+
+    model_var = OrderedDict((var, reporter(model)) for var, reporter in (model_reporters or {}).items())
+    return index, model_var, pack_arrays(*model.datacollector.export_arrays())
+
+
+class SimulationExecutor:
+    """
+    Long-lived pool of simulation workers.
+
+    Workers are spawned once (heavy modules imported at start) and serve a stream of parameter tasks, from one or
+    several sweeps (it can be given to BatchRunnerMP through its executor parameter). With reuse_models, each worker
+    resets its previous model in place (see CivilViolenceModel.reset) instead of creating a new one for every task.
+    """
+
+    def __init__(self, nr_processes=None, reuse_models=True, network_cache_dir=None):
+        """
+        Create a new simulation executor.
+        :param nr_processes: number of workers. If None, by default all available CPUs will be used.
+        :param reuse_models: reset the previous model of the worker instead of creating a new model for each task
+        :param network_cache_dir: directory of the on-disk network cache shared by the workers (see
+            network_cache.configure_network_cache), the cache configuration of the parent is inherited if None
+        """
+        self.processes = nr_processes or cpu_count()
+        self.reuse_models = reuse_models
+        self.utilisation = None  # Utilisation report of the workers during the last imap
+        if network_cache_dir is not None:
+            configure_network_cache(directory=network_cache_dir)  # Before the pool, workers inherit it
+
+        # Workers must share the resource tracker of the parent: shared populations created after the pool
+        # would otherwise be tracked (and removed at exit) by every worker.
+        resource_tracker.ensure_running()
+        self.pool = Pool(self.processes, initializer=_init_worker)
+
+    def imap(self, tasks, engine=Engine.MESA.name, max_steps=200, model_reporters=None, chunksize=1,
+             schedule=False):
+        """
+        Run the simulations of a stream of tasks.
+        :param tasks: iterable of dictionaries of model parameters
+        :param engine: simulation backend (MESA or VECTORIZED, see constant_variables.Engine)
+        :param max_steps: maximal number of steps of the simulations
+        :param model_reporters: dictionary of reporter names and functions (not lambda) evaluated at the end of a run
+        :param chunksize: number of tasks sent at once to a worker
+        :param schedule: order tasks by estimated cost, longest first, and batch the cheap ones (see task_scheduler).
+            The whole stream is read first and chunksize is ignored.
+        :return: iterator of (task index, model reporters values, packed data collector arrays), in completion order
+        """
+        if schedule:
+            tasks = list(tasks)
+            defaults = get_default_parameters(get_model_class(engine))
+            costs = [estimate_cost(params, max_steps, defaults) for params in tasks]
+            chunks = ([(i, tasks[i]) for i in chunk] for chunk in schedule_tasks(costs, self.processes))
+        else:
+            numbered = enumerate(tasks)
+            chunks = iter(lambda: list(islice(numbered, chunksize)), [])
+
+        run_chunks = ([(i, engine, params, max_steps, model_reporters, self.reuse_models) for i, params in chunk]
+                      for chunk in chunks)
+
+        timings = []
+        start = time.time()
+        for results in self.pool.imap_unordered(partial(run_chunk, _run_task), run_chunks):
+            for result, timing in results:
+                timings.append(timing)
+                yield result
+
+        self.utilisation = utilisation_report(timings, self.processes, start, time.time())
+
+    def map(self, tasks, **kwargs):
+        """
+        Run the simulations of a list of tasks (see imap).
+        :return: list of (model reporters values, packed data collector arrays), in the order of the tasks
+        """
+        results = {index: (model_var, payload) for index, model_var, payload in self.imap(tasks, **kwargs)}
+        return [results[index] for index in range(len(results))]
+
+    def close(self):
+        """
+        Stop the workers once every task is done.
+        """
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,18 +1,33 @@
+import os
 import time
-import pandas as pd
+import hashlib
 import numpy as np
 from SALib.sample import saltelli
 from tqdm import tqdm
-from multiprocessing import Pool, cpu_count
-from mesa.batchrunner import BatchRunner
-from civil_violence_model import CivilViolenceModel
+from multiprocessing import cpu_count
+from constant_variables import Engine, Collection
+from network_cache import NETWORK_CACHE_DIR
+from simulation_executor import SimulationExecutor
+from sweep_store import SweepStore
+from task_scheduler import format_utilisation
 from utils import *
 
 
-def sobol_analysis_no_network(problem):
+def sobol_analysis_no_network(problem, engine=Engine.MESA.name, store_path=None, resume=False):
+    """
+    Sobol sensitivity analysis of civil violence model without network.
+    Work with multiprocessing.
+    Results are appended to a sweep store as runs complete. With resume, the runs already in the store are skipped,
+    so a killed sweep continues where it stopped.
+    :param problem: details of the variable parameters
+    :param engine: simulation backend (MESA or VECTORIZED, see constant_variables.Engine)
+    :param store_path: path of the sweep store (see sweep_store.SweepStore), new timestamped file in archives if None
+    :param resume: continue the sweep stored in store_path (its settings must match)
+    """
     replicates = 4
     max_steps = 150
     distinct_samples = 100
+    steady_state_window = 0  # Set > 0 to stop settled runs early (see utils.steady_state_reached), 0 runs to max_steps
 
     model_reporters = {"QUIESCENT": compute_quiescent,
                        "ACTIVE": compute_active,
@@ -20,38 +35,47 @@ def sobol_analysis_no_network(problem):
                        "OUTBREAKS": compute_outbreaks,
                        "LEGITIMACY": compute_legitimacy}
 
-    # We get all our samples here
-    param_values = saltelli.sample(problem, distinct_samples)
-    data = pd.DataFrame(index=range(replicates*len(param_values)),
-                        columns=['active_threshold_t', 'initial_legitimacy_l0', 'max_jail_term'])
-
-    data['Run'], data['QUIESCENT'], data['ACTIVE'], data['JAILED'], data['OUTBREAKS'], data['LEGITIMACY'] = \
-        None, None, None, None, None, None
+    if resume and (store_path is None or not os.path.exists(store_path)):
+        raise ValueError("No sweep store to resume at {}.".format(store_path))
+    if store_path is None:
+        store_path = 'archives/sweep_sobol_{0}.sqlite'.format(int(time.time()))
 
+    # We get all our samples here (Saltelli sampling is deterministic, a resumed sweep gets the same samples)
+    param_values = saltelli.sample(problem, distinct_samples)
+    n_samples = len(param_values)
     column_order = ['Run', 'QUIESCENT', 'ACTIVE', 'JAILED', 'OUTBREAKS', 'LEGITIMACY']
     available_processors = cpu_count()
     print("Sobol MP will use {} processors.".format(available_processors))
-    pool = Pool(available_processors)
 
-    run_iter_args = enumerate([[max_steps, model_reporters, list(v)] for _ in range(replicates) for v in param_values])
-    print("Number steps is {}. Starting ...".format(len(param_values) * replicates))
+    with SweepStore(store_path, problem['names'], column_order[1:]) as store:
+        store.check_settings({'problem': problem, 'distinct_samples': distinct_samples, 'replicates': replicates,
+                              'max_steps': max_steps, 'engine': engine, 'steady_state_window': steady_state_window,
+                              'samples': hashlib.sha1(param_values.tobytes()).hexdigest()})
+        done = store.get_done()
+        if done and not resume:
+            raise ValueError("Sweep store {} already holds runs, use resume to continue it.".format(store_path))
 
-    with tqdm((len(param_values) * (replicates)), disable=False) as pbar:
-        for count, vals, iteration_data in pool.imap_unordered(_mp_function, run_iter_args):
-            data.iloc[count, 0:3] = vals
-            data.loc[count, column_order] = iteration_data.loc[0, column_order]
-            print(f'{count / (len(param_values) * (replicates)) * 100:.2f}% done')
+        # One task per remaining (replicate, sample), run by workers started once, models are reset in place
+        runs = [(sample, replicate) for replicate in range(replicates) for sample in range(n_samples)
+                if (sample, replicate) not in done]
+        tasks = [get_task_parameters(param_values[sample], steady_state_window) for sample, _ in runs]
+        print("Number steps is {} ({} already done). Starting ...".format(n_samples * replicates, len(done)))
 
-            if count % 200 == 0:
-                path_tmp = 'archives/progress_data_sobol_{0}.npy'.format(int(time.time()))
-                with open(path_tmp, 'ab') as f:
-                    np.save(f, data)
-                    print("Progress saved in the file {:s}".format(path_tmp))
+        executor = SimulationExecutor(available_processors, network_cache_dir=NETWORK_CACHE_DIR)
+        with executor, tqdm(total=len(tasks), disable=False) as pbar:
+            for i, model_var, _ in executor.imap(tasks, engine=engine, max_steps=max_steps,
+                                                 model_reporters=model_reporters, schedule=True):
+                sample, replicate = runs[i]
+                store.append(sample, replicate, tasks[i], model_var)
+                pbar.update()
 
-    pbar.update()
+            print(format_utilisation(executor.utilisation))
+        print("Runs stored in {:s}".format(store_path))
 
-    # Close multi-processing
-    pool.close()
+        data = store.to_dataframe(n_samples)
+
+    data.insert(len(problem['names']), 'Run', data.index)
+    data = data.reindex(range(replicates * n_samples))
 
     path = 'archives/saved_data_sobol_{0}.npy'.format(int(time.time()))
     with open(path, 'ab') as f:
@@ -61,30 +85,23 @@ def sobol_analysis_no_network(problem):
     return data
 
 
-def _mp_function(input):
-    count, iter_args = input
-
-    max_steps = iter_args[0]
-    model_reporters = iter_args[1]
-    vals = iter_args[2]
-
-    vals[2] = int(vals[2])
-
-    variable_parameters = {}
+def get_task_parameters(vals, steady_state_window=0, population_seed=None):
+    """
+    Model parameters of a Sobol sample.
+    :param vals: values of active_threshold_t, initial_legitimacy_l0 and max_jail_term
+    :param steady_state_window: steady state window of the model (0 runs until max_steps)
+    :param population_seed: seed of the population and its social network, independent populations if None. Opt-in
+        common population of several samples (their network is generated once, see network_cache).
+    """
     names = ['active_threshold_t', 'initial_legitimacy_l0', 'max_jail_term']
-    for name, val in zip(names, vals):
-        variable_parameters[name] = val  # dictionary
-
-    batch = BatchRunner(CivilViolenceModel,
-                        max_steps=max_steps,
-                        variable_parameters={name: [] for name in names},
-                        model_reporters=model_reporters)
-
-    batch.run_iteration(variable_parameters, tuple(vals), count)
-    iteration_data = batch.get_model_vars_dataframe()
-    iteration_data['Run'] = count  # Don't know what causes this, but iteration number is not correctly filled
-
-    return count, vals, iteration_data
+    parameters = dict(zip(names, vals))
+    parameters['max_jail_term'] = int(parameters['max_jail_term'])
+    parameters['agent_collection'] = Collection.MODEL_ONLY.name  # Only model reporters are used
+    parameters['steady_state_window'] = steady_state_window
+    if population_seed is not None:
+        parameters['population_seed'] = population_seed
+
+    return parameters
 
 
 def sobol_main():
@@ -3,6 +3,7 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from itertools import combinations
+from sweep_store import SweepStore
 
 # from Sobol import problem
 
@@ -40,6 +41,30 @@ def plot_index(s, params, i, title=''):
     plt.axvline(0, c='k')
 
 
+def load_output(path, problem, name='OUTBREAKS'):
+    """
+    Load the output analysed of a Sobol sweep.
+    A sweep store (.sqlite, see sobol_mp.py) only reads the analysed output, older .npy archives are loaded in memory.
+
+    Args:
+        path (str): path of the sweep store or of the archive
+        problem (dict): details of the variable parameters
+        name (str): name of the output
+    """
+    if path.endswith('.sqlite'):
+        with SweepStore(path, problem['names'], [name]) as store:
+            settings = store.get_settings()
+            n_samples = settings['distinct_samples'] * (2 * problem['num_vars'] + 2)  # Saltelli, second order
+            return store.get_output(name, n_samples, settings['replicates'])
+
+    with open(path, 'rb') as f:
+        data = np.load(f, allow_pickle=True)[()]
+
+    data = pd.DataFrame(data, columns = ['active_threshold_t', 'initial_legitimacy_l0', 'max_jail_term', 'Run',
+                                         'QUIESCENT', 'ACTIVE', 'JAILED', 'OUTBREAKS', 'LEGITIMACY'])
+    return data[name].values
+
+
 def sobol_plot_main():
     problem = {
         'num_vars': 3,
@@ -49,16 +74,12 @@ def sobol_plot_main():
 
     file_path = [
         # './archives/saved_data_sobol_1611799908.npy',
+        # './archives/sweep_sobol_<timestamp>.sqlite',  # Sweep store of sobol_mp.py
         './archives/saved_data_sobol_no_network_1611861983.npy',
     ]
 
     for path in file_path:
-        with open(path, 'rb') as f:
-            data = np.load(f, allow_pickle=True)[()]
-
-    data = pd.DataFrame(data, columns = ['active_threshold_t', 'initial_legitimacy_l0', 'max_jail_term', 'Run',
-                                         'QUIESCENT', 'ACTIVE', 'JAILED', 'OUTBREAKS', 'LEGITIMACY'])
-    Y = data['OUTBREAKS'].values
+        Y = load_output(path, problem, 'OUTBREAKS')
 
     # loaded_data = pd.DataFrame(data, columns=['active_threshold_t', 'initial_legitimacy_l0', 'max_jail_term', 'Run',
     #                                             'QUIESCENT', 'ACTIVE', 'JAILED', 'OUTBREAKS', 'LEGITIMACY'])
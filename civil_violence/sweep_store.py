@@ -0,0 +1,130 @@
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+
+
+class SweepStore:
+    """
+    Append-only result store of a sweep, in a SQLite database.
+
+    Each run is a row keyed by (sample, replicate) holding the parameter values and the outputs of the run. Rows are
+    only inserted (never rewritten), and committed by batches, so a checkpoint costs the new rows only and a killed
+    sweep can be resumed from the runs already stored (see get_done).
+    The settings of the sweep (problem, number of samples, replicates, etc.) are stored with the results, a sweep can
+    only be resumed with the same settings.
+    """
+
+    def __init__(self, path, parameter_names, output_names, commit_every=50):
+        """
+        Open (or create) a sweep store.
+        :param path: path of the SQLite database
+        :param parameter_names: names of the varied parameters
+        :param output_names: names of the outputs (model reporters)
+        :param commit_every: number of runs appended between two commits
+        """
+        self.path = path
+        self.parameter_names = list(parameter_names)
+        self.output_names = list(output_names)
+        self.commit_every = commit_every
+        self.pending = 0
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+        columns = ', '.join('"{}" REAL'.format(name) for name in self.parameter_names + self.output_names)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS runs (sample INTEGER, replicate INTEGER, {}, '
+                                'PRIMARY KEY (sample, replicate))'.format(columns))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.commit()
+
+    def check_settings(self, settings):
+        """
+        Save the settings of the sweep, or check they match the settings of the stored sweep.
+        :param settings: dictionary of JSON-serializable values
+        """
+        for key, value in settings.items():
+            value = json.dumps(value, sort_keys=True)
+            row = self.connection.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.connection.execute('INSERT INTO settings VALUES (?, ?)', (key, value))
+            elif row[0] != value:
+                raise ValueError("Sweep setting {} is {}, stored sweep used {}.".format(key, value, row[0]))
+        self.connection.commit()
+
+    def get_settings(self):
+        """
+        Settings of the stored sweep (see check_settings).
+        :return: dictionary of values
+        """
+        return {key: json.loads(value) for key, value in self.connection.execute('SELECT key, value FROM settings')}
+
+    def get_done(self):
+        """
+        Runs already stored.
+        :return: set of (sample, replicate)
+        """
+        return set(self.connection.execute('SELECT sample, replicate FROM runs'))
+
+    def append(self, sample, replicate, parameters, outputs):
+        """
+        Append the result of a run.
+        :param sample: index of the sample
+        :param replicate: index of the replicate
+        :param parameters: dictionary of parameter values
+        :param outputs: dictionary of output values
+        """
+        values = [parameters[name] for name in self.parameter_names] + [outputs[name] for name in self.output_names]
+        self.connection.execute('INSERT OR IGNORE INTO runs VALUES ({})'.format(', '.join('?' * (len(values) + 2))),
+                                [int(sample), int(replicate)] + [float(value) for value in values])
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        """
+        Make the appended runs durable.
+        """
+        self.connection.commit()
+        self.pending = 0
+
+    def to_dataframe(self, n_samples):
+        """
+        Stored runs as a dataframe, indexed like the tasks of the sweep (replicate * n_samples + sample).
+        :param n_samples: number of samples of the sweep
+        """
+        self.commit()
+        data = pd.read_sql_query('SELECT * FROM runs ORDER BY replicate, sample', self.connection)
+        data.index = data['replicate'] * n_samples + data['sample']
+        return data.drop(columns=['sample', 'replicate'])
+
+    def get_output(self, name, n_samples, replicates, fetch_size=10000):
+        """
+        A single output of the stored runs, read by batches of rows (the other outputs are not loaded), e.g. the
+        output analysed by sobol_plot.
+        :param name: name of the output
+        :param n_samples: number of samples of the sweep
+        :param replicates: number of replicates of the sweep
+        :param fetch_size: number of rows read at a time
+        :return: array indexed like the tasks of the sweep (replicate * n_samples + sample), NaN for missing runs
+        """
+        self.commit()
+        output = np.full(replicates * n_samples, np.nan)
+        cursor = self.connection.execute('SELECT sample, replicate, "{}" FROM runs'.format(name))
+        rows = cursor.fetchmany(fetch_size)
+        while rows:
+            run_samples, run_replicates, values = np.array(rows, dtype=float).T
+            output[run_replicates.astype(np.int64) * n_samples + run_samples.astype(np.int64)] = values
+            rows = cursor.fetchmany(fetch_size)
+        return output
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
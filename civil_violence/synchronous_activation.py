@@ -0,0 +1,98 @@
+from mesa.time import RandomActivation
+from constant_variables import Draw, Phase
+
+
+class SynchronousActivation(RandomActivation):
+    """
+    Synchronous (double-buffered) activation of the civil violence model, by phase:
+    1. jail: sentences are served, released citizens are placed back in the grid (in stream id order),
+    2. citizens: contagious hardship and activation rule of every acting citizen are computed from the state of
+       the previous phase, then the new states are applied,
+    3. citizens move: every citizen picks an empty cell of its vision, moves targeting the same cell are resolved in
+       activation order (ORDER draw), the other citizens stay in place,
+    4. cops arrest: every cop picks an active citizen of its vision, arrests of the same citizen are resolved in
+       activation order, arresting cops move on the cell of the arrestee,
+    5. other cops move like citizens.
+
+    Within a phase, agents only read the state committed by the previous phase and return their decision, so the
+    result doesn't depend on the order in which agents are evaluated and a phase can be split between workers.
+    Rules and draws are the ones of the vectorized engine.
+    """
+
+    def step(self):
+        model = self.model
+        profiler = model.profiler
+        start = profiler.clock()
+
+        # Jail, in stream id order (citizen_list order)
+        acting = []
+        for citizen in model.citizen_list:
+            if citizen.jail_sentence:
+                citizen.serve_sentence()
+            else:
+                acting.append(citizen)
+        start = profiler.lap(Phase.RELEASE, start)
+
+        # Citizens: contagion and activation read the states of the previous phase
+        for citizen in acting:
+            citizen.update_grievance()
+        start = profiler.lap(Phase.CONTAGION, start)
+        next_states = [citizen.decide() for citizen in acting]
+        for citizen, state_code in zip(acting, next_states):
+            citizen.set_state(state_code)
+        start = profiler.lap(Phase.DECISION, start)
+
+        if model.movement:
+            targets = [citizen.get_move_target(citizen.get_empty_cells()) for citizen in acting]
+            start = profiler.lap(Phase.NEIGHBORHOOD, start)
+            self.move_agents(acting, targets)
+            start = profiler.lap(Phase.MOVEMENT, start)
+
+        # Cops: arrests read the states of the citizens after their phase
+        cops = model.cop_list
+        arrestees = [cop.choose_arrestee() for cop in cops]
+        start = profiler.lap(Phase.NEIGHBORHOOD, start)
+        arresting = self.resolve_conflicts(cops, [arrestee.pos if arrestee else None for arrestee in arrestees])
+        for i in arresting:
+            cell = arrestees[i].pos
+            cops[i].arrest(arrestees[i])
+            if model.movement:
+                model.move_agent(cops[i], cell)
+        start = profiler.lap(Phase.ARREST, start)
+
+        if model.movement:
+            arresting = set(arresting)
+            idle = [cop for i, cop in enumerate(cops) if i not in arresting]
+            targets = [cop.get_move_target(cop.get_empty_cells()) for cop in idle]
+            start = profiler.lap(Phase.NEIGHBORHOOD, start)
+            self.move_agents(idle, targets)
+            profiler.lap(Phase.MOVEMENT, start)
+
+        self.steps += 1
+        self.time += 1
+
+    def resolve_conflicts(self, agents, targets):
+        """
+        Agents targeting the same cell are resolved in activation order (ORDER draw, see StreamActivation).
+        :param agents: list of agents
+        :param targets: target cell of every agent, None if none
+        :return: indices (in agents) of the agents getting their target, in activation order
+        """
+        order = self.model.get_uniforms(Draw.ORDER)
+        candidates = sorted((i for i, target in enumerate(targets) if target is not None),
+                            key=lambda i: order[agents[i].stream_id])
+        taken = set()
+        winners = []
+        for i in candidates:
+            if targets[i] not in taken:
+                taken.add(targets[i])
+                winners.append(i)
+        return winners
+
+    def move_agents(self, agents, targets):
+        """
+        Move agents to their target cell (empty cells at the start of the phase). Agents targeting the same cell are
+        resolved in activation order, the others stay in place.
+        """
+        for i in self.resolve_conflicts(agents, targets):
+            self.model.move_agent(agents[i], targets[i])
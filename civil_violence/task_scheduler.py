@@ -0,0 +1,138 @@
+import os
+import time
+import inspect
+import numpy as np
+from constant_variables import GraphType
+
+# Relative costs, calibrated on the mesa engine (1 unit is the step of an agent with vision 1, about 50 µs)
+VISION_COST = 0.075  # Per agent and step, per square root of the number of cells in vision (all radii)
+EDGE_COST = 4e-5  # Per edge and step (contagious hardship propagation)
+CHUNKS_PER_PROCESS = 4  # Chunks cost about remaining cost / (processes * CHUNKS_PER_PROCESS) (guided scheduling)
+
+
+def get_default_parameters(model_cls):
+    """
+    Default value of the parameters of a model class.
+    """
+    return {name: parameter.default for name, parameter in inspect.signature(model_cls.__init__).parameters.items()
+            if parameter.default is not inspect.Parameter.empty}
+
+
+def get_vision_cells(radius, width, height):
+    """
+    Number of cells in the von Neumann neighborhood of a cell (the diamond is bounded by the grid).
+    """
+    return min(2 * radius * (radius + 1), width * height - 1)
+
+
+def estimate_cost(params, max_steps, defaults=None):
+    """
+    Estimate the relative cost of a simulation from its parameters.
+    Agents cost grows with the square root of the number of cells in vision (every vision radius is maintained by the
+    vision counter at each move and state change), the social network adds a cost per edge.
+
+    :param params: parameters of the model
+    :param max_steps: maximal number of steps of the simulation
+    :param defaults: default parameters of the model (see get_default_parameters)
+    :return: cost in agent step units
+    """
+    p = dict(defaults or {})
+    p.update(params)
+
+    cells = p['width'] * p['height']
+    citizens = p['agent_density'] * cells
+    agents = citizens + p['cop_density'] * cells
+    edges = p['p'] * citizens ** 2 if p['graph_type'] in GraphType.__members__ else 0.
+    steps = min(max_steps, p.get('max_iter', max_steps) + 1)
+
+    vision = get_vision_cells(p['agent_vision'], p['width'], p['height']) + \
+        get_vision_cells(p['cop_vision'], p['width'], p['height'])
+    step_cost = agents * (1 + VISION_COST * np.sqrt(vision)) + EDGE_COST * edges
+
+    return agents + EDGE_COST * edges + steps * step_cost  # Construction and steps
+
+
+def schedule_tasks(costs, processes, chunks_per_process=CHUNKS_PER_PROCESS):
+    """
+    Order tasks longest first and batch them in chunks of decreasing cost (longest processing time first, guided
+    scheduling). A chunk is filled up to the remaining cost / (processes * chunks_per_process): expensive tasks are
+    sent alone and first so they don't end as stragglers, cheap tasks are grouped to reduce the number of round trips
+    with the workers, and chunks shrink toward the end (down to single tasks) so the workers finish together.
+
+    :param costs: estimated cost of each task
+    :param processes: number of workers
+    :param chunks_per_process: number of chunks of the remaining cost per worker
+    :return: list of chunks (lists of task indices), in dispatch order
+    """
+    costs = np.asarray(costs, dtype=float)
+    if len(costs) == 0:
+        return []
+
+    remaining = costs.sum()
+    chunks = []
+    chunk, chunk_cost = [], 0.
+    for index in np.argsort(-costs, kind='stable'):
+        if not chunk:
+            target = remaining / (processes * chunks_per_process)
+        chunk.append(int(index))
+        chunk_cost += costs[index]
+        if chunk_cost >= target:
+            chunks.append(chunk)
+            remaining -= chunk_cost
+            chunk, chunk_cost = [], 0.
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def run_chunk(function, chunk):
+    """
+    Run the tasks of a chunk in a worker and time them.
+    :param function: function running a task
+    :param chunk: list of task arguments
+    :return: list of (result, (pid, start, end))
+    """
+    results = []
+    for args in chunk:
+        start = time.time()
+        result = function(args)
+        results.append((result, (os.getpid(), start, time.time())))
+    return results
+
+
+def utilisation_report(timings, processes, start=None, end=None):
+    """
+    Utilisation of the workers during a run.
+    :param timings: list of (pid, start, end) of every task
+    :param processes: number of workers
+    :param start: start of the run, first task start if None
+    :param end: end of the run, last task end if None
+    :return: dictionary with wall time, busy time, utilisation (busy time / (processes * wall time)) and tail
+        (time between the first worker becoming idle for good and the end of the run)
+    """
+    if not timings:
+        return {'tasks': 0, 'wall_time': 0., 'busy_time': 0., 'utilisation': 0., 'tail': 0.}
+
+    timings = np.array([(pid, task_start, task_end) for pid, task_start, task_end in timings])
+    start = timings[:, 1].min() if start is None else start
+    end = timings[:, 2].max() if end is None else end
+    wall_time = max(end - start, 1e-9)
+    busy_time = (timings[:, 2] - timings[:, 1]).sum()
+
+    last_ends = [timings[timings[:, 0] == pid, 2].max() for pid in np.unique(timings[:, 0])]
+    if len(last_ends) < processes:
+        last_ends.append(start)  # Some workers got no task
+
+    return {'tasks': len(timings),
+            'wall_time': float(wall_time),
+            'busy_time': float(busy_time),
+            'utilisation': float(busy_time / (processes * wall_time)),
+            'tail': float(end - min(last_ends))}
+
+
+def format_utilisation(report):
+    """
+    One line summary of a utilisation report.
+    """
+    return "{tasks} tasks in {wall_time:.1f}s, utilisation {utilisation:.0%}, tail {tail:.1f}s".format(**report)
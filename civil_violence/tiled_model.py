@@ -0,0 +1,295 @@
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from constant_variables import State, Draw, TilePhase
+from vision import von_neumann_offsets, diamond_sum
+from shared_population import SharedPopulation, attach_population
+from agent_rng import AgentStreams
+from vectorized_model import VectorizedCivilViolenceModel
+
+# Columns of the model placed in shared memory, read and written by the tile workers
+SHARED_COLUMNS = ['cell_agent', 'citizen_pos', 'cop_pos', 'state', 'hardship', 'hardship_cont', 'grievance',
+                  'hardship_endo', 'risk_aversion', 'threshold']
+
+# Streams of the tiled models attached by the current process, by name of their shared memory
+_streams = {}
+
+
+def get_tile_bounds(width, tiles, halo):
+    """
+    Split the grid in vertical strips of about the same width.
+    A strip reads `halo` columns of its neighbors on both sides, which is only possible if the vision diamond doesn't
+    overlap itself on the torus (2 * halo + 1 <= width).
+    :param width: grid width
+    :param tiles: number of strips
+    :param halo: width of the halo (largest vision radius)
+    :return: list of (x0, x1) bounds of the strips, empty if the grid is too narrow to be split
+    """
+    if 2 * halo + 1 > width:
+        return []
+    edges = np.linspace(0, width, max(1, min(tiles, width)) + 1).astype(np.int64)
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+class HaloBlock:
+    """
+    Cells of a strip x0 <= x < x1 of the grid extended by `halo` columns of the neighbor strips on both sides
+    (wrapped on the torus), copied from the shared grid at the start of a phase.
+    Agents of the strip only read the block, so vision counts and draws are the ones of the whole grid.
+    """
+
+    def __init__(self, cell_agent, width, height, x0, x1, halo):
+        self.width = width
+        self.height = height
+        self.x0 = x0
+        self.x1 = x1
+        self.halo = halo
+        rows = np.arange(x0 - halo, x1 + halo) % width
+        self.cells = cell_agent.reshape(width, height)[rows]
+
+    def get_agents(self):
+        """
+        Index of the agents (cops after citizens) located in the strip, halo excluded.
+        """
+        ids = self.cells[self.halo:self.halo + self.x1 - self.x0].ravel()
+        return ids[ids >= 0]
+
+    def get_active_layer(self, state, n_citizens):
+        """
+        Per-cell flag of active citizens presence.
+        """
+        citizens = (self.cells >= 0) & (self.cells < n_citizens)
+        layer = np.zeros(self.cells.shape, dtype=bool)
+        layer[citizens] = state[self.cells[citizens]] == State.ACTIVE.value
+        return layer
+
+    def get_local(self, pos):
+        """
+        Coordinates in the block of flat positions of the strip.
+        """
+        x, y = np.divmod(pos, self.height)
+        return x - self.x0 + self.halo, y
+
+    def count_in_vision(self, pos, layer, radius):
+        """
+        Sum a per-cell layer of the block over the von Neumann neighborhood of positions of the strip
+        (see VectorizedCivilViolenceModel.count_in_vision).
+        """
+        x, y = self.get_local(pos)
+        return diamond_sum(layer.astype(np.int64), radius)[x, y]
+
+    def sample_in_vision(self, pos, layer, radius, draws):
+        """
+        Pick uniformly, for positions of the strip, a cell of the neighborhood where layer is True, candidates being
+        ranked in the order of the offsets of the whole grid (see VectorizedCivilViolenceModel.sample_in_vision).
+        :return: flat index (in the whole grid) of the selected cells, -1 if there is no candidate
+        """
+        available = self.count_in_vision(pos, layer, radius)
+        rank = np.floor(draws * available).astype(np.int64)
+        chosen = np.full(len(pos), -1, dtype=np.int64)
+
+        x, y = self.get_local(pos)
+        seen = np.zeros(len(pos), dtype=np.int64)
+        offsets_x, offsets_y = von_neumann_offsets(radius, self.width, self.height)
+        offsets_x = np.where(offsets_x > radius, offsets_x - self.width, offsets_x)  # Back to signed offsets
+        for dx, dy in zip(offsets_x, offsets_y):
+            local_x, local_y = x + dx, (y + dy) % self.height
+            hit = layer[local_x, local_y]
+            select = hit & (seen == rank) & (chosen < 0)
+            chosen[select] = ((local_x[select] + self.x0 - self.halo) % self.width) * self.height + local_y[select]
+            seen += hit
+
+        return chosen
+
+
+def run_tile(task):
+    """
+    Decisions of the agents of a strip for a phase of the step, written in the shared columns of the model.
+    Only the agents of the strip are written, the rest of the grid is read through the halo of the strip.
+    :param task: tuple (name of the shared memory, phase (see constant_variables.TilePhase), x0, x1, legitimacy,
+        step)
+    """
+    name, phase, x0, x1, legitimacy, step = task
+    arrays, meta = attach_population(name, writable=True)
+    if name not in _streams:
+        _streams[name] = AgentStreams(meta['key'])
+    streams = _streams[name]
+
+    n_citizens, n_agents = meta['n_citizens'], meta['n_citizens'] + meta['n_cops']
+    block = HaloBlock(arrays['cell_agent'], meta['width'], meta['height'], x0, x1, meta['halo'])
+    agents = block.get_agents()
+
+    if phase == TilePhase.CITIZENS:
+        # Same rules than VectorizedCivilViolenceModel.update_citizens, the new states are buffered
+        citizens = agents[agents < n_citizens]
+        citizens = citizens[arrays['acting'][citizens]]
+        hardship, hardship_cont = arrays['hardship'], arrays['hardship_cont']
+
+        to_update = citizens[hardship[citizens] < 1]
+        hardship_cont[to_update] += arrays['received'][to_update]
+        hardship[citizens] = np.minimum(hardship_cont[citizens] + arrays['hardship_endo'][citizens], 1)
+        arrays['grievance'][citizens] = hardship[citizens] * (1 - legitimacy)
+
+        pos = arrays['citizen_pos'][citizens]
+        c_v = block.count_in_vision(pos, block.cells >= n_citizens, meta['agent_vision'])
+        a_v = block.count_in_vision(pos, block.get_active_layer(arrays['state'], n_citizens), meta['agent_vision'])
+        cop_to_agent_ratio = np.floor_divide(c_v, a_v + 1)
+        net_risk = arrays['risk_aversion'][citizens] * (1 - np.exp(-1 * meta['k'] * cop_to_agent_ratio))
+
+        rule_a = arrays['grievance'][citizens] - net_risk > arrays['threshold'][citizens]
+        arrays['next_state'][citizens] = np.where(rule_a, State.ACTIVE.value, State.QUIESCENT.value)
+
+        if meta['movement']:
+            arrays['citizen_target'][citizens] = block.sample_in_vision(
+                pos, block.cells == -1, meta['agent_vision'], streams.uniforms(step, Draw.MOVE, n_agents)[citizens])
+        return
+
+    cops = agents[agents >= n_citizens] - n_citizens
+    cops = cops[arrays['selected_cops'][cops]]
+    if phase == TilePhase.ARRESTS:
+        layer, draw = block.get_active_layer(arrays['state'], n_citizens), Draw.ARREST
+    else:
+        layer, draw = block.cells == -1, Draw.MOVE
+    arrays['cop_target'][cops] = block.sample_in_vision(arrays['cop_pos'][cops], layer, meta['cop_vision'],
+                                                        streams.uniforms(step, draw, n_agents)[n_citizens + cops])
+
+
+class TiledCivilViolenceModel(VectorizedCivilViolenceModel):
+    """
+    Civil violence model class, vectorized engine split in tiles, for a single large grid (e.g. 1000x1000 with
+    millions of agents) where the replicate-level parallelism of BatchRunnerMP doesn't help.
+
+    The grid is split in vertical strips owned by worker processes. Agent columns and grid are placed in shared
+    memory, and for every phase of a step (citizens decision and move target, cops arrest targets, cops move
+    targets) each worker copies its strip and a halo of max(agent_vision, cop_vision) columns of the neighbor strips
+    from the shared grid, then computes the decisions of the agents located in its strip. Ownership follows the
+    positions of the grid, so an agent crossing a strip boundary is handled by the new strip at the next phase.
+
+    Decisions are double-buffered (new states and targets are written apart, see TilePhase) and committed by the
+    parent between phases, which also handles the global couplings: received contagious hardship over the social
+    network, jail releases, conflicts of moves and arrests across strips, jailings count, legitimacy and outbreaks.
+    Rules and draws are the ones of VectorizedCivilViolenceModel, so a seed gives the same run whatever the number
+    of tiles and processes.
+
+    Workers are stopped and columns moved back to private memory when the run ends (or by close).
+    """
+    def __init__(self, tiles=4, processes=None, **params):
+        """
+        Create a new civil violence model, vectorized engine split in tiles.
+        Other parameters are the same than VectorizedCivilViolenceModel.
+        :param tiles: number of strips of the grid. The grid isn't split if it is narrower than the vision diamond.
+        :param processes: number of worker processes, min(tiles, CPUs) if None. Strips are computed in the current
+            process if 1 or less.
+        """
+        super().__init__(**params)
+
+        self.halo = max(self.agent_vision, self.cop_vision)
+        self.tile_bounds = get_tile_bounds(self.width, tiles, self.halo)
+        if processes is None:
+            processes = min(len(self.tile_bounds), cpu_count())
+        self.processes = processes
+        self.shared = None
+        self.pool = None
+        if self.tile_bounds:
+            self.share_columns()
+
+    def share_columns(self):
+        """
+        Move the columns read by the workers to shared memory (the model uses writable views on it), and start the
+        workers.
+        """
+        columns = {key: getattr(self, key) for key in SHARED_COLUMNS}
+        columns.update({
+            'received': np.zeros(self.n_citizens),  # Received contagious hardship of the step
+            'acting': np.zeros(self.n_citizens, dtype=bool),  # Citizens acting this step
+            'next_state': np.zeros(self.n_citizens, dtype=np.int8),  # New states of the citizens phase
+            'citizen_target': np.full(self.n_citizens, -1, dtype=np.int64),  # Move targets of the citizens phase
+            'selected_cops': np.zeros(self.n_cops, dtype=bool),  # Cops of the cops phases
+            'cop_target': np.full(self.n_cops, -1, dtype=np.int64),  # Targets of the cops phases
+        })
+        meta = {'width': self.width, 'height': self.height, 'n_citizens': self.n_citizens, 'n_cops': self.n_cops,
+                'agent_vision': self.agent_vision, 'cop_vision': self.cop_vision, 'halo': self.halo, 'k': self.k,
+                'movement': self.movement, 'key': self.streams.key}
+
+        self.shared = SharedPopulation.create(columns, meta)
+        arrays, _ = attach_population(self.shared.name, writable=True)
+        for key in SHARED_COLUMNS:
+            setattr(self, key, arrays[key])
+        self.tile_columns = arrays
+
+        if self.processes > 1:
+            self.pool = Pool(self.processes)
+
+    def close(self):
+        """
+        Stop the workers and move the shared columns back to private memory. The model keeps working (in the current
+        process, without tiles) and its columns can still be read by reporters.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.shared is not None:
+            for key in SHARED_COLUMNS:
+                setattr(self, key, np.array(getattr(self, key)))
+            self.tile_columns = None
+            self.shared.unlink()
+            self.shared = None
+
+    def reset(self, **params):
+        """
+        Reset the model in place for a new run (see VectorizedCivilViolenceModel.reset), workers are restarted.
+        """
+        self.close()
+        super().reset(**params)
+
+    def step(self):
+        super().step()
+        if not self.running:
+            self.close()
+
+    def run_tiles(self, phase):
+        """
+        Run a phase on every strip and wait for all of them (the results are in the shared columns).
+        :param phase: phase of the step (see constant_variables.TilePhase)
+        """
+        tasks = [(self.shared.name, phase, x0, x1, self.legitimacy, self.schedule.steps)
+                 for x0, x1 in self.tile_bounds]
+        if self.pool is None:
+            for task in tasks:
+                run_tile(task)
+        else:
+            self.pool.map(run_tile, tasks)
+
+    def update_citizens(self, acting, received):
+        if self.shared is None:
+            return super().update_citizens(acting, received)
+
+        columns = self.tile_columns
+        columns['received'][acting] = received[acting]
+        columns['acting'][:] = False
+        columns['acting'][acting] = True
+        self.run_tiles(TilePhase.CITIZENS)
+        return columns['next_state'][acting], columns['citizen_target'][acting] if self.movement else None
+
+    def choose_arrest_targets(self, cops):
+        if self.shared is None:
+            return super().choose_arrest_targets(cops)
+        return self.run_cops(TilePhase.ARRESTS, cops)
+
+    def choose_cop_moves(self, cops):
+        if self.shared is None:
+            return super().choose_cop_moves(cops)
+        return self.run_cops(TilePhase.COP_MOVES, cops)
+
+    def run_cops(self, phase, cops):
+        """
+        Targets of cops computed by the strips.
+        :param phase: TilePhase.ARRESTS or TilePhase.COP_MOVES
+        :param cops: index of the cops
+        :return: flat index of the target cells, -1 if none
+        """
+        columns = self.tile_columns
+        columns['selected_cops'][:] = False
+        columns['selected_cops'][cops] = True
+        self.run_tiles(phase)
+        return columns['cop_target'][cops]
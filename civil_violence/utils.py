@@ -130,6 +130,49 @@ def compute_outbreaks(model):
     return model.outbreaks
 
 
+def compute_stop_step(model):
+    """
+    Return the step at which the simulation stopped (current step while running). Padded steps of a run stopped in
+    a steady state keep the step of the stop.
+    :param model : civil violence model class instance
+    """
+    return model.iteration
+
+
+def compute_profile(model):
+    """
+    Return the wall time and number of calls accumulated per phase of the steps (see profiling.PhaseProfiler), None
+    if the model is not profiled. Profiles of several runs are aggregated by profiling.profile_table.
+    :param model : civil violence model class instance
+    """
+    profiler = getattr(model, 'profiler', None)
+    return profiler.get_totals() if profiler is not None and profiler.enabled else None
+
+
+def steady_state_reached(model, window, tolerance=0.):
+    """
+    Check if the simulation settled: the number of active and jailed citizens and the legitimacy did not vary more
+    than the tolerance during the last window steps (the current values being compared to the collected ones).
+    :param model : civil violence model class instance
+    :param window : number of steps without variation
+    :param tolerance : maximal variation, as a fraction of the citizens for the counts
+    :return: True if the steady state criterion holds
+    """
+    history = model.datacollector
+    if history.n_collected < window:
+        return False
+
+    citizens = compute_quiescent(model) + compute_active(model) + compute_jailed(model)
+    for name, reporter, scale in [("ACTIVE", compute_active, citizens),
+                                  ("JAILED", compute_jailed, citizens),
+                                  ("LEGITIMACY", compute_legitimacy, 1.)]:
+        values = history.get_model_array(name)[-window:]
+        current = reporter(model)
+        if max(values.max(), current) - min(values.min(), current) > tolerance * scale:
+            return False
+    return True
+
+
 def compute_datacollector(model):
     """
     Return data collecor
@@ -0,0 +1,556 @@
+import numpy as np
+from mesa import Model
+from constant_variables import State, GraphType, HardshipConst, Collection, Draw
+from graph_utils import load_or_generate_edges, edges_to_csr, NetworkCSR
+from vision import von_neumann_offsets, diamond_sum, draw_without_replacement
+from shared_population import attach_population, check_population
+from agent_rng import AgentStreams
+from columnar_datacollector import ColumnarDataCollector
+from utils import *
+
+
+class ArraySchedule:
+    """
+    Minimal stand-in for mesa schedulers.
+    Agents of the vectorized model are not mesa Agent objects, however BatchRunner, BatchRunnerMP and
+    DataCollector rely on the step counter of the schedule.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.steps = 0
+        self.time = 0
+
+    def get_agent_count(self):
+        return self.model.n_citizens + self.model.n_cops
+
+
+class VectorizedCivilViolenceModel(Model):
+    """
+    Civil violence model class, vectorized engine.
+
+    Citizens and cops attributes are stored in struct-of-arrays NumPy columns (index i of every column is the
+    i-th citizen) and a whole step is computed with batched array operations instead of per agent step methods.
+    Rules are the same than CivilViolenceModel (Epstein 2002 + ABEC contagious hardship), but agents are updated
+    synchronously by phase (jail release, citizens activation and movement, then cops arrest and movement).
+    Moves targeting the same cell are resolved in random order, losers stay in place.
+    """
+    def __init__(self,
+                 max_iter=200,
+                 height=40, width=40,
+                 agent_density=0.7, agent_vision=7,
+                 active_agent_density=0.01,
+                 cop_density=0.04, cop_vision=7,
+                 inf_threshold=40, tackle_inf=False,
+                 k=2.3, graph_type=GraphType.BARABASI_ALBERT.name,
+                 p=0.1, p_ws=0.1,
+                 directed=False, max_jail_term=30,
+                 active_threshold_t=0.1, initial_legitimacy_l0=0.82,
+                 movement=True, seed=None, population_seed=None, population=None,
+                 agent_collection=Collection.FULL.name, collection_interval=1, collection_sample=0.1,
+                 steady_state_window=0, steady_state_tolerance=0.):
+        """
+        Create a new civil violence model, vectorized engine.
+        Parameters are the same than CivilViolenceModel (including population_seed).
+        :param population: name of a shared population (see shared_population). If provided, agents and social
+            network are loaded from shared memory (static attributes are used zero-copy) instead of being generated.
+        :param agent_collection, collection_interval, collection_sample: accepted for compatibility with
+            CivilViolenceModel configurations, the vectorized engine only collects model reporters.
+
+        Additional attributes:
+            streams : counter-based random streams used for every draws of the simulation, agents draw with their
+                index (cops after citizens), like the stream_id of the mesa agents.
+            cell_agent : flat grid (x * height + y) storing the index of the agent in the cell, -1 if empty.
+                Cops are indexed after citizens (n_citizens + cop index).
+            citizen_pos, cop_pos : flat cell index of each agent, -1 if the citizen is jailed
+            network_csr : social network in compressed sparse row format
+        """
+        super().__init__()
+
+        self.seed = seed
+        self.random.seed(self.seed)
+        self.streams = AgentStreams(self.seed)
+
+        self.height = height
+        self.width = width
+        self.schedule = ArraySchedule(self)
+        self.max_iter = max_iter
+        self.steady_state_window = steady_state_window
+        self.steady_state_tolerance = steady_state_tolerance
+        self.iteration = 0
+        self.movement = movement
+
+        self.max_jail_term = max_jail_term
+        self.active_threshold_t = active_threshold_t
+        self.initial_legitimacy_l0 = initial_legitimacy_l0
+        self.legitimacy = initial_legitimacy_l0
+        self.k = k
+        self.graph_type = graph_type
+
+        self.agent_density = agent_density
+        self.agent_vision = agent_vision
+        self.active_agent_density = active_agent_density
+        self.cop_density = cop_density
+        self.cop_vision = cop_vision
+        self.inf_threshold = inf_threshold
+
+        self.jailings_list = [0, 0, 0, 0]
+        self.outbreaks = 0
+        self.outbreak_now = 0
+        self.outbreak_influencer_now = False
+        self.tackle_inf = tackle_inf
+        self._offsets_cache = {}
+
+        self.datacollector = ColumnarDataCollector(n_steps=self.max_iter + 2, model_reporters=self.get_model_reporters())
+
+        # ==============================
+        # === Initialize environment ===
+        # ==============================
+
+        if population is None:
+            self.generate_population(graph_type, p, p_ws, directed, population_seed)
+        else:
+            self.load_population(population)
+
+        # Citizen dynamic columns
+        self.hardship_cont = np.zeros(self.n_citizens)
+        self.hardship = np.array(self.hardship_endo)
+        self.threshold = np.where(self.enforced_active, 0., self.active_threshold_t)
+        self.state = np.where(self.enforced_active, State.ACTIVE.value, State.QUIESCENT.value).astype(np.int8)
+        self.jail_sentence = np.zeros(self.n_citizens, dtype=np.int64)
+        self.grievance = self.hardship * (1 - self.legitimacy)
+
+        # Grid
+        self.cell_agent = np.full(self.width * self.height, -1, dtype=np.int64)
+        self.cell_agent[self.citizen_pos] = np.arange(self.n_citizens)
+        self.cell_agent[self.cop_pos] = self.n_citizens + np.arange(self.n_cops)
+
+        # Social network
+        self.network_csr = NetworkCSR(self.indptr, self.indices, self.influence * self.expression_intensity,
+                                      self.state == State.ACTIVE.value, self.directed, **self.network_extra)
+
+        self.influencer = self.network_csr.degree > self.inf_threshold
+        self.influencer_list = list(np.flatnonzero(self.influencer))
+
+        self.running = True
+        self.datacollector.collect(self)
+
+    def generate_population(self, graph_type, p, p_ws, directed, population_seed):
+        """
+        Place agents randomly on the grid, draw their static attributes and generate the social network.
+        :param population_seed: random seed of the population, seed of the model if None
+        """
+        streams = self.streams if population_seed is None else AgentStreams(population_seed)
+        n_cells = self.width * self.height
+        draws = streams.uniforms(0, Draw.PLACEMENT, n_cells)
+        citizen_cells = np.flatnonzero(draws < self.agent_density + self.active_agent_density)
+        cop_cells = np.flatnonzero((draws >= self.agent_density + self.active_agent_density)
+                                   & (draws < self.agent_density + self.active_agent_density + self.cop_density))
+
+        self.n_citizens = len(citizen_cells)
+        self.n_cops = len(cop_cells)
+        self.citizen_pos = citizen_cells.astype(np.int64)
+        self.cop_pos = cop_cells.astype(np.int64)
+
+        # Citizen static columns
+        self.enforced_active = draws[citizen_cells] >= self.agent_density
+        self.hardship_endo = streams.uniforms(0, Draw.HARDSHIP, n_cells)[citizen_cells]
+        self.susceptibility = streams.uniforms(0, Draw.SUSCEPTIBILITY, n_cells)[citizen_cells]
+        self.influence = streams.uniforms(0, Draw.INFLUENCE, n_cells)[citizen_cells]
+        self.expression_intensity = streams.uniforms(0, Draw.EXPRESSION_INTENSITY, n_cells)[citizen_cells]
+        self.risk_aversion = streams.uniforms(0, Draw.RISK_AVERSION, n_cells)[citizen_cells]
+
+        edges = load_or_generate_edges(self.n_citizens, graph_type, p, p_ws, directed,
+                                       self.seed if population_seed is None else population_seed)
+        self.indptr, self.indices = edges_to_csr(edges, self.n_citizens, directed)
+        self.directed = directed
+        self.network_extra = {}
+
+    def reset(self, **params):
+        """
+        Reset the model in place for a new run instead of creating a new model (see simulation_executor).
+        Population and dynamic columns are rebuilt from the new parameters and seed, the neighborhood offsets are
+        reused if the grid size doesn't change.
+        :param params: parameters of the new run, same than __init__ (missing parameters take their default value)
+        """
+        shape, offsets = (self.width, self.height), self._offsets_cache
+        self.__init__(**params)
+        if (self.width, self.height) == shape:
+            self._offsets_cache = offsets
+
+    def load_population(self, population):
+        """
+        Load agents and social network from a shared population.
+        Static columns are read-only views on the shared memory, positions are copied since agents move.
+        """
+        arrays, meta = attach_population(population)
+        check_population(meta, self.width, self.height)
+
+        self.n_citizens = len(arrays['citizen_pos'])
+        self.n_cops = len(arrays['cop_pos'])
+        self.citizen_pos = arrays['citizen_pos'].copy()
+        self.cop_pos = arrays['cop_pos'].copy()
+
+        self.enforced_active = arrays['enforced_active']
+        self.hardship_endo = arrays['hardship_endo']
+        self.susceptibility = arrays['susceptibility']
+        self.influence = arrays['influence']
+        self.expression_intensity = arrays['expression_intensity']
+        self.risk_aversion = arrays['risk_aversion']
+
+        self.indptr, self.indices = arrays['indptr'], arrays['indices']
+        self.directed = meta['directed']
+        self.network_extra = {key: arrays[key] for key in ['rows', 'in_indptr', 'in_indices'] if key in arrays}
+
+    def export_population(self):
+        """
+        Initial population of the model, to be placed in shared memory (see SharedPopulation.create).
+        :return: dictionary of arrays and dictionary of meta values
+        """
+        arrays = {
+            'citizen_pos': self.citizen_pos, 'cop_pos': self.cop_pos, 'enforced_active': self.enforced_active,
+            'hardship_endo': self.hardship_endo, 'susceptibility': self.susceptibility,
+            'influence': self.influence, 'expression_intensity': self.expression_intensity,
+            'risk_aversion': self.risk_aversion,
+        }
+        arrays.update(self.network_csr.get_arrays())
+        meta = {'width': self.width, 'height': self.height, 'directed': self.network_csr.directed}
+        return arrays, meta
+
+    def step(self):
+        """
+        One step in agent-based model simulation
+        """
+
+        self.citizens_step()
+        self.cops_step()
+        self.schedule.steps += 1
+        self.schedule.time += 1
+        self.iteration += 1
+        self.update_legitimacy()
+
+        self.outbreak_score_monitoring()
+        steady = self.steady_state_window > 0 and \
+            steady_state_reached(self, self.steady_state_window, self.steady_state_tolerance)
+        self.datacollector.collect(self)
+
+        # Stop the model after a certain amount of iterations, or earlier once settled.
+        if self.iteration > self.max_iter or steady:
+            self.datacollector.pad(self.max_iter + 2)
+            self.running = False
+
+    def citizens_step(self):
+        """
+        Citizen agent rules (Epstein 2002 model) applied to every citizen at once.
+        """
+
+        # Jailed agent can't perform any action
+        # After sentence resets state and contagious hardship
+        jailed = self.jail_sentence > 0
+        self.jail_sentence[jailed] -= 1
+        released = np.flatnonzero(jailed & (self.jail_sentence == 0))
+        if released.size:
+            self.state[released] = State.QUIESCENT.value
+            self.hardship_cont[released] = 0
+            self.add_jailed(released)
+
+        acting = np.flatnonzero(~jailed)
+        if not acting.size:
+            return
+
+        pos = self.citizen_pos[acting]
+        new_state, targets = self.update_citizens(acting, self.get_received_hardship())
+        self.state[acting] = new_state
+
+        # Move agents in the 2D Grid
+        if self.movement:
+            self.move_agents(acting, pos, targets)
+
+    def update_citizens(self, acting, received):
+        """
+        Contagious hardship, activation rule and move target of the acting citizens, from the states of the previous
+        phase (new states are returned, not applied).
+        :param acting: index of the acting citizens
+        :param received: received contagious hardship of every citizen (see get_received_hardship)
+        :return: new state of the acting citizens, and their target cell (-1 if none, None without movement)
+        """
+        to_update = acting[self.hardship[acting] < 1]
+        self.hardship_cont[to_update] += received[to_update]
+        self.hardship[acting] = np.minimum(self.hardship_cont[acting] + self.hardship_endo[acting], 1)
+        self.grievance[acting] = self.hardship[acting] * (1 - self.legitimacy)
+
+        pos = self.citizen_pos[acting]
+        c_v = self.count_in_vision(pos, self.get_cop_layer(), self.agent_vision)
+        a_v = self.count_in_vision(pos, self.get_active_layer(), self.agent_vision)
+        cop_to_agent_ratio = np.floor_divide(c_v, a_v + 1)
+        net_risk = self.risk_aversion[acting] * (1 - np.exp(-1 * self.k * cop_to_agent_ratio))
+
+        rule_a = self.grievance[acting] - net_risk > self.threshold[acting]
+        new_state = np.where(rule_a, State.ACTIVE.value, State.QUIESCENT.value)
+
+        targets = None
+        if self.movement:
+            targets = self.sample_in_vision(pos, self.cell_agent == -1, self.agent_vision,
+                                            self.get_uniforms(Draw.MOVE)[acting])
+        return new_state, targets
+
+    def cops_step(self):
+        """
+        Cops inspect their vision and arrest a random active citizen, then move there.
+        Cops without active citizen in vision move to a random empty cell.
+        """
+        if not self.n_cops:
+            return
+
+        cops = np.arange(self.n_cops)
+        targets = self.choose_arrest_targets(cops)
+
+        # Two cops can target the same citizen, only the first one (in activation order) arrests it.
+        arresting = self.resolve_conflicts(self.n_citizens + cops, targets)
+
+        if arresting.size:
+            cells = targets[arresting]
+            arrestees = self.cell_agent[cells]
+            self.jail_sentence[arrestees] = self.draw_sentences(Draw.SENTENCE, arrestees)
+            self.state[arrestees] = State.JAILED.value
+            self.jailings_list[0] += arrestees.size
+            self.remove_agent_grid(arrestees)
+
+            if self.movement:
+                self.cell_agent[self.cop_pos[arresting]] = -1
+                self.cop_pos[arresting] = cells
+                self.cell_agent[cells] = self.n_citizens + arresting
+
+        # No active citizens, move to random empty cell
+        if self.movement:
+            idle = np.setdiff1d(cops, arresting, assume_unique=True)
+            pos = self.cop_pos[idle]
+            self.move_agents(self.n_citizens + idle, pos, self.choose_cop_moves(idle))
+
+    def choose_arrest_targets(self, cops):
+        """
+        Cell of an active citizen in the vision of every cop.
+        :param cops: index of the cops
+        :return: flat index of the target cells, -1 if there is no active citizen in vision
+        """
+        return self.sample_in_vision(self.cop_pos[cops], self.get_active_layer(), self.cop_vision,
+                                     self.get_uniforms(Draw.ARREST)[self.n_citizens + cops])
+
+    def choose_cop_moves(self, cops):
+        """
+        Empty cell in the vision of every cop.
+        :param cops: index of the cops
+        :return: flat index of the target cells, -1 if there is no empty cell in vision
+        """
+        return self.sample_in_vision(self.cop_pos[cops], self.cell_agent == -1, self.cop_vision,
+                                     self.get_uniforms(Draw.MOVE)[self.n_citizens + cops])
+
+    def get_received_hardship(self, hardship_params=HardshipConst):
+        """
+        Received contagious hardship of every citizen from its active network neighbors.
+        Sum over the CSR rows of the "active x influence x expression intensity" vector.
+        :param hardship_params: default values
+        :return: array of received hardship per citizen
+        """
+        distance = hardship_params.DISTANCE.value
+        timestep = hardship_params.TIME_STEP.value
+        transmission_rate = hardship_params.TRANSMISSION_RATE.value
+        hardship = hardship_params.HARDSHIP.value
+
+        self.network_csr.active = self.state == State.ACTIVE.value
+        self.network_csr.rebuild()
+
+        return hardship + distance * timestep * transmission_rate * self.network_csr.received * self.susceptibility
+
+    def get_offsets(self, radius):
+        """
+        Von Neumann neighborhood offsets of a given radius (center excluded), wrapped on the torus.
+        :param radius: vision radius
+        :return: arrays of x and y offsets
+        """
+        if radius not in self._offsets_cache:
+            self._offsets_cache[radius] = von_neumann_offsets(radius, self.width, self.height)
+        return self._offsets_cache[radius]
+
+    def neighbor_cells(self, x, y, dx, dy):
+        """
+        Flat index of the cells at offset (dx, dy) of the given coordinates.
+        """
+        return ((x + dx) % self.width) * self.height + (y + dy) % self.height
+
+    def count_in_vision(self, pos, layer, radius):
+        """
+        Sum a per-cell layer over the von Neumann neighborhood of every position.
+        Vision counts are computed for the whole grid at once (see vision.diamond_sum).
+        :param pos: flat positions
+        :param layer: per-cell values (flat grid)
+        :param radius: vision radius
+        """
+        grid_layer = layer.astype(np.int64).reshape(self.width, self.height)
+        return diamond_sum(grid_layer, radius).ravel()[pos]
+
+    def sample_in_vision(self, pos, layer, radius, draws):
+        """
+        Pick uniformly, for every position, a cell of its von Neumann neighborhood where layer is True.
+        Candidates are ranked in the order of the offsets, like VisionCounter.get_empty_cells.
+        :param pos: flat positions
+        :param layer: boolean per-cell mask (flat grid)
+        :param radius: vision radius
+        :param draws: uniform draw of every position
+        :return: flat index of the selected cells, -1 if there is no candidate
+        """
+        available = self.count_in_vision(pos, layer, radius)
+        rank = np.floor(draws * available).astype(np.int64)
+        chosen = np.full(len(pos), -1, dtype=np.int64)
+
+        x, y = np.divmod(pos, self.height)
+        seen = np.zeros(len(pos), dtype=np.int64)
+        for dx, dy in zip(*self.get_offsets(radius)):
+            cells = self.neighbor_cells(x, y, dx, dy)
+            hit = layer[cells]
+            select = hit & (seen == rank) & (chosen < 0)
+            chosen[select] = cells[select]
+            seen += hit
+
+        return chosen
+
+    def get_uniforms(self, draw):
+        """
+        Uniform draws of every agent (citizens then cops) for a purpose at the current step (see AgentStreams).
+        :param draw: purpose of the draw (see constant_variables.Draw)
+        """
+        return self.streams.uniforms(self.schedule.steps, draw, self.n_citizens + self.n_cops)
+
+    def draw_sentences(self, draw, citizens):
+        """
+        Jail sentences (uniform in 1..max_jail_term) of citizens.
+        """
+        return 1 + np.floor(self.get_uniforms(draw)[citizens] * self.max_jail_term).astype(np.int64)
+
+    def resolve_conflicts(self, agents, targets):
+        """
+        Agents targeting the same cell are resolved in activation order (ORDER draw, see StreamActivation).
+        :param agents: global index of the agents
+        :param targets: target of every agent, -1 if none
+        :return: indices (in agents) of the agents getting their target
+        """
+        candidates = np.flatnonzero(targets >= 0)
+        order = candidates[np.argsort(self.get_uniforms(Draw.ORDER)[agents[candidates]], kind='stable')]
+        _, first = np.unique(targets[order], return_index=True)
+        return order[first]
+
+    def move_agents(self, agents, pos, targets):
+        """
+        Move agents (global index, cops after citizens) to their target cell.
+        Agents targeting the same cell are resolved in activation order, the others stay in place.
+        """
+        movers = self.resolve_conflicts(agents, targets)
+
+        agents, pos, targets = agents[movers], pos[movers], targets[movers]
+        self.cell_agent[pos] = -1
+        self.cell_agent[targets] = agents
+
+        is_citizen = agents < self.n_citizens
+        self.citizen_pos[agents[is_citizen]] = targets[is_citizen]
+        self.cop_pos[agents[~is_citizen] - self.n_citizens] = targets[~is_citizen]
+
+    def get_cop_layer(self):
+        """
+        Per-cell flag of cops presence.
+        """
+        return self.cell_agent >= self.n_citizens
+
+    def get_active_layer(self):
+        """
+        Per-cell flag of active citizens presence (jailed citizens are not on the grid).
+        """
+        layer = np.zeros(self.width * self.height, dtype=bool)
+        on_grid = self.citizen_pos >= 0
+        layer[self.citizen_pos[on_grid]] = self.state[on_grid] == State.ACTIVE.value
+        return layer
+
+    def outbreak_score_monitoring(self):
+        active = self.count_type_citizens("ACTIVE")
+        if self.tackle_inf:
+            if active > 30 and not self.outbreak_influencer_now:
+                self.jail_influencer()
+                self.outbreak_influencer_now = True
+
+            if active < 30:
+                self.outbreak_influencer_now = False
+
+        # Count amount of outbreaks
+        if active > 50 and self.outbreak_now == 0:
+            self.outbreaks += 1  # Total number of outbreak
+            self.outbreak_now = 1  # Indicate if outbreak now
+
+        if active < 50:
+            self.outbreak_now = 0
+
+    def update_legitimacy(self):
+        """
+        Compute legitimacy (Epstein Working Paper 2001)
+        """
+        self.jailings_list[3] = self.jailings_list[2]
+        self.jailings_list[2] = self.jailings_list[1]
+        nb_active_and_quiescent = self.count_type_citizens("ACTIVE") + self.count_type_citizens("QUIESCENT")
+        self.jailings_list[1] = self.jailings_list[0] / nb_active_and_quiescent
+        self.jailings_list[0] = 0
+
+        sum_jailed = self.jailings_list[1] - self.jailings_list[2] ** 2 - self.jailings_list[3] ** 3
+        self.legitimacy = self.initial_legitimacy_l0 * (1 - sum_jailed)
+        if self.legitimacy <= 0:
+            self.legitimacy = 0
+
+    def get_model_reporters(self):
+        """
+        Dictionary of model reporter names and attributes/funcs, same than CivilViolenceModel.
+        """
+        return {"QUIESCENT": compute_quiescent,
+                "ACTIVE": compute_active,
+                "JAILED": compute_jailed,
+                "LEGITIMACY": compute_legitimacy,
+                "INFLUENCERS": compute_influencers,
+                "OUTBREAKS": compute_outbreaks,
+                "STOP_STEP": compute_stop_step}
+
+    def count_type_citizens(self, state_req):
+        """
+        Helper method to count citizens in a given state.
+        """
+        return int(np.count_nonzero(self.state == State[state_req].value))
+
+    def remove_agent_grid(self, citizens):
+        """
+        Removes citizens from the grid.
+        """
+        self.cell_agent[self.citizen_pos[citizens]] = -1
+        self.citizen_pos[citizens] = -1
+
+    def add_jailed(self, citizens):
+        """
+        Un-jail citizens
+        Place citizens whose sentence is over back on random empty cells in the grid.
+        """
+        empties = np.flatnonzero(self.cell_agent == -1)
+        if len(empties) < len(citizens):
+            raise Exception("There are no empty cells.")
+
+        # One at a time, in index order, each citizen takes a cell among the remaining sorted empty cells
+        citizens = np.sort(citizens)
+        cells = empties[draw_without_replacement(len(empties), self.get_uniforms(Draw.RELEASE)[citizens])]
+        self.citizen_pos[citizens] = cells
+        self.cell_agent[cells] = citizens
+
+    def jail_influencer(self):
+        """
+        Jail random citizens with the influencer tag.
+        """
+        if self.influencer_list:
+            n = len(self.influencer_list)
+            draws = self.get_uniforms(Draw.INFLUENCER)[:n]
+            picked = np.unique(np.asarray(self.influencer_list)[np.floor(draws * n).astype(np.int64)])
+            arrestees = picked[self.state[picked] != State.JAILED.value]
+            self.jail_sentence[arrestees] = self.draw_sentences(Draw.INFLUENCER_SENTENCE, arrestees)
+            self.state[arrestees] = State.JAILED.value
+            self.jailings_list[0] += arrestees.size
+            self.remove_agent_grid(arrestees)
@@ -0,0 +1,287 @@
+from bisect import bisect_right, insort
+import numpy as np
+
+
+def von_neumann_offsets(radius, width, height):
+    """
+    Von Neumann neighborhood offsets of a given radius on a torus, center excluded.
+    Offsets are wrapped on the torus and the ones reaching the same cell are counted once,
+    like mesa get_neighborhood method.
+
+    :param radius: vision radius
+    :param width: grid width
+    :param height: grid height
+    :return: arrays of x and y offsets (in [0, width) and [0, height))
+    """
+    dx, dy = np.meshgrid(np.arange(-radius, radius + 1), np.arange(-radius, radius + 1), indexing='ij')
+    keep = (np.abs(dx) + np.abs(dy) <= radius) & ((dx != 0) | (dy != 0))
+    wrapped = np.unique(np.stack([dx[keep] % width, dy[keep] % height], axis=1), axis=0)
+    return wrapped[:, 0], wrapped[:, 1]
+
+
+def diamond_sum(layer, radius):
+    """
+    Sum a per-cell layer over the von Neumann neighborhood (center excluded) of every cell of a torus.
+    The diamond is decomposed in 2 * radius + 1 column segments which sums are obtained from prefix sums
+    along y, so the cost is O(cells * radius) instead of O(cells * radius²).
+
+    :param layer: array of shape (width, height), or (..., width, height) for a stack of grids (replicates)
+    :param radius: vision radius
+    :return: array of the shape of layer
+    """
+    width, height = layer.shape[-2:]
+    total = np.zeros(layer.shape, dtype=layer.dtype)
+    if radius == 0:
+        return total
+
+    if 2 * radius + 1 > width or 2 * radius + 1 > height:
+        # The diamond overlaps itself on the torus, cells must be counted once.
+        for dx, dy in zip(*von_neumann_offsets(radius, width, height)):
+            total += np.roll(layer, (-dx, -dy), axis=(-2, -1))
+        return total
+
+    padded = np.concatenate([layer[..., -radius:], layer, layer[..., :radius]], axis=-1)
+    prefix = np.zeros(layer.shape[:-1] + (height + 2 * radius + 1,), dtype=layer.dtype)
+    np.cumsum(padded, axis=-1, out=prefix[..., 1:])
+
+    ys = np.arange(height) + radius
+    for dx in range(-radius, radius + 1):
+        half = radius - abs(dx)
+        segment = prefix[..., ys + half + 1] - prefix[..., ys - half]
+        total += np.roll(segment, -dx, axis=-2)
+
+    return total - layer
+
+
+
+def draw_without_replacement(n_items, uniforms):
+    """
+    Sequential draws without replacement among n_items sorted items: draw k takes the floor(u_k * (n_items - k))-th
+    of the items not drawn yet. Same picks than deleting every drawn item from the array of items, but the rank of a
+    pick in the whole array is found by bisection of the ranks already drawn: the cost of a draw depends on the
+    number of draws, not on n_items.
+
+    :param n_items: number of items (e.g. empty cells of a grid, in index order)
+    :param uniforms: uniform draws in [0, 1), one per pick, at most n_items
+    :return: array of the rank of every pick in the whole array of items
+    """
+    picked = []  # Ranks already drawn, sorted
+    ranks = np.empty(len(uniforms), dtype=np.int64)
+    for k, uniform in enumerate(np.asarray(uniforms).tolist()):
+        i = int(uniform * (n_items - k))
+        # Smallest rank with i items not drawn before it: fixed point of rank = i + number of drawn ranks <= rank
+        rank = i
+        while True:
+            shifted = i + bisect_right(picked, rank)
+            if shifted == rank:
+                break
+            rank = shifted
+        insort(picked, rank)
+        ranks[k] = rank
+    return ranks
+
+class CellSet:
+    """
+    Set of cells of a grid (flat index x * height + y) with O(1) insertion, removal, membership and draw.
+
+    Cells are stored in an array holding the members first, the position of every cell in this array is kept in a
+    position map. A removed member is swapped with the last member, an added cell with the first non-member.
+    """
+
+    def __init__(self, n_cells):
+        """
+        Create a set holding every cell of a grid.
+        :param n_cells: number of cells of the grid
+        """
+        self.n_cells = n_cells
+        self.fill()
+
+    def fill(self):
+        """
+        Put every cell in the set (in the order of their index).
+        """
+        self.cells = list(range(self.n_cells))
+        self.index = list(range(self.n_cells))
+        self.size = self.n_cells
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, cell):
+        return self.index[cell] < self.size
+
+    def _swap(self, cell, position):
+        """
+        Move cell to position, the cell at position taking its place.
+        """
+        other = self.cells[position]
+        current = self.index[cell]
+        self.cells[current], self.cells[position] = other, cell
+        self.index[other], self.index[cell] = current, position
+
+    def add(self, cell):
+        if self.index[cell] >= self.size:
+            self._swap(cell, self.size)
+            self.size += 1
+
+    def discard(self, cell):
+        if self.index[cell] < self.size:
+            self.size -= 1
+            self._swap(cell, self.size)
+
+    def draw(self, uniform):
+        """
+        Pick a member from a uniform draw in [0, 1).
+        :return: flat index of the cell
+        """
+        return self.cells[int(uniform * self.size)]
+
+
+class VisionCounter:
+    """
+    Grid-level counting service of cops and active citizens in vision.
+
+    Per-cell occupancy layers (cop count, active count, occupancy) are maintained along the simulation, as well as,
+    for every vision radius used by the model, the number of cops and active citizens in the von Neumann
+    neighborhood of every cell. Each change in the grid only updates the diamond around the modified cell,
+    so agents look up C_v and A_v in O(1) instead of scanning their neighborhood.
+    Empty cells are tracked by a bitmap (vacant), read by the agents to find the empty cells in their vision, and by
+    an indexed set (empty_cells) from which released citizens draw their cell in O(1).
+    """
+
+    def __init__(self, width, height, radii):
+        """
+        Create a new vision counter.
+        :param width: grid width
+        :param height: grid height
+        :param radii: vision radius used by the agents (citizens and cops)
+        """
+        self.width = width
+        self.height = height
+        self.radii = sorted(set(radii))
+        self.offsets = {r: von_neumann_offsets(r, width, height) for r in self.radii}
+
+        self.cops = np.zeros((width, height), dtype=np.int64)
+        self.actives = np.zeros((width, height), dtype=np.int64)
+        self.occupancy = np.zeros((width, height), dtype=np.int64)
+        self.vacant = np.ones((width, height), dtype=bool)
+        self.empty_cells = CellSet(width * height)
+
+        self.cops_in_vision = {r: np.zeros((width, height), dtype=np.int64) for r in self.radii}
+        self.actives_in_vision = {r: np.zeros((width, height), dtype=np.int64) for r in self.radii}
+
+    def clear(self):
+        """
+        Empty the grid (every layer and vision count set to zero).
+        """
+        for layer in [self.cops, self.actives, self.occupancy] + list(self.cops_in_vision.values()) + \
+                list(self.actives_in_vision.values()):
+            layer.fill(0)
+        self.vacant.fill(True)
+        self.empty_cells.fill()
+
+    def rebuild(self):
+        """
+        Recompute the vision counts of every cell from the occupancy layers.
+        """
+        for r in self.radii:
+            self.cops_in_vision[r] = diamond_sum(self.cops, r)
+            self.actives_in_vision[r] = diamond_sum(self.actives, r)
+
+    def get_diamond(self, pos, radius):
+        """
+        Coordinates of the cells in the von Neumann neighborhood of pos.
+        The neighborhood is symmetric: these are also the cells which have pos in their vision.
+        """
+        dx, dy = self.offsets[radius]
+        return (pos[0] + dx) % self.width, (pos[1] + dy) % self.height
+
+    def update(self, pos, cops=0, actives=0, propagate=True):
+        """
+        Add cops and/or active citizens (negative values to remove) to the cell pos.
+        :param pos: (x, y) coordinates of the cell
+        :param cops: variation of the number of cops
+        :param actives: variation of the number of active citizens
+        :param propagate: update vision counts of the surrounding cells. Set to False for bulk loading,
+            followed by a call to rebuild.
+        """
+        x, y = pos
+        self.cops[x, y] += cops
+        self.actives[x, y] += actives
+
+        if not propagate:
+            return
+
+        for r in self.radii:
+            cells = self.get_diamond(pos, r)
+            if cops:
+                self.cops_in_vision[r][cells] += cops
+            if actives:
+                self.actives_in_vision[r][cells] += actives
+
+    def place(self, pos, cops=0, actives=0, propagate=True):
+        """
+        An agent enters the cell pos.
+        """
+        self.occupancy[pos] += 1
+        if self.vacant[pos]:
+            self.vacant[pos] = False
+            self.empty_cells.discard(pos[0] * self.height + pos[1])
+        self.update(pos, cops, actives, propagate)
+
+    def remove(self, pos, cops=0, actives=0):
+        """
+        An agent leaves the cell pos.
+        """
+        self.occupancy[pos] -= 1
+        if self.occupancy[pos] == 0:
+            self.vacant[pos] = True
+            self.empty_cells.add(pos[0] * self.height + pos[1])
+        self.update(pos, -cops, -actives)
+
+    def move(self, pos, new_pos, cops=0, actives=0):
+        """
+        An agent moves from the cell pos to the cell new_pos.
+        """
+        self.remove(pos, cops, actives)
+        self.place(new_pos, cops, actives)
+
+    def count_cops(self, pos, radius):
+        """
+        Number of cops in the von Neumann neighborhood of pos (C_v)
+        """
+        return self.cops_in_vision[radius][pos]
+
+    def count_actives(self, pos, radius):
+        """
+        Number of active citizens in the von Neumann neighborhood of pos (A_v)
+        """
+        return self.actives_in_vision[radius][pos]
+
+    def get_empty_cells(self, pos, radius):
+        """
+        Empty cells in the von Neumann neighborhood of pos, in the order of the offsets (see von_neumann_offsets), the
+        order used by the vectorized engines to pick a cell from a draw.
+        :return: list of (x, y) coordinates
+        """
+        xs, ys = self.get_diamond(pos, radius)
+        empty = self.vacant[xs, ys]
+        return list(zip(xs[empty].tolist(), ys[empty].tolist()))
+
+    def get_active_cells(self, pos, radius):
+        """
+        Cells of active citizens in the von Neumann neighborhood of pos, in the order of the offsets.
+        :return: list of (x, y) coordinates
+        """
+        xs, ys = self.get_diamond(pos, radius)
+        active = self.actives[xs, ys] > 0
+        return list(zip(xs[active].tolist(), ys[active].tolist()))
+
+    def draw_empty_cell(self, uniform):
+        """
+        Pick an empty cell of the grid from a uniform draw in [0, 1) (see CellSet).
+        :return: (x, y) coordinates, None if the grid is full
+        """
+        if not self.empty_cells:
+            return None
+        return divmod(self.empty_cells.draw(uniform), self.height)